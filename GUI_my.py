@@ -10,32 +10,32 @@ Features:
 - visualization of selected channels in configurable graphs
 - settings can be set/loaded from file
 - can be controlled remotely via socket connection
+- external trigger mode, recording starts on a hardware edge
 - only 16 channel model 1608 was tested
 
 maybe:
-- implement trigger mode ? wait for digital signal to start recording ?
 - disable remote mode if no device is connected ?
 """
 
-import json
+import time
+IMPORT_START = time.perf_counter()  # for the startup timing report
+
 import logging
-import queue
-import shutil
 import sys
-import numpy as np
-from queue import Queue, Empty
+import threading
 
 from PyQt6.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
-from PyQt6.QtCore import Qt, QTimer
-from PyQt6 import uic, QtGui
-import pyqtgraph as pg
+from PyQt6.QtCore import QTimer, pyqtSignal
+from PyQt6 import QtGui
 
 from pathlib import Path
-from datetime import datetime
 
 from MCC_Board_linux import MCCBoard
-from GUI_utils import MCC_settings, PlotWindowEnum, COLOR_PALETTE, MAX_GRAPHS, RemoteConnDialog
-from socket_utils import SocketComm, MessageType, SocketMessage
+from board_process import MCCBoardProcess
+from GUI_utils import MCC_settings, PlotWindowEnum, MAX_GRAPHS, RemoteConnDialog, digital_bit_to_level, load_ui
+from settings_utils import COLOR_PALETTE
+from socket_utils import ControlServer, SocketMessage
+from control_utils import RemoteControl
 
 #from datastructure_tools.DataJoint.schemas.beh_flex import NAME_OF_BEHBLOCK
 # TODO fix this import !
@@ -46,29 +46,37 @@ log.setLevel(logging.DEBUG)
 
 VERSION = "0.5.0"
 UPDATE_GRAPHS_TIME = 100  # ms
+DEVICE_RESCAN_TIME = 2000  # ms between scans for plugged in devices while none is connected
 COUNTER_UPDATE_TIME = 1000  # ms
+TTL_PLOT_LEVEL = 5  # V, digital lines are plotted like TTL signals on the analog channels
 HOST = "localhost"  # if connecting to remote, use the IP of the current machine
 PORT = 8800
+TRANSFER_PORT = 8802  # data connection for transfer_files and read_range
 ENABLE_REMOTE = True
-DAQ_FOLDER = 'daq'
+ACQUISITION_PROCESS = False  # run the acquisition in a child process, plotting load can not cause overruns
+
+class MCC_GUI(QMainWindow, RemoteControl):
+    # remote commands arrive on the thread of the control server
+    remote_message_received = pyqtSignal(dict, int)
+    # device discovery and connection run in a background thread
+    devices_scanned = pyqtSignal(list)
+    device_connected = pyqtSignal(bool)
 
-class MCC_GUI(QMainWindow):
     def __init__(self):
         super(MCC_GUI, self).__init__()
-        self.session_path = None
-        self.files_copied = False
         self.is_remote_ctr = False
         self.counter_timer = None
         self.rec_timer = None
         self.plot_timer = None
+        self.last_scan_values = None
         self.path2file = Path(__file__)
-        uic.loadUi(self.path2file.parent / 'GUI' / 'GUI.ui', self)
+        load_ui(self.path2file.parent / 'GUI' / 'GUI.ui', self)
         self.setWindowTitle('MCCRecorder v.%s' % VERSION)
 
         self.log = logging.getLogger('GUI')
         self.log.setLevel(logging.DEBUG)
         self.daq_device = None
-        self.mcc_board = MCCBoard()
+        self.mcc_board = MCCBoardProcess() if ACQUISITION_PROCESS else MCCBoard()
         self.ConnectButton.setIcon(QtGui.QIcon("GUI/icons/connect.svg"))
         self.RUNButton.setIcon(QtGui.QIcon("GUI/icons/play.svg"))
         self.RECButton.setIcon(QtGui.QIcon("GUI/icons/record.svg"))
@@ -79,8 +87,10 @@ class MCC_GUI(QMainWindow):
         self.tabWidget.setTabIcon(3, QtGui.QIcon("GUI/icons/Window.svg"))
         self.tabWidget.setTabIcon(4, QtGui.QIcon("GUI/icons/Window.svg"))
         self.settings = MCC_settings()
+        self.setup_remote_control(HOST, TRANSFER_PORT)
         if ENABLE_REMOTE:
-            self.socket_comm = SocketComm(type='server', host=HOST, port=PORT)
+            self.socket_comm = ControlServer(host=HOST, port=PORT, on_message=self.remote_message_received.emit)
+            self.remote_message_received.connect(self.handle_remote_message)
         else:  # disable remote mode
             self.socket_comm = None
             self.RemoteModeButton.setEnabled(False)
@@ -121,6 +131,10 @@ class MCC_GUI(QMainWindow):
         self.Channel_viewWidget_1.idx = 0
         self.Channel_viewWidget_2.idx = 1
         self.Channel_viewWidget_3.idx = 2
+        self.device_thread = None
+        self.devices = []
+        self.device_timer = QTimer()
+        self.device_timer.timeout.connect(self.rescan_devices)
 
         self.ConnectSignals()
         for ele in self.channel_win:
@@ -129,15 +143,51 @@ class MCC_GUI(QMainWindow):
             ele.setCurrentIndex(0)
         # self.tabWidget.setTabVisible(1, False)
 
-        self.scan_devices()
         self.load_settings_fromfile('MCC_settings_default.json')
+        self.scan_devices()
+        self.device_timer.start(DEVICE_RESCAN_TIME)
     ### DAQ Board interaction
+    @property
+    def device_job_running(self) -> bool:
+        return self.device_thread is not None and self.device_thread.is_alive()
+
+    def run_in_device_thread(self, target) -> bool:
+        """
+        USB enumeration and connecting can take seconds, so they do not block the window. The board is not
+        touched from the window while a job runs, the job sends its result with a signal
+        """
+        if self.device_job_running:
+            return False
+        self.device_thread = threading.Thread(target=target, daemon=True)
+        self.device_thread.start()
+        return True
+
     def scan_devices(self):
         """
-        calls the MCCBoard class to scan available devices and displays them in dropdown
+        calls the MCCBoard class to scan available devices in the background, show_devices displays them
         """
+        def scan():
+            try:
+                self.devices_scanned.emit(self.mcc_board.scan_devices())
+            except Exception:
+                self.log.exception('Scanning for devices failed')
+
+        self.run_in_device_thread(scan)
+
+    def rescan_devices(self):
+        """scans again while no device is connected, a device plugged in later is found (and connected)"""
+        if self.device_job_running:  # the board state changes meanwhile, reading it would wait for the job
+            return
+        if not self.mcc_board.is_connected and not self.mcc_board.is_recording and not self.mcc_board.is_viewing:
+            self.scan_devices()
+
+    def show_devices(self, devices: list):
+        if devices == self.devices:
+            return
+        if not self.devices:
+            self.log.info(f'Found {len(devices)} device(s) {time.perf_counter() - IMPORT_START:0.3f} s after start')
+        self.devices = devices
         self.Device_dropdown.clear()
-        devices = self.mcc_board.scan_devices()
         if devices:  # found devices
             self.Device_dropdown.addItems(devices)
             self.ConnectButton.setEnabled(True)
@@ -149,16 +199,31 @@ class MCC_GUI(QMainWindow):
 
     def connect_to_device(self):
         """
-        calls the MCCBoard class to connect to chosen device
+        calls the MCCBoard class to connect to chosen device in the background, show_connection updates the window
         """
         idx = self.Device_dropdown.currentIndex()
-        self.mcc_board.connect_to_device(idx)
-        self.mcc_board.reset_counters()
+
+        def connect():
+            try:
+                self.mcc_board.connect_to_device(idx)
+                self.mcc_board.reset_counters()
+            except Exception:
+                self.log.exception(f'Connecting to device {idx} failed')
+            self.device_connected.emit(self.mcc_board.is_connected)
+
         self.log.debug(f'Connecting to {idx} device')
+        if self.run_in_device_thread(connect):
+            self.ConnectButton.setEnabled(False)
+
+    def show_connection(self, is_connected: bool):
+        if not is_connected:
+            self.ConnectButton.setEnabled(bool(self.devices))
+            return
+        self.log.info(f'Connected {time.perf_counter() - IMPORT_START:0.3f} s after start')
         if self.mcc_board.ai_ranges:
             self.Range_combo.clear()
             self.Range_combo.addItems(self.mcc_board.ai_ranges)
-        if self.mcc_board.is_connected:
+        if is_connected:
             self.ConnectButton.setEnabled(False)
             self.RUNButton.setEnabled(True)
             self.RECButton.setEnabled(True)
@@ -173,13 +238,29 @@ class MCC_GUI(QMainWindow):
             self.set_settings()
         self.ScanDevButton.setEnabled(False)
 
+    def start_board(self, start) -> bool:
+        """
+        starts viewing or recording with the current settings, a configuration the board can not scan is shown
+        to the user. Remote commands get the error as reply
+        """
+        try:
+            start(self.settings)
+        except RuntimeError as e:
+            self.log.error(f"Can not start the scan: {e}")
+            if self.is_remote_ctr:
+                raise
+            QMessageBox.warning(self, 'Can not start the scan', str(e))
+            return False
+        return True
+
     def run_daq(self):
         """
         calls the MCCBoard class to start acquiring data, visualize the data
         """
         self.get_settings()
         self.mcc_board.reset_counters()
-        self.mcc_board.start_viewing(self.settings)
+        if not self.start_board(self.mcc_board.start_viewing):
+            return
 
         self.reset_plots()
         self.recording_Info.setText('Viewing')
@@ -197,7 +278,8 @@ class MCC_GUI(QMainWindow):
             self.counter_timer.start(COUNTER_UPDATE_TIME)
 
         self.RUNButton.setEnabled(False)
-        self.RECButton.setEnabled(False)
+        # recording can be started from viewing, keeping the recent history
+        self.RECButton.setEnabled(not self.is_remote_ctr)
 
         self.STOPButton.setEnabled(True)
         self.tabWidget.setCurrentIndex(2)
@@ -205,16 +287,28 @@ class MCC_GUI(QMainWindow):
 
     def record_daq(self):
         """
-        calls the MCCBoard class to start recording the chosen data
+        calls the MCCBoard class to start recording the chosen data,
+        a running viewing scan is recorded without restarting it if the settings allow, otherwise it is stopped
+        first and its recent history is written in front of the recording
         """
         self.get_settings()
+        if self.mcc_board.is_viewing:
+            if self.mcc_board.attach_recording(self.settings):
+                self.files_copied = False
+                self.recording_Info.setText('ON')
+                self.s_since_start = 0
+                self.RECButton.setEnabled(False)
+                self.CounterScanButton.setEnabled(False)
+                return
+            self.stop_daq()
         self.files_copied = False
         self.mcc_board.reset_counters()
-        self.mcc_board.start_recording(self.settings)
+        if not self.start_board(self.mcc_board.start_recording):
+            return
 
         # self.timer = pg.QtCore.QTimer()
         self.reset_plots()
-        self.recording_Info.setText('ON')
+        self.recording_Info.setText('ARMED' if self.mcc_board.is_armed else 'ON')
         self.plot_timer = QTimer()
         self.plot_timer.timeout.connect(self.update_plots)
         self.plot_timer.start(UPDATE_GRAPHS_TIME)
@@ -264,10 +358,16 @@ class MCC_GUI(QMainWindow):
 
     def get_counter_vals(self):
         """
-        polls mcc board for the counters status
-        display available counter values
+        display available counter values, these are taken from the scanned data if the counters are sampled
+        together with the analog channels, otherwise polls mcc board for the counters status
         """
-        counter_vals = self.mcc_board.get_single_counter()
+        is_scanning = self.mcc_board.is_recording or self.mcc_board.is_viewing
+        if is_scanning and self.mcc_board.counter_channels:
+            if self.last_scan_values is None:
+                return
+            counter_vals = [int(self.last_scan_values[column]) for column in self.mcc_board.counter_columns]
+        else:
+            counter_vals = self.mcc_board.get_single_counter()
         for val, display in zip(counter_vals, [self.counterDisplay_1, self.counterDisplay_2]):
             display.display(val)
 
@@ -286,6 +386,7 @@ class MCC_GUI(QMainWindow):
 
     #### PLOTTING ######
     def reset_plots(self):
+        self.last_scan_values = None
         self.plotting_widgets = []
         plotting_indx = []
         for multi_view_graph in [self.Channel_viewWidget_1, self.Channel_viewWidget_2, self.Channel_viewWidget_3]:
@@ -300,39 +401,42 @@ class MCC_GUI(QMainWindow):
             except AttributeError: # no graphs here
                 continue
             index_vec = []
-            for ch_id, channel in enumerate(self.settings.channel_list):
+            for channel in self.settings.channel_list:
                 if channel['win'] == win_id and channel['active']:
-                    index_vec.append(ch_id)
+                    # data arrives in scan order, which only holds the active channels
+                    # digital lines are a bit of the scanned port column
+                    scan_index = self.mcc_board.get_scan_index(channel['id'])
+                    if scan_index is not None:
+                        index_vec.append((scan_index, self.mcc_board.get_channel_bit(channel['id'])))
             self.plotting_indexing_vec.append(index_vec)
 
     def update_plots(self):
-        # analyze the perfect size for this update ? changing from 100 to 500 seemed to improve a lot.
-        value_array = np.zeros((self.settings.num_channels, 500))
-        array_step = 0
-        for array_step in range(500):
-            try:
-                for q_id, queue in enumerate(self.mcc_board.data_queues):
-                    value_array[q_id, array_step] = queue.get(False)
-            except Empty:
-                break
-        if array_step == 500:
-            self.log.warning('queue is not being emptied fast enough !')
-        value_array = value_array[:, :array_step]
+        value_array = self.mcc_board.get_new_data()  # everything since the last tick, reused by the next call
 
         if value_array.shape[1] == 0:  # no new data was acquired between calls
             return
+        self.last_scan_values = value_array[:, -1].copy()
 
+        # only plots on the visible tab are drawn, the others just keep their histories
+        render = not self.isMinimized()
         for plot_widget, index_vec in zip(self.plotting_widgets, self.plotting_indexing_vec):
             if index_vec:
-                plot_widget.update_new([value_array[index, :] for index in index_vec])
+                plot_widget.update_new([value_array[index, :] if bit is None else
+                                        digital_bit_to_level(value_array[index, :], bit, TTL_PLOT_LEVEL)
+                                        for index, bit in index_vec], render=render)
 
-        self.statusbar.showMessage(f"In Q :{self.mcc_board.data_queues[0].qsize()}")
+        self.statusbar.showMessage(f"In Q :{self.mcc_board.get_backlog()}")
         # todo indicate the lag ?
 
     def increase_time(self):
         """
-        counts the recording time up each second and displays it
+        counts the recording time up each second and displays it, starts counting once a trigger arrived
         """
+        if self.mcc_board.is_armed:
+            return
+        if self.recording_Info.text() == 'ARMED':
+            self.recording_Info.setText('ON')
+            self.push_status()
         self.s_since_start = self.s_since_start + 1
         self.timer_info.setText(f'{int(self.s_since_start / 60):02d}:{self.s_since_start % 60:02d}')
 
@@ -355,6 +459,9 @@ class MCC_GUI(QMainWindow):
         self.set_settings()
 
     def get_settings(self):
+        # digital line mappings are only set in the settings file, keep them
+        digital_mapping = {channel['id']: {key: channel[key] for key in ('source', 'bit') if key in channel}
+                           for channel in self.settings.channel_list}
         self.settings.channel_list = list()
         for ch_id, (ch_name, ch_rec, ch_win) in enumerate(zip(self.channel_names, self.channel_rec, self.channel_win)):
             # if not ch_name.isEnabled():  # skip inactvated channels
@@ -368,6 +475,7 @@ class MCC_GUI(QMainWindow):
             channel_dict['active'] = ch_rec.isChecked()
             channel_dict['win'] = PlotWindowEnum[ch_win.currentText()].value
             channel_dict['color'] = COLOR_PALETTE[ch_id]
+            channel_dict.update(digital_mapping.get(ch_id, {}))
             self.settings.channel_list.append(channel_dict)
 
         self.settings.voltage_range = self.Range_combo.currentText()
@@ -385,6 +493,7 @@ class MCC_GUI(QMainWindow):
         self.settings.add_graphsettings(self.Graph_setting_3.get_current_settings())
 
         self.settings.scan_counters = self.Counters_checkBox.isChecked()
+        self.settings.trigger_mode = self.Trigger_checkBox.isChecked()
         self.settings.pulse_rate = self.PulsesSpin.value()
 
     def set_settings(self):
@@ -410,6 +519,7 @@ class MCC_GUI(QMainWindow):
         self.set_nr_graths()
 
         self.Counters_checkBox.setChecked(self.settings.scan_counters)
+        self.Trigger_checkBox.setChecked(self.settings.trigger_mode)
         self.PulsesSpin.setValue(self.settings.pulse_rate)
         #self.settings.
     def set_graph_options(self):
@@ -458,6 +568,16 @@ class MCC_GUI(QMainWindow):
 
         self.RemoteModeButton.clicked.connect(self.remote_mode)
 
+        self.devices_scanned.connect(self.show_devices)
+        self.device_connected.connect(self.show_connection)
+        for multi_view_graph in [self.Channel_viewWidget_1, self.Channel_viewWidget_2, self.Channel_viewWidget_3]:
+            multi_view_graph.plots_created.connect(self.plots_created)
+
+    def plots_created(self):
+        """the graphs of a viewer are created when its tab is shown first, a running scan is plotted there too"""
+        if self.mcc_board.is_recording or self.mcc_board.is_viewing:
+            self.reset_plots()
+
     def adjust_viewer1(self):
         self.Graph_setting_1.nr_of_graphs = int(self.Viewer1_Combo.currentText())
         self.Channel_viewWidget_1.nr_plots = int(self.Viewer1_Combo.currentText())
@@ -504,129 +624,37 @@ class MCC_GUI(QMainWindow):
         self.tabWidget.setTabEnabled(1, False)
         self.tabWidget.setTabEnabled(0, False)
         self.tabWidget.setCurrentIndex(2)
-        self.remote_message_timer = QTimer()
-        self.remote_message_timer.timeout.connect(self.check_and_parse_messages)
-        self.remote_message_timer.start(500)
         self.is_remote_ctr = True
         self.socket_comm.send_json_message(SocketMessage.status_ready)
+        self.push_status()
 
     def exit_remote_mode(self):
         self.socket_comm.close_socket()
         self.Client_label.setText("disconnected")
         self.RemoteModeButton.setText("ENTER\nREMOTE-mode")
-        if self.remote_message_timer:
-            self.remote_message_timer.stop()
-            self.remote_message_timer = None
         self.is_remote_ctr = False
         self.RUNButton.setEnabled(True)
         self.RECButton.setEnabled(True)
         self.tabWidget.setTabEnabled(1, True)
         self.tabWidget.setTabEnabled(0, True)
 
-    def check_and_parse_messages(self):
-        message = self.socket_comm.read_json_message_fast_linebreak()
-        if message:
-            # parse message
-            print(message)
-            if message['type'] == MessageType.start_daq.value \
-                    or message['type'] == MessageType.start_daq_viewing.value:
-                if self.mcc_board.is_recording or self.mcc_board.is_viewing:  # got record but we already are !
-                    self.socket_comm.send_json_message(SocketMessage.status_error)
-                    self.log.info("got message to start, but something is already running!")
-                    return
-
-                try:
-                    if message["setting_file"]:
-                        self.load_settings_fromfile(message["setting_file"])
-                        self.log.debug(f"loaded settings from {message['setting_file']}")
-                except (FileNotFoundError, KeyError):
-                    self.log.error("passed settings file not found")
-
-                self.settings.session_name = message["session_id"]
-                self.session_label.setText(self.settings.session_name)
-                self.remote_message_timer.setInterval(5000)  # increase the interval to 10s
-
-                if message['type'] == MessageType.start_daq.value:
-                    self.log.info("got message to start recording")
-                    self.record_daq()
-                    self.socket_comm.send_json_message(SocketMessage.respond_recording)
-                elif message['type'] == MessageType.start_daq_viewing.value:
-                    self.log.info("got message to start viewing")
-                    self.run_daq()
-                    self.socket_comm.send_json_message(SocketMessage.respond_viewing)
-
-            elif message['type'] == MessageType.stop_daq.value:
-                if not self.mcc_board.is_recording or not self.mcc_board.is_viewing:
-                    self.log.info("got message to stop")
-                    self.stop_daq()
-                    self.remote_message_timer.setInterval(500)
-                    self.socket_comm.send_json_message(SocketMessage.respond_stop)
-                else:
-                    self.log.info("got message to stop, but nothing is running")
-                    self.socket_comm.send_json_message(SocketMessage.status_error)
-
-            elif message['type'] == MessageType.start_daq_pulses.value:
-                if not self.mcc_board.is_pulsing:
-                    try:
-                        self.PulsesSpin.setValue(message['fps'])
-                    except KeyError:
-                        pass
-                    self.start_stop_pulses(lag=message['pulse_lag'])
-                    self.socket_comm.send_json_message(SocketMessage.respond_pulsing)
-                else:
-                    self.log.info("got message to start pulsing, but already are!")
-                    self.socket_comm.send_json_message(SocketMessage.status_error)
-
-            elif message['type'] == MessageType.stop_daq_pulses.value:
-                self.start_stop_pulses()
-                self.socket_comm.send_json_message(SocketMessage.respond_stop)
-
-            elif message['type'] == MessageType.poll_status.value:
-                if self.mcc_board.is_recording:
-                    self.socket_comm.send_json_message(SocketMessage.status_recording)
-                elif self.mcc_board.is_viewing:
-                    self.socket_comm.send_json_message(SocketMessage.status_viewing)
-                elif self.is_remote_ctr:
-                    self.socket_comm.send_json_message(SocketMessage.status_ready)
-                else:
-                    self.socket_comm.send_json_message(SocketMessage.status_error)
-
-            elif message['type'] == MessageType.disconnected.value:
-                self.log.info("got message that client disconnected")
-                self.exit_remote_mode()
-
-            elif message['type'] == MessageType.copy_files.value:
-                self.log.debug('got message to copy files')
-                self.session_path = message['session_path']
-                if self.session_path:
-                    self.copy_recorded_file()
-
-            elif message['type'] == MessageType.purge_files.value:
-                self.log.debug('got message to purge files')
-                self.purge_recorded_file()
-
-    def purge_recorded_file(self):
-        #TODO add a check that this is the current file ?
-        self.log.info(f"Deleting file {self.mcc_board.file_name}")
-        try:
-            Path(self.mcc_board.file_name).unlink()
-        except FileNotFoundError:
-            self.log.warning(f"File {self.mcc_board.file_name} doesnt not exist")
+    ### remote control hooks, the commands are handled by RemoteControl
+    def is_remote_ready(self) -> bool:
+        return self.is_remote_ctr
 
-    def copy_recorded_file(self):
-        self.log.info(f"Copying file {self.mcc_board.file_name} to {Path(self.session_path) / DAQ_FOLDER }")
-        if not self.mcc_board.is_recording and not self.files_copied:
-            try:
-                if "MusterMaus" in self.settings.session_name:
-                    shutil.copyfile(self.mcc_board.file_name, Path(self.session_path) / self.mcc_board.file_name.name)
-                else:
-                    shutil.copyfile(self.mcc_board.file_name, Path(self.session_path) / DAQ_FOLDER /
-                                    self.mcc_board.file_name.name)
-            except (FileNotFoundError, IOError):
-                self.socket_comm.send_json_message(SocketMessage.respond_copy_fail)
-                return
-            self.files_copied = True
-            self.socket_comm.send_json_message(SocketMessage.respond_copy)
+    def set_trigger_mode(self, trigger_mode: bool):
+        self.Trigger_checkBox.setChecked(trigger_mode)
+
+    def set_session_name(self, session_name: str):
+        self.settings.session_name = session_name
+        self.session_label.setText(session_name)
+
+    def set_pulse_rate(self, pulse_rate: int):
+        self.PulsesSpin.setValue(pulse_rate)
+
+    def client_disconnected(self):
+        self.log.info("got message that client disconnected")
+        self.exit_remote_mode()
 
     def check_connection(self):
         if self.socket_comm.connected:
@@ -638,10 +666,13 @@ class MCC_GUI(QMainWindow):
     def app_is_exiting(self):
         if self.socket_comm:
             self.socket_comm.close_socket()
+        self.stop_file_services()
         if self.mcc_board.is_recording or self.mcc_board.is_viewing:
             self.mcc_board.stop_recording()
-        if self.mcc_board.daq_device:
+        if self.mcc_board.is_connected:
             self.mcc_board.release_device()
+        if isinstance(self.mcc_board, MCCBoardProcess):
+            self.mcc_board.close()
 
     def closeEvent(self, event):
         self.log.info("Received window close event.")
@@ -664,12 +695,23 @@ class MCC_GUI(QMainWindow):
 
 
 def start_gui():
+    t_imported = time.perf_counter()
     app = QApplication([])
+    t_app = time.perf_counter()
     win = MCC_GUI()
+    t_window = time.perf_counter()
     win.show()
+    app.processEvents()
+    t_shown = time.perf_counter()
+    print(f"Startup timing: imports {t_imported - IMPORT_START:0.3f} s, QApplication {t_app - t_imported:0.3f} s, "
+          f"window {t_window - t_app:0.3f} s, shown {t_shown - t_window:0.3f} s, total {t_shown - IMPORT_START:0.3f} s")
     app.exec()
 
 
 if __name__ == '__main__':
     logging.info('Starting via __main__')
+    if '--compile-ui' in sys.argv:  # e.g. after installing or editing the .ui file
+        from GUI_utils import compile_ui
+        print(compile_ui(Path(__file__).parent / 'GUI' / 'GUI.ui'))
+        sys.exit()
     sys.exit(start_gui())
@@ -1,12 +1,11 @@
-import copy
 from pathlib import Path
+import importlib.util
 import json
-import datetime
-from PyQt6 import QtWidgets, QtCore, QtGui
+from PyQt6 import QtWidgets, QtCore, QtGui, uic
+from recording_utils import (fit_clock_table, get_channel_names, get_manifest_name, read_clock_table,
+                             read_trailer, unwrap_counter)
+from settings_utils import MCC_settings, is_valid_bit
 
-COLOR_PALETTE = ['#023eff', '#ff7c00', '#1ac938', '#e8000b', '#8b2be2', '#9f4800', '#f14cc1', '#a3a3a3', '#ffc400',
-                 '#00d7ff', '#023eff', '#ff7c00', '#1ac938', '#e8000b', '#8b2be2', '#9f4800']
-# 'bright' from seaborn
 from enum import IntEnum, Enum, unique
 
 MAX_GRAPHS = 4
@@ -168,6 +167,53 @@ class GraphSettings(QtWidgets.QWidget):
             # self.created_elements.append(label_yr)
 
 
+def digital_bit_to_level(port_values, bit: int, high_level: float = 1.0):
+    """extracts a single TTL line from the packed port values of a digital scan"""
+    import numpy as np
+    return ((np.asarray(port_values).astype(np.int64) >> bit) & 1) * high_level
+
+
+def encoder_to_position(counts, counts_per_rev: int, sampling_rate: float, bits: int = 32):
+    """
+    converts scanned encoder counts into a continuous angle in degrees and the angular velocity in degree/s
+    """
+    import numpy as np
+    position = unwrap_counter(counts, bits) * (360 / counts_per_rev)
+    if position.size < 2:
+        return position, np.zeros_like(position)
+    velocity = np.gradient(position) * sampling_rate
+    return position, velocity
+
+
+def compile_ui(ui_file: (str, Path)) -> Path:
+    """compiles a Qt Designer file to GUI/ui_<name>.py, only if the .ui file changed since the last time"""
+    ui_file = Path(ui_file)
+    py_file = ui_file.with_name(f"ui_{ui_file.stem}.py")
+    if not py_file.exists() or py_file.stat().st_mtime < ui_file.stat().st_mtime:
+        with open(ui_file, 'r') as ui_fi, open(py_file, 'w') as py_fi:
+            uic.compileUi(ui_fi, py_fi)
+    return py_file
+
+
+def load_ui(ui_file: (str, Path), widget):
+    """
+    sets up the widget from a Qt Designer file via its compiled module, which is much faster than
+    parsing the xml with uic.loadUi at every start. Falls back to loadUi if the module can not be written
+    """
+    try:
+        py_file = compile_ui(ui_file)
+    except OSError:
+        return uic.loadUi(ui_file, widget)
+    spec = importlib.util.spec_from_file_location(py_file.stem, py_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    ui_class = next(getattr(module, name) for name in dir(module) if name.startswith('Ui_'))
+    ui = ui_class()
+    ui.setupUi(widget)
+    widget.__dict__.update(vars(ui))  # the child widgets become attributes of the widget, like with loadUi
+    return widget
+
+
 class MyBinaryFile_Reader:
     def __init__(self, file_name):
         self.rec_duration = None
@@ -180,119 +226,105 @@ class MyBinaryFile_Reader:
         self.num_channels = None
         self.data = None
         self.header = None
+        self.manifest = None
+        self.clock_table = None  # rows of (sample, time.monotonic_ns, time.time_ns)
+        self.clock_fit = None
         self.read_file()
         self.make_fields_toproperties()
 
     def process_header(self):
         self.num_channels = self.header['num_channels']
-        self.channel_names = [channel['name'] for channel in self.header['channel_list']]
+        self.channel_names = get_channel_names(self.header)
         self.voltage_range = self.header['voltage_range']
         self.device = self.header['device']
         self.sampling_rate = self.header['sampling_rate']
 
-    def read_file(self):
+    @staticmethod
+    def read_segment(file_name) -> tuple:
+        """returns the header, the flat data and the trailer of a single binary file"""
         import numpy as np
-        with open(self.file_name, 'rb') as fi:
+        with open(file_name, 'rb') as fi:
+            trailer, data_end = read_trailer(fi)
+            fi.seek(0)
             header_length = int.from_bytes(fi.read(16), 'little')
-            self.header = json.loads(fi.read(header_length).decode('utf-8'))
+            header = json.loads(fi.read(header_length).decode('utf-8'))
             # print(struct.unpack('f',fi.read(4)))
-            self.process_header()
-            data = np.fromfile(fi, float)
-            len_remainder = len(data) % self.num_channels
-            if len_remainder != 0:
-                print('Data length is not multiple of channel count !! Cropping..')
-                data = data[:-len_remainder]
-            self.data = np.reshape(data, (-1, self.num_channels))
-            self.rec_duration = self.data.shape[0] / self.sampling_rate
+            data = np.fromfile(fi, float, count=(data_end - fi.tell()) // 8)
+        return header, data, trailer
+
+    def read_file(self):
+        """reads a recording, a segmented one is read via its manifest as one continuous recording"""
+        import numpy as np
+        manifest_name = Path(self.file_name)
+        if not manifest_name.name.endswith('.manifest.json'):
+            manifest_name = get_manifest_name(self.file_name)
+        if manifest_name.exists():
+            with open(manifest_name, 'r') as fi:
+                self.manifest = json.load(fi)
+            first_segment = manifest_name.parent / self.manifest['segments'][0]['file_name']
+            segments = [self.read_segment(manifest_name.parent / segment['file_name'])
+                        for segment in self.manifest['segments']]
+            self.header = segments[0][0]
+            data = np.concatenate([segment_data for _, segment_data, _ in segments])
+            trailers = [trailer for _, _, trailer in segments]
+        else:
+            first_segment = self.file_name
+            self.header, data, trailer = self.read_segment(self.file_name)
+            trailers = [trailer]
+        clock_table = [point for trailer in trailers for point in trailer.get('clock_table', [])]
+        if not all(trailers):
+            # a segment which was not closed has no trailer, its clock points are only in the clock file
+            try:
+                clock_table = read_clock_table(first_segment)
+            except FileNotFoundError:
+                pass
+        self.clock_table = np.array(clock_table, dtype=np.int64).reshape(-1, 3)
+        self.process_header()
+        len_remainder = len(data) % self.num_channels
+        if len_remainder != 0:
+            print('Data length is not multiple of channel count !! Cropping..')
+            data = data[:-len_remainder]
+        self.data = np.reshape(data, (-1, self.num_channels))
+        self.rec_duration = self.data.shape[0] / self.sampling_rate
+
+    def fit_clock(self) -> dict:
+        """fits the wall-clock time of the samples to the clock table of the recording"""
+        if self.clock_fit is None:
+            self.clock_fit = fit_clock_table(self.clock_table, self.sampling_rate)
+        return self.clock_fit
+
+    def sample_to_time(self, samples):
+        """returns the wall-clock time (s since epoch) of sample indices of the recording"""
+        import numpy as np
+        fit = self.fit_clock()
+        return fit['time_offset_ns'] / 1e9 + (np.asarray(samples) - fit['sample_offset']) * fit['seconds_per_sample']
+
+    def get_encoder(self, channel_name: str) -> tuple:
+        """returns the unwrapped position (degree) and velocity (degree/s) of a scanned encoder channel"""
+        for encoder in self.header.get('encoder_channels', []):
+            if encoder['name'] == channel_name:
+                return encoder_to_position(self.__dict__[channel_name], encoder['counts_per_rev'],
+                                           self.sampling_rate)
+        raise KeyError(f"{channel_name} is no encoder channel")
 
     def make_fields_toproperties(self):
         '''this adds the channel names as fields to the class'''
         for idx, channel_name in enumerate(self.channel_names):
             self.__dict__[channel_name] = self.data[:, idx]
-
-
-class MCC_settings:
-    def __init__(self):
-        self.scan_counters = False
-        self.num_channels = None
-        self.channel_list = []
-        self.device = None
-        self.voltage_range = None
-        self.pulse_rate = 30
-        self.sampling_rate = 1000
-        self.graphsettings = {}
-        default_params_file = 'MCC_settings_default.json'
-        if Path(default_params_file).exists():
-            self.from_file(default_params_file)
-        else:
-            self.default_setting()
-
-    def to_header(self) -> bytes:
-        self.get_active_channels()
-        dictionary = copy.deepcopy(vars(self))
-        dictionary['datetime'] = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        ids_topop = []
-        for c_id, channel in enumerate(dictionary['channel_list']):
-            channel.pop('color', None)
-            channel.pop('win', None)
-            if not channel["active"]:
-                ids_topop.append(c_id)
-        dictionary.pop("graphsettings")
-        for c_id in sorted(ids_topop, reverse=True):
-            dictionary['channel_list'].pop(c_id)
-        return json.dumps(dictionary).encode()
-
-    def get_active_channels(self):
-        active_channels = [ch_id for ch_id, channel in enumerate(self.channel_list) if channel['active']]
-        low_channel = min(active_channels)
-        high_channel = max(active_channels)
-        self.num_channels = high_channel - low_channel + 1
-        return low_channel, high_channel
-
-    def default_setting(self, num_channels=16):
-        if num_channels == 16:
-            self.device = "USB-1608G"
-            self.voltage_range = 'BIP5VOLTS'
-        elif num_channels == 8:
-            self.voltage_range = 'BIP10VOLTS'
-            raise NotImplementedError
-        else:
-            raise NotImplementedError
-
-        for ch_id in range(num_channels):
-            channel_dict = {}
-            channel_dict['id'] = ch_id
-            channel_dict['name'] = f"Channel_{ch_id}"
-            channel_dict['active'] = True
-            channel_dict['win'] = -1
-            channel_dict['color'] = COLOR_PALETTE[ch_id]
-            self.channel_list.append(channel_dict)
-
-    def from_file(self, path2file: (str, Path)):
-        with open(path2file, 'r') as fi:
-            loaded_dict = json.load(fi)
-        for key in loaded_dict.keys():
-            if key in self.__dict__.keys():
-                self.__dict__[key] = loaded_dict[key]
-
-    def to_file(self, path2file: (str, Path)):
-        dict_to_save = vars(self)
-        with open(path2file, 'w') as fi:
-            json.dump(dict_to_save, fi, indent=4)
-
-    def add_graphsettings(self, graphsetting: dict):
-        # # throw away old settings
-        # if "A" in graphsetting.keys():
-        #     for graph_name in [el.name for el in list(PlotWindowEnum)[1:5]]:
-        #         self.graphsettings.pop(graph_name, None)
-        # elif "E" in graphsetting.keys():
-        #     for graph_name in [el.name for el in list(PlotWindowEnum)[5:9]]:
-        #         self.graphsettings.pop(graph_name, None)
-        # elif "J" in graphsetting.keys():
-        #     for graph_name in [el.name for el in list(PlotWindowEnum)[9:13]]:
-        #         self.graphsettings.pop(graph_name, None)
-
-        self.graphsettings.update({**graphsetting})
+        # named TTL lines are unpacked from the scanned digital port
+        port_columns = [idx for idx, name in enumerate(self.channel_names) if name.startswith('DIO_')]
+        if port_columns:
+            # channels with an invalid or out of range bit were not scanned, older headers only have the settings
+            digital_channels = self.header.get('digital_channels')
+            for channel in self.header['channel_list']:
+                if channel.get('source') != 'dio':
+                    continue
+                if digital_channels is not None:
+                    bit = digital_channels.get(str(channel['id']))
+                else:
+                    bit = channel.get('bit') if is_valid_bit(channel.get('bit')) else None
+                if bit is not None:
+                    self.__dict__[channel['name']] = digital_bit_to_level(self.data[:, port_columns[0]], bit)
 
 
 class RemoteConnDialog(QtWidgets.QDialog):
@@ -2,8 +2,7 @@ import logging
 import platform
 from pathlib import Path
 from ctypes import c_double, cast, POINTER, addressof, sizeof
-from threading import Thread, Event
-from queue import Queue, Full, Empty
+from threading import Thread
 import json
 import struct
 import time
@@ -11,13 +10,20 @@ import datetime
 
 import numpy as np
 
-from GUI_utils import MCC_settings
+from settings_utils import MCC_settings
+from buffer_utils import SampleRing, SharedSampleRing
+from recording_utils import RecordingSink
+from socket_utils import StreamServer
 
 OS_TYPE = platform.system()
 if OS_TYPE == 'Linux':
     from uldaq import (get_daq_device_inventory, DaqDevice, AInScanFlag,
                        AiInputMode, AiQueueElement, create_float_buffer,
-                       ScanStatus, InterfaceType, TmrIdleState, PulseOutOption)
+                       ScanStatus, InterfaceType, TmrIdleState, PulseOutOption,
+                       DaqInChanType, DaqInChanDescriptor, DaqInScanFlag, DigitalDirection,
+                       CounterMeasurementType, CounterMeasurementMode, CounterEdgeDetection,
+                       CounterTickSize, CounterDebounceMode, CounterDebounceTime, CConfigScanFlag,
+                       TriggerType)
     from uldaq import ScanOption as ScanOptions
     from uldaq import Range as ULRange
     from uldaq import ScanStatus as Status
@@ -36,6 +42,9 @@ elif OS_TYPE == 'Windows':
     from mcculw.ul import ULError
 
 
+CLOCK_TABLE_INTERVAL = 1  # s between entries linking sample count and host clocks in a recording
+PLOT_RING_SECONDS = 5  # s of scans the plots can fall behind before scans are skipped
+
 # AnalogInputMode ==  AiInputMode
 # DaqDeviceInfo ==  DaqDevice
 
@@ -47,7 +56,10 @@ class MCCBoard:
 
     def __init__(self):
         self.is_viewing = False
-        self.data_queues = None
+        self.plot_ring = None  # scans for plotting in this process, the GUI takes all new ones per tick
+        self.plot_read_count = 0
+        self.plot_columns = None  # preallocated (columns, scans) array handed to the GUI
+        self.plot_values = None
         self.record_tofile = True
         self.is_recording = False
         self.is_pulsing = False
@@ -55,6 +67,43 @@ class MCCBoard:
         self.recording_thread = None
         self.ai_ranges = None
         self.num_channels = None
+        self.scan_channels = []
+        self.supports_queue = False
+        self.supports_daqi = False
+        self.scan_columns = []
+        self.digital_ports = []
+        self.counter_channels = []
+        self.encoder_channels = {}
+        self.digital_channels = {}
+        self.daqi_descriptors = []
+        self.scan_device = None
+        self.actual_rate = None
+        self.trigger_mode = False
+        self.trigger_type = 'POS_EDGE'
+        self.trigger_level = 0.0
+        self.trigger_channel = 0
+        self.trigger_info = {}
+        self.is_armed = False
+        self.history_ring = None
+        self.history_columns = []
+        self.history_rate = None
+        self.history_end_ns = None
+        self.pretrigger_history = None
+        self.pretrigger_samples = 0
+        self.file_sink = None
+        self.recorded_files = []  # all files of the last recording, segments and manifest
+        self.last_clock_ns = 0
+        self.last_clock_point = None  # latest (scan count, monotonic ns, wall-clock ns) of the running scan
+        self.clock_source = 'internal'  # 'pacer_out' drives the clock of other boards, 'external' follows it
+        self.file_suffix = ''
+        self.device_id = None
+        self.live_ring = None  # shared memory ring other processes can follow the scan in
+        self.live_ring_rows = 0  # size of the live ring, 0 disables it
+        self.live_export_name = ''  # name of the shared memory ring the live data is exported to
+        self.live_export_seconds = 0
+        self.stream_server = None  # binary live data stream for TCP subscribers
+        self.use_queues = True  # the plot ring is only needed if the scan is plotted in this process
+        self.scan_key = None
         self.is_connected = False
         self.sampling_rate = 30
         self.log = logging.getLogger('DAQ-Board')
@@ -96,6 +145,7 @@ class MCCBoard:
 
     def connect_to_device_windows(self, idx):
         ul.create_daq_device(self.board_num, self.devices[idx])
+        self.device_id = self.devices[idx].unique_id
 
         self.daq_device = DaqDevice(self.board_num)
         if not self.daq_device.supports_analog_input:
@@ -117,10 +167,12 @@ class MCCBoard:
 
         scan_options = self.ai_info.supported_scan_options
         resolution = self.ai_info.resolution
+        self.supports_queue = self.ai_info.supports_gain_queue
         self.is_connected = True
 
     def connect_to_device_linux(self, idx):
         self.daq_device = DaqDevice(self.devices[idx])
+        self.device_id = self.devices[idx].unique_id
         # Get the AiDevice object and verify that it is valid.
         ai_device = self.daq_device.get_ai_device()
         if ai_device is None:
@@ -138,6 +190,15 @@ class MCCBoard:
         ctr_info = ctr_device.get_info()
         dev_num_counters = ctr_info.get_num_ctrs()
         self.log.info(f"This board has {dev_num_counters} counters")
+        self.dev_counters = list(range(dev_num_counters))
+        self.encoder_counters = [counter_num for counter_num in self.dev_counters
+                                 if CounterMeasurementType.ENCODER in ctr_info.get_measurement_types(counter_num)]
+        # the daq input subsystem samples analog, digital and counter channels on the same clock
+        daqi_device = self.daq_device.get_daqi_device()
+        self.supports_daqi = daqi_device is not None
+        dio_device = self.daq_device.get_dio_device()
+        self.dio_ports = dio_device.get_info().get_port_types() if dio_device is not None else []
+        self.dio_port_bits = [dio_device.get_info().get_port_info(port).number_of_bits for port in self.dio_ports]
         # Establish a connection to the DAQ device.
         descriptor = self.daq_device.get_descriptor()
         self.log.debug(f'Connecting to {descriptor.dev_string}')
@@ -157,38 +218,391 @@ class MCCBoard:
         # Get a list of supported ranges and validate the range index.
         ranges = self.ai_info.get_ranges(self.input_mode)
         self.ai_ranges = [airange.name for airange in ranges]
+        # a channel queue allows to scan only the selected channels
+        self.supports_queue = bool(self.ai_info.get_queue_types())
 
         self.is_connected = True
         # Allocate a buffer to receive the data.
         # data = create_float_buffer(channel_count, samples_per_channel)
 
-    def start_recording(self, settings: MCC_settings):
-        # Record option is mandatory for now..
-        self.low_chan, self.high_chan = settings.get_active_channels()
-        self.ai_range = ULRange[settings.voltage_range]
-        self.num_channels = settings.num_channels
-        self.sampling_rate = settings.sampling_rate
-        self.file_header = settings.to_header()
-
-        # self.data_queues = [Queue(10000)] * self.num_channels
-        self.data_queues = [Queue(1000) for _ in range(self.num_channels)]
-        # self.stop_recordingevent = event
+    def set_scan_channels(self, settings: MCC_settings):
+        """
+        determines the channels which are sampled by the scan. With a channel queue only the active channels are
+        scanned, otherwise every channel between the lowest and highest active channel is sampled
+        """
+        active_channels = settings.get_active_channel_ids()
+        if not active_channels:  # only digital lines or counters are scanned
+            self.low_chan, self.high_chan = None, None
+            self.scan_channels = []
+        elif self.supports_queue:
+            self.low_chan, self.high_chan = active_channels[0], active_channels[-1]
+            self.scan_channels = active_channels
+        else:
+            self.low_chan, self.high_chan = active_channels[0], active_channels[-1]
+            self.scan_channels = list(range(self.low_chan, self.high_chan + 1))
+            if len(self.scan_channels) != len(active_channels):
+                self.log.warning('Board does not support a channel queue, scanning all channels in between')
+        self.num_channels = len(self.scan_channels)
+
+    def set_scan_columns(self, settings: MCC_settings):
+        """
+        determines the columns of a scan, the analog channels are followed by the digital port and the counters
+        if those are requested and the board can scan them synchronously via the daq input subsystem
+        """
+        self.set_scan_channels(settings)
+        names = {channel['id']: channel['name'] for channel in settings.channel_list}
+        self.scan_columns = [names.get(ch_id, f"CH_{ch_id}") for ch_id in self.scan_channels]
+        self.digital_ports = []
+        self.counter_channels = []
+        self.encoder_channels = {}
+        self.digital_channels = {}
+        digital_channels = settings.get_digital_channels()
+        if settings.scan_digital or settings.scan_counters or settings.encoder_channels or digital_channels:
+            if OS_TYPE != 'Linux' or not self.supports_daqi:
+                self.log.warning('Board can not scan counters or digital ports synchronously, scanning analog only')
+            else:
+                if (settings.scan_digital or digital_channels) and self.dio_ports:
+                    # all TTL lines of the port are packed into one integer per sample
+                    self.digital_ports = [self.dio_ports[0]]
+                    for channel in digital_channels:
+                        if channel['bit'] < self.dio_port_bits[0]:
+                            self.digital_channels[channel['id']] = channel['bit']
+                        else:
+                            self.log.warning(f"{channel['name']}: bit {channel['bit']} is not on port "
+                                             f"{self.dio_ports[0].name}")
+                for encoder in settings.encoder_channels:
+                    if encoder['counter'] in self.encoder_counters:
+                        self.encoder_channels[encoder['counter']] = encoder
+                    else:
+                        self.log.warning(f"Counter {encoder['counter']} does not support encoder mode")
+                counters = set(self.encoder_channels)
+                if settings.scan_counters:
+                    counters.update(self.dev_counters)
+                self.counter_channels = sorted(counters)
+        self.scan_columns.extend([f"DIO_{port.name}" for port in self.digital_ports])
+        self.scan_columns.extend([self.encoder_channels[counter_num]['name'] if counter_num in self.encoder_channels
+                                  else f"CTR{counter_num}" for counter_num in self.counter_channels])
+        self.num_channels = len(self.scan_columns)
+        if not self.scan_channels and not (self.digital_ports or self.counter_channels):
+            # a_in_scan needs at least one analog channel
+            raise RuntimeError('Error: No channel to scan, activate an analog channel. Digital lines, counters and '
+                               'encoders alone can only be scanned by boards with a daq input subsystem')
+
+    @property
+    def counter_columns(self) -> list:
+        """indices of the counter columns within a scan"""
+        first = len(self.scan_channels) + len(self.digital_ports)
+        return list(range(first, first + len(self.counter_channels)))
+
+    def get_scan_index(self, ch_id: int) -> (int, None):
+        """returns the position of a channel within a scan, None if it is not scanned"""
+        if ch_id in self.digital_channels:
+            return len(self.scan_channels)
+        try:
+            return self.scan_channels.index(ch_id)
+        except ValueError:
+            return None
+
+    def get_channel_bit(self, ch_id: int) -> (int, None):
+        """returns the bit of the digital port a channel is mapped to, None for analog channels"""
+        return self.digital_channels.get(ch_id)
+
+    def create_daqi_descriptors(self):
+        """linux library routine to describe the channels of a combined daq input scan"""
+        if self.input_mode == AiInputMode.SINGLE_ENDED:
+            ai_type = DaqInChanType.ANALOG_SE
+        else:
+            ai_type = DaqInChanType.ANALOG_DIFF
+        self.daqi_descriptors = [DaqInChanDescriptor(ch_id, ai_type, self.ai_range) for ch_id in self.scan_channels]
+        dio_device = self.daq_device.get_dio_device()
+        for port in self.digital_ports:
+            dio_device.d_config_port(port, DigitalDirection.INPUT)
+            self.daqi_descriptors.append(DaqInChanDescriptor(port, DaqInChanType.DIGITAL))
+        ctr_device = self.daq_device.get_ctr_device()
+        for counter_num in self.counter_channels:
+            if counter_num in self.encoder_channels:
+                # quadrature decoding happens on the board, the scan streams the position counts
+                encoder_mode = CounterMeasurementMode[f"ENCODER_{self.encoder_channels[counter_num].get('mode', 'X4')}"]
+                ctr_device.c_config_scan(counter_num, CounterMeasurementType.ENCODER, encoder_mode,
+                                         CounterEdgeDetection.RISING_EDGE, CounterTickSize.TICK_20ns,
+                                         CounterDebounceMode.NONE, CounterDebounceTime.DEBOUNCE_0ns,
+                                         CConfigScanFlag.DEFAULT)
+            self.daqi_descriptors.append(DaqInChanDescriptor(counter_num, DaqInChanType.CTR32))
+
+    def get_trigger_descriptor(self):
+        """
+        the descriptor of the configured trigger channel within the daq input scan. Analog triggers need the channel
+        to be scanned (checked on start_recording), for TTL triggers on the trigger input the channel is ignored
+        """
+        for descriptor in self.daqi_descriptors[:len(self.scan_channels)]:
+            if descriptor.channel == self.trigger_channel:
+                return descriptor
+        return self.daqi_descriptors[0]
+
+    def start_scan_linux(self, points_per_channel: int, triggered: bool = False):
+        """
+        starts the hardware paced scan into self.memhandle. Only analog channels are scanned with a_in_scan,
+        digital ports and counters are added via daq_in_scan so every column shares the same clock
+        if triggered, the scan is armed and starts sampling on the external trigger
+        returns the device which is running the scan
+        """
+        scan_options = self.scan_options
+        if triggered:
+            scan_options |= ScanOptions.EXTTRIGGER
+        if self.clock_source == 'pacer_out':
+            scan_options |= ScanOptions.PACEROUT
+        elif self.clock_source == 'external':
+            scan_options |= ScanOptions.EXTCLOCK
+        if self.digital_ports or self.counter_channels:
+            self.create_daqi_descriptors()
+            self.scan_device = self.daq_device.get_daqi_device()
+            if triggered:
+                self.scan_device.set_trigger(TriggerType[self.trigger_type], self.get_trigger_descriptor(),
+                                             self.trigger_level, 0, 0)
+            self.arm_scan()
+            rate = self.scan_device.daq_in_scan(self.daqi_descriptors, points_per_channel, self.sampling_rate,
+                                                scan_options, DaqInScanFlag.DEFAULT, self.memhandle)
+        else:
+            self.scan_device = self.daq_device.get_ai_device()
+            # with a loaded queue the channels, input_mode and range are ignored
+            self.load_channel_queue()
+            if triggered:
+                self.scan_device.set_trigger(TriggerType[self.trigger_type], self.trigger_channel,
+                                             self.trigger_level, 0, 0)
+            self.arm_scan()
+            rate = self.scan_device.a_in_scan(self.low_chan, self.high_chan, self.input_mode,
+                                              self.ai_range, points_per_channel,
+                                              self.sampling_rate, scan_options, AInScanFlag.DEFAULT,
+                                              self.memhandle)
+        self.actual_rate = rate
+        self.log.info(f"Staring scanning with {rate} Hz")
+        return self.scan_device
+
+    def arm_scan(self):
+        """notes the host time right before the scan is started (and armed in trigger mode)"""
+        self.trigger_info = {'arm_monotonic_ns': time.monotonic_ns(), 'arm_time_ns': time.time_ns()}
+
+    def wait_for_trigger(self, scan_device):
+        """
+        blocks until the armed scan acquired its first samples or was stopped,
+        the host time of the trigger is estimated from the samples acquired at detection
+        returns the scan status
+        """
+        self.log.info('Waiting for trigger..')
+        status = Status.RUNNING
+        while status == Status.RUNNING:
+            status, transfer_status = scan_device.get_scan_status()
+            if transfer_status.current_scan_count > 0:
+                detected_ns = time.monotonic_ns()
+                trigger_ns = detected_ns - int(transfer_status.current_scan_count / self.actual_rate * 1e9)
+                self.trigger_info.update({'trigger_type': self.trigger_type,
+                                          'trigger_level': self.trigger_level,
+                                          'trigger_sample_index': self.pretrigger_samples,
+                                          'detected_monotonic_ns': detected_ns,
+                                          'trigger_monotonic_ns': trigger_ns,
+                                          'arm_to_trigger_s':
+                                              (trigger_ns - self.trigger_info['arm_monotonic_ns']) / 1e9})
+                self.log.info(f"Triggered {self.trigger_info['arm_to_trigger_s']:0.4f} s after arming")
+                break
+            time.sleep(0.0001)
+        self.is_armed = False
+        return status
+
+    def take_history(self) -> (np.ndarray, None):
+        """
+        hands over the samples kept while viewing, if they were scanned with the current columns and rate
+        the history ring is released afterwards
+        """
+        ring, self.history_ring = self.history_ring, None
+        if ring is None or self.history_columns != self.scan_columns or self.history_rate != self.sampling_rate:
+            return None
+        return ring.history()
+
+    def update_header(self, **fields):
+        """adds fields to the file header, which is only written once the scan is running"""
+        header = json.loads(self.file_header.decode())
+        header.update(fields)
+        self.file_header = json.dumps(header).encode()
+
+    def load_channel_queue(self):
+        if not self.supports_queue:
+            return
+        if OS_TYPE == 'Linux':
+            self.load_channel_queue_linux()
+        elif OS_TYPE == 'Windows':
+            self.load_channel_queue_windows()
+        self.log.debug(f'Loaded channel queue {self.scan_channels}')
+
+    def load_channel_queue_linux(self):
+        """linux library routine to load the analog input queue with the channels to scan"""
+        queue_list = []
+        for ch_id in self.scan_channels:
+            queue_element = AiQueueElement()
+            queue_element.channel = ch_id
+            queue_element.input_mode = self.input_mode
+            queue_element.range = self.ai_range
+            queue_list.append(queue_element)
+        self.daq_device.get_ai_device().a_in_load_queue(queue_list)
+
+    def load_channel_queue_windows(self):
+        """windows library routine to load the gain queue with the channels to scan"""
+        ul.a_load_queue(self.board_num, self.scan_channels, [self.ai_range] * len(self.scan_channels),
+                        len(self.scan_channels))
+
+    @staticmethod
+    def get_scan_key(settings: MCC_settings) -> str:
+        """summarizes the settings which define a scan, to decide if a running scan can be recorded"""
+        return json.dumps([settings.get_active_channel_ids(),
+                           [(channel['id'], channel.get('bit')) for channel in settings.get_digital_channels()],
+                           settings.scan_counters, settings.scan_digital, settings.encoder_channels,
+                           settings.sampling_rate, settings.voltage_range])
+
+    def set_file_name(self, settings: MCC_settings):
         Path("data").mkdir(exist_ok=True)
         try:
-            self.file_name = Path("data") / f"{settings.session_name}.bin"
+            self.file_name = Path("data") / f"{settings.session_name}{self.file_suffix}.bin"
             if settings.session_name is None:
                 raise AttributeError
         except AttributeError:  # no session name was passed
-            self.file_name = Path("data") / f"DAQrec_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.bin"
+            self.file_name = (Path("data") /
+                              f"DAQrec_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{self.file_suffix}.bin")
+
+    def attach_recording(self, settings: MCC_settings) -> bool:
+        """
+        starts recording a running viewing scan without restarting it, the file begins at the next chunk
+        boundary and holds the recent history in front. Returns False if the scan can not be reused,
+        e.g. the channel settings changed or a trigger is requested
+        """
+        if (not self.is_viewing or self.is_recording or OS_TYPE != 'Linux' or settings.trigger_mode
+                or self.get_scan_key(settings) != self.scan_key):
+            return False
+        self.set_file_name(settings)
+        self.file_header = settings.to_header(self.scan_channels, self.scan_columns, self.digital_channels)
+        self.pretrigger_samples = 0
+        self.trigger_info = {'attach_monotonic_ns': time.monotonic_ns(), 'attach_time_ns': time.time_ns()}
+        self.file_sink = RecordingSink(self.file_name, self.file_header, self.num_channels,
+                                       segment_samples=settings.get_segment_samples(self.num_channels))
+        self.is_recording = True
+        self.log.info('Attached recording to running scan')
+        return True
+
+    def create_live_ring(self, settings: MCC_settings):
+        """
+        a new shared memory ring for every scan, as the number of columns may change. With live_export_name set
+        the ring is published under this name for other processes (LiveDataClient)
+        """
+        self.close_live_ring()
+        self.live_export_name = settings.live_export_name
+        self.live_export_seconds = settings.live_export_seconds
+        num_rows = self.live_ring_rows
+        if self.live_export_name:
+            num_rows = max(num_rows, int(self.live_export_seconds * self.sampling_rate))
+        if num_rows:
+            metadata = {'channel_names': self.scan_columns, 'sampling_rate': self.sampling_rate,
+                        'device_id': self.device_id, 'start_time_ns': time.time_ns()}
+            self.live_ring = SharedSampleRing(num_rows, self.num_channels, name=self.live_export_name or None,
+                                              metadata=metadata)
+
+    def start_stream(self, settings: MCC_settings):
+        """starts the live data stream server if a port is set, it keeps running across scans"""
+        if self.stream_server is not None and self.stream_server.port != settings.stream_port:
+            self.stop_stream()
+        if settings.stream_port and self.stream_server is None:
+            self.stream_server = StreamServer(host=settings.stream_host, port=settings.stream_port)
+            self.stream_server.start()
+        if self.stream_server is not None:
+            self.stream_server.start_scan(self.scan_columns, self.sampling_rate)
+
+    def stop_stream(self):
+        if self.stream_server is not None:
+            self.stream_server.stop()
+            self.stream_server = None
+
+    def close_live_ring(self):
+        if self.live_ring is not None:
+            self.live_ring.close()
+            self.live_ring = None
+
+    def create_plot_ring(self):
+        """the plot ring and the arrays the new scans are read into are allocated once per scan"""
+        self.plot_ring = None
+        if self.use_queues:
+            num_rows = max(int(self.sampling_rate * PLOT_RING_SECONDS), 1)
+            self.plot_ring = SampleRing(num_rows, self.num_channels)
+            self.plot_values = np.empty(self.plot_ring.capacity)
+            self.plot_columns = np.empty((self.num_channels, num_rows))
+        self.plot_read_count = 0
+
+    def get_new_data(self, max_scans: (int, None) = None) -> np.ndarray:
+        """
+        returns all scans acquired since the last call in one copy, shape (columns, scans), every column is
+        contiguous. The array is reused by the next call. If plotting fell behind by more than the plot ring,
+        the oldest scans are skipped
+        """
+        if self.plot_ring is None:
+            return np.zeros((self.num_channels or 0, 0))
+        start_count = self.plot_read_count
+        rows, self.plot_read_count = self.plot_ring.read_new(start_count, max_scans, out=self.plot_values)
+        skipped = (self.plot_read_count - start_count) // self.num_channels - rows.shape[0]
+        if skipped:
+            self.log.warning(f'plotting is too slow, skipped {skipped} scans')
+        columns = self.plot_columns[:, :rows.shape[0]]
+        columns[:] = rows.T
+        return columns
+
+    def get_backlog(self) -> int:
+        """number of scans waiting to be plotted"""
+        if self.plot_ring is None:
+            return 0
+        return (self.plot_ring.write_count - self.plot_read_count) // self.num_channels
+
+    def start_recording(self, settings: MCC_settings):
+        # Record option is mandatory for now..
+        self.ai_range = ULRange[settings.voltage_range]
+        self.set_scan_columns(settings)
+        if (settings.trigger_mode and settings.trigger_type.startswith('ATRIG')
+                and settings.trigger_channel not in self.scan_channels):
+            raise RuntimeError(f'Error: Trigger channel {settings.trigger_channel} is not scanned, activate it '
+                               'for an analog trigger')
+        self.sampling_rate = settings.sampling_rate
+        self.scan_key = self.get_scan_key(settings)
+        self.file_header = settings.to_header(self.scan_channels, self.scan_columns, self.digital_channels)
+        # samples of a preceding viewing scan are written in front of the recording
+        self.pretrigger_history = self.take_history()
+        self.pretrigger_samples = 0 if self.pretrigger_history is None else self.pretrigger_history.shape[0]
+        self.update_header(pretrigger_samples=self.pretrigger_samples,
+                           pretrigger_end_monotonic_ns=self.history_end_ns)
+        self.trigger_mode = settings.trigger_mode
+        self.trigger_type = settings.trigger_type
+        self.trigger_level = settings.trigger_level
+        self.trigger_channel = settings.trigger_channel
+        if self.trigger_mode and OS_TYPE != 'Linux':
+            self.log.warning('External trigger is only implemented for linux, starting right away')
+            self.trigger_mode = False
+        self.is_armed = self.trigger_mode
+        self.trigger_info = {}
+
+        self.create_plot_ring()
+        self.create_live_ring(settings)
+        self.start_stream(settings)
+        # self.stop_recordingevent = event
+        self.set_file_name(settings)
 
         if OS_TYPE == 'Linux':
             self.log.debug('Start recording via Linux routine')
+            self.file_sink = RecordingSink(self.file_name, self.file_header, self.num_channels,
+                                           history=self.pretrigger_history,
+                                           segment_samples=settings.get_segment_samples(self.num_channels))
+            self.pretrigger_history = None
             self.start_rec_time = time.monotonic()
-            self.recording_thread = Thread(target=self.start_recording_linux)
+            self.recording_thread = Thread(target=self.run_scan_linux)
             self.recording_thread.start()
 
         elif OS_TYPE == 'Windows':
             self.log.debug('Started recording-thread via Windows routine')
+            if settings.get_segment_samples(self.num_channels):
+                self.log.warning('File segmentation is only implemented for linux, recording a single file')
+            self.recorded_files = [self.file_name]
             self.start_rec_time = time.monotonic()
             self.recording_thread = Thread(target=self.start_recording_windows)
             self.recording_thread.start()
@@ -201,7 +615,7 @@ class MCCBoard:
         self.log.info('Stopping recording')
         if OS_TYPE == 'Linux':
             try:
-                self.daq_device.get_ai_device().scan_stop()
+                self.scan_device.scan_stop()
             except uldaq.ul_exception.ULException:
                 self.log.warning("some UL exception occured")
 
@@ -211,10 +625,14 @@ class MCCBoard:
             self.stop_pulsing()
         print(f"Stopping recording after {(time.monotonic() - self.start_rec_time):0.1f} s")
         self.recording_thread.join()
+        self.file_sink = None
+        if self.is_viewing:
+            self.history_end_ns = time.monotonic_ns()
         # for queue in self.data_queues: # wait until the data showing is empty
         #    queue.join()
         self.is_recording = False
         self.is_viewing = False
+        self.is_armed = False
 
     def start_recording_windows(self):
         # Create a circular buffer that can hold buffer_size_seconds worth of
@@ -242,7 +660,8 @@ class MCCBoard:
         if not self.memhandle:
             raise Exception('Failed to allocate memory')
 
-        # Start the scan
+        # Start the scan, with a loaded queue low_chan and high_chan are ignored
+        self.load_channel_queue()
         ul.a_in_scan(
             self.board_num, self.low_chan, self.high_chan, ul_buffer_count,
             self.sampling_rate, self.ai_range, self.memhandle, self.scan_options)
@@ -259,11 +678,14 @@ class MCCBoard:
             fi.write(head_len.to_bytes(16, 'little'))
             fi.write(self.file_header)
             self.log.debug(f'written header')
+            if self.pretrigger_history is not None:
+                fi.write(self.pretrigger_history.tobytes())
+                self.log.debug(f'written {self.pretrigger_samples} samples of pre-trigger history')
+                self.pretrigger_history = None
 
             # Start the write loop
             prev_count = 0
             prev_index = 0
-            write_ch_num = self.low_chan
 
             loop_counter = 0
             t = 0
@@ -326,17 +748,14 @@ class MCCBoard:
                         self.log.error('A buffer overrun occurred2')
                         break
 
+                    if self.live_ring is not None:
+                        self.live_ring.write(np.ctypeslib.as_array(write_chunk_array))
+                    if self.stream_server is not None:
+                        self.stream_server.publish(np.ctypeslib.as_array(write_chunk_array))
+                    if self.plot_ring is not None:
+                        self.plot_ring.write(np.ctypeslib.as_array(write_chunk_array))
                     for i in range(write_chunk_size):
                         fi.write(bytearray(struct.pack("d", write_chunk_array[i])))
-                        try:
-                            self.data_queues[write_ch_num - self.low_chan].put_nowait(write_chunk_array[i])
-                        except Full:
-                            self.log.error('Queue buffer is FULL!!')
-                            ul.stop_background(self.board_num, FunctionType.AIFUNCTION)
-                            break
-                        write_ch_num += 1
-                        if write_ch_num == self.high_chan + 1:
-                            write_ch_num = self.low_chan
 
                 else:
                     wrote_chunk = False
@@ -363,9 +782,11 @@ class MCCBoard:
         ul.win_buf_free(self.memhandle)
         self.memhandle = None
 
-    def start_recording_linux(self):
-        ai_device = self.daq_device.get_ai_device()
-
+    def run_scan_linux(self):
+        """
+        acquisition thread, runs the scan and hands every chunk to the history ring, the recording sink
+        (if one is attached) and the data queues for plotting
+        """
         # Create a circular buffer that can hold buffer_size_seconds worth of
         # data, or at least 10 points (this may need to be adjusted to prevent
         # a buffer overrun)
@@ -383,51 +804,40 @@ class MCCBoard:
         #        points_per_channel += packet_size - remainder
 
         ul_buffer_count = points_per_channel * self.num_channels
-        # When handling the buffer, we will read 1/10 of the buffer at a time
+        # When handling the buffer, we will read 1/20 of the buffer at a time
         write_chunk_size = int(ul_buffer_count / 20)
 
         self.memhandle = create_float_buffer(self.num_channels, points_per_channel)
 
-        # Allocate an array of doubles temporary storage of the data
-        write_chunk_array = (c_double * write_chunk_size)()
-
         # Check if the buffer was successfully allocated
         if not self.memhandle:
             raise Exception('Failed to allocate memory')
 
-        # Start the scan
-        rate = ai_device.a_in_scan(self.low_chan, self.high_chan, self.input_mode,
-                                   self.ai_range, points_per_channel,
-                                   self.sampling_rate, self.scan_options, AInScanFlag.DEFAULT, self.memhandle)
-        self.log.info(f"Staring scanning with {rate} Hz")
+        # numpy view on the UL buffer and temporary storage of the data
+        ul_buffer = np.ctypeslib.as_array(self.memhandle)
+        write_chunk_array = np.zeros(write_chunk_size)
+
+        self.last_clock_point = None
+        # Start the scan, only a recording started from idle waits for the trigger
+        triggered = self.file_sink is not None and self.trigger_mode
+        scan_device = self.start_scan_linux(points_per_channel, triggered=triggered)
 
         status = Status.IDLE
         # Wait for the scan to start fully
         while status == Status.IDLE:
-            status, _ = ai_device.get_scan_status()
+            status, _ = scan_device.get_scan_status()
 
-        # Create a file for storing the data
-        with open(self.file_name, 'wb') as fi:
-            self.log.info(f'Writing data to {self.file_name}')
-            head_len = len(self.file_header)
-            fi.write(head_len.to_bytes(16, 'little'))
-            fi.write(self.file_header)
-            self.log.debug(f'written header')
+        if triggered:
+            status = self.wait_for_trigger(scan_device)
 
-            # Start the write loop
-            prev_count = 0
-            prev_index = 0
-            write_ch_num = self.low_chan
-
-            loop_counter = 0
-            t = 0
+        # Start the write loop
+        prev_count = 0
+        prev_index = 0
+        try:
             while status != Status.IDLE:
                 # Get the latest counts
-                t0 = time.monotonic()
-
-                status, transfer_status = ai_device.get_scan_status()
+                status, transfer_status = scan_device.get_scan_status()
                 curr_count = transfer_status.current_total_count
-                curr_index = transfer_status.current_index  # indicates where are we in buffer ?
 
                 new_data_count = curr_count - prev_count
                 # Check for a buffer overrun before copying the data, so
@@ -436,273 +846,129 @@ class MCCBoard:
                 if new_data_count > ul_buffer_count:
                     # Print an error and stop writing
                     if status == ScanStatus.RUNNING:
-                        ai_device.scan_stop()
+                        scan_device.scan_stop()
                     self.log.error('A buffer overrun occurred')
                     break
 
                 # Check if a chunk is available
-                if new_data_count > write_chunk_size:
-                    wrote_chunk = True
-                    # Copy the current data to a new array
-
-                    # Check if the data wraps around the end of the UL
-                    # buffer. Multiple copy operations will be required.
-                    # in linux i could find out via transfer_status.current_index
-                    if curr_index < prev_index - 1 and curr_index != 0:  # todo check if i need -1 ?
-                        # self.log.info('This weird wrap happended.. ')
-                        first_chunk_size = ul_buffer_count - prev_index
-                        second_chunk_size = (
-                                write_chunk_size - first_chunk_size)
-
-                        # Copy the first chunk of data to the
-                        # write_chunk_array
-
-                        # write_chunk_array[:first_chunk_size] = np.frombuffer(self.memhandle, count=first_chunk_size, offset=8 * prev_index)
-                        write_chunk_array[:first_chunk_size] = self.memhandle[prev_index:prev_index + first_chunk_size]
-
-                        # Copy the second chunk of data to the
-                        # write_chunk_array
-                        # write_chunk_array[first_chunk_size:] = np.frombuffer(self.memhandle, count=curr_index, offset=0)
-                        if second_chunk_size == 0:
-                            pass
-                        else:
-                            write_chunk_array[:first_chunk_size] = self.memhandle[0:second_chunk_size]
-
-                    else:
-                        # write_chunk_array = np.copy(np.frombuffer(self.memhandle, count=write_chunk_size, offset=8 * prev_index))
-                        # write_chunk_array = np.frombuffer(self.memhandle, count=write_chunk_size, offset=8 * prev_index)
-                        write_chunk_array[:] = self.memhandle[prev_index:prev_index + write_chunk_size]
-
-                        # potentially not, as long as i make sure the data was used before the buffer loops
-
-                    # Check for a buffer overrun just after copying the data
-                    # from the UL buffer. This will ensure that the data was
-                    # not overwritten in the UL buffer before the copy was
-                    # completed. This should be done before writing to the
-                    # file, so that corrupt data does not end up in it.
-                    status, transfer_status = ai_device.get_scan_status()
-                    curr_count = transfer_status.current_total_count
-                    if curr_count - prev_count > ul_buffer_count:
-                        # Print an error and stop writing
-                        if status == ScanStatus.RUNNING:
-                            ai_device.scan_stop()
-                        self.log.error('A buffer overrun occurred between copy ')
-                        break
-
-                    for i in range(write_chunk_size):
-                        fi.write(bytearray(struct.pack("d", write_chunk_array[i])))
-                        # f.write(str(write_chunk_array[i]) + ',')
-                        try:
-                            self.data_queues[write_ch_num - self.low_chan].put_nowait(write_chunk_array[i])
-                            # todo consider doing this on client side !
-                        except Full:
-                            self.log.error('Queue buffer is FULL!!')
-                            if status == ScanStatus.RUNNING:
-                                ai_device.scan_stop()
-                            break
-                        write_ch_num += 1
-                        if write_ch_num == self.high_chan + 1:
-                            write_ch_num = self.low_chan
-                            # f.write(u'\n')
-                else:
-                    wrote_chunk = False
-
-                if wrote_chunk:
-                    # Increment prev_count by the chunk size
-                    prev_count += write_chunk_size
-                    # Increment prev_index by the chunk size
-                    prev_index += write_chunk_size
-                    # Wrap prev_index to the size of the UL buffer
-                    prev_index %= ul_buffer_count
-
-                else:
+                if new_data_count <= write_chunk_size:
                     # Wait a short amount of time for more data to be
                     # acquired.
                     time.sleep(0.0001)
+                    continue
 
-                # t += (time.monotonic() - t0)
-                # loop_counter += 1
-                # if loop_counter == 100:
-                #     loop_counter = 0
-                #     self.log.info(f'100 grabbing/rec loops took :{t:0.5f} s')
-                #     t = 0
-
-        # free buffer before exiting the Thread
-        self.memhandle = None
-
-    def start_viewing(self, settings: MCC_settings):
-        # Record option is mandatory for now..
-        self.low_chan, self.high_chan = settings.get_active_channels()
-        self.ai_range = ULRange[settings.voltage_range]
-        self.num_channels = settings.num_channels
-        self.sampling_rate = settings.sampling_rate
-        self.data_queues = [Queue(1000) for _ in range(self.num_channels)]
-
-        if OS_TYPE == 'Linux':
-            self.log.debug('Start viewing via Linux routine')
-            self.start_rec_time = time.monotonic()
-            self.recording_thread = Thread(target=self.start_viewing_linux)
-            self.recording_thread.start()
-
-        elif OS_TYPE == 'Windows':
-            raise NotImplementedError
-            self.log.debug('Started recording-thread via Windows routine')
-            # self.start_rec_time = time.monotonic()
-            # self.recording_thread = Thread(target=self.start_recording_windows)
-            # self.recording_thread.start()
-        else:
-            raise NotImplementedError
-
-        self.is_viewing = True
-
-    def start_viewing_linux(self):
-        ai_device = self.daq_device.get_ai_device()
-        # Create a circular buffer that can hold buffer_size_seconds worth of
-        # data, or at least 10 points (this may need to be adjusted to prevent
-        # a buffer overrun)
-        points_per_channel = max(self.sampling_rate * self.buffer_size_seconds, 10)
-
-        ul_buffer_count = points_per_channel * self.num_channels
-        # When handling the buffer, we will read 1/10 of the buffer at a time
-        write_chunk_size = int(ul_buffer_count / 20)
-
-        self.memhandle = create_float_buffer(self.num_channels, points_per_channel)
-
-        # Allocate an array of doubles temporary storage of the data
-        write_chunk_array = (c_double * write_chunk_size)()
-
-        # Check if the buffer was successfully allocated
-        if not self.memhandle:
-            raise Exception('Failed to allocate memory')
-
-        # Start the scan
-        rate = ai_device.a_in_scan(self.low_chan, self.high_chan, self.input_mode,
-                                   self.ai_range, points_per_channel,
-                                   self.sampling_rate, self.scan_options, AInScanFlag.DEFAULT, self.memhandle)
-        self.log.info(f"Staring scanning with {rate} Hz")
-
-        status = Status.IDLE
-        # Wait for the scan to start fully
-        while status == Status.IDLE:
-            status, _ = ai_device.get_scan_status()
-
-        # Start the write loop
-        prev_count = 0
-        prev_index = 0
-        write_ch_num = self.low_chan
-
-        loop_counter = 0
-        t = 0
-        while status != Status.IDLE:
-            # Get the latest counts
-            t0 = time.monotonic()
-
-            status, transfer_status = ai_device.get_scan_status()
-            curr_count = transfer_status.current_total_count
-            curr_index = transfer_status.current_index  # indicates where are we in buffer ?
-
-            new_data_count = curr_count - prev_count
-            # Check for a buffer overrun before copying the data, so
-            # that no attempts are made to copy more than a full buffer
-            # of data
-            if new_data_count > ul_buffer_count:
-                # Print an error and stop writing
-                if status == ScanStatus.RUNNING:
-                    ai_device.scan_stop()
-                self.log.error('A buffer overrun occurred')
-                break
-
-            # Check if a chunk is available
-            if new_data_count > write_chunk_size:
-                wrote_chunk = True
-                # Copy the current data to a new array
-
-                # Check if the data wraps around the end of the UL
-                # buffer. Multiple copy operations will be required.
-                # in linux i could find out via transfer_status.current_index
-                if curr_index < prev_index - 1 and curr_index != 0:  # todo check if i need -1 ?
-                    # self.log.info('This weird wrap happended.. ')
-                    first_chunk_size = ul_buffer_count - prev_index
-                    second_chunk_size = (
-                            write_chunk_size - first_chunk_size)
-
-                    # Copy the first chunk of data to the
-                    # write_chunk_array
-
-                    # write_chunk_array[:first_chunk_size] = np.frombuffer(self.memhandle, count=first_chunk_size, offset=8 * prev_index)
-                    write_chunk_array[:first_chunk_size] = self.memhandle[prev_index:prev_index + first_chunk_size]
-
-                    # Copy the second chunk of data to the
-                    # write_chunk_array
-                    # write_chunk_array[first_chunk_size:] = np.frombuffer(self.memhandle, count=curr_index, offset=0)
-                    if second_chunk_size == 0:
-                        # write_chunk_array[:] = self.memhandle[prev_index:prev_index + write_chunk_size]
-                        pass
-                    else:
-                        try:
-                            write_chunk_array[:first_chunk_size] = self.memhandle[0:second_chunk_size]
-                        except ValueError:
-                            print("a")
-
-
-                else:
-                    # write_chunk_array = np.copy(np.frombuffer(self.memhandle, count=write_chunk_size, offset=8 * prev_index))
-                    # write_chunk_array = np.frombuffer(self.memhandle, count=write_chunk_size, offset=8 * prev_index)
-                    write_chunk_array[:] = self.memhandle[prev_index:prev_index + write_chunk_size]
-
-                    # potentially not, as long as i make sure the data was used before the buffer loops
+                # Copy the current data to a new array, if the data wraps around the end
+                # of the UL buffer the second part is taken from its beginning
+                first_chunk_size = min(write_chunk_size, ul_buffer_count - prev_index)
+                write_chunk_array[:first_chunk_size] = ul_buffer[prev_index:prev_index + first_chunk_size]
+                write_chunk_array[first_chunk_size:] = ul_buffer[:write_chunk_size - first_chunk_size]
 
                 # Check for a buffer overrun just after copying the data
                 # from the UL buffer. This will ensure that the data was
                 # not overwritten in the UL buffer before the copy was
                 # completed. This should be done before writing to the
                 # file, so that corrupt data does not end up in it.
-                status, transfer_status = ai_device.get_scan_status()
+                status, transfer_status = scan_device.get_scan_status()
+                clock_point = (transfer_status.current_scan_count, time.monotonic_ns(), time.time_ns())
+                self.last_clock_point = clock_point
                 curr_count = transfer_status.current_total_count
                 if curr_count - prev_count > ul_buffer_count:
                     # Print an error and stop writing
                     if status == ScanStatus.RUNNING:
-                        ai_device.scan_stop()
+                        scan_device.scan_stop()
                     self.log.error('A buffer overrun occurred between copy ')
                     break
 
-                for i in range(write_chunk_size):
-                    try:
-                        self.data_queues[write_ch_num - self.low_chan].put_nowait(write_chunk_array[i])
-                        # todo consider doing this on client side !
-                    except Full:
-                        self.log.error('Queue buffer is FULL!!')
-                        if status == ScanStatus.RUNNING:
-                            ai_device.scan_stop()
-                        break
-                    write_ch_num += 1
-                    if write_ch_num == self.high_chan + 1:
-                        write_ch_num = self.low_chan
-            else:
-                wrote_chunk = False
+                # a recording attached at this chunk takes its history from the ring, so the chunk goes in after
+                self.handle_file_sink(prev_count, write_chunk_array, clock_point)
+                if self.history_ring is not None:
+                    self.history_ring.write(write_chunk_array)
+                if self.live_ring is not None:
+                    self.live_ring.write(write_chunk_array)
+                if self.stream_server is not None:
+                    self.stream_server.publish(write_chunk_array)
+                if self.plot_ring is not None:
+                    self.plot_ring.write(write_chunk_array)
 
-            if wrote_chunk:
                 # Increment prev_count by the chunk size
                 prev_count += write_chunk_size
                 # Increment prev_index by the chunk size
                 prev_index += write_chunk_size
                 # Wrap prev_index to the size of the UL buffer
                 prev_index %= ul_buffer_count
+        finally:
+            self.close_file_sink()
+            # free buffer before exiting the Thread
+            self.memhandle = None
+
+    def handle_file_sink(self, chunk_start_count: int, chunk: np.ndarray, clock_point: (tuple, None) = None):
+        """
+        writes a chunk to the attached recording, a sink which was attached to the running scan is opened
+        at this chunk boundary.
+        clock_point (scan count, monotonic ns, wall-clock ns) is added to the clock table of the recording
+        every CLOCK_TABLE_INTERVAL
+        """
+        sink = self.file_sink
+        if sink is None:
+            return
+        if not sink.is_open:
+            sink.open(chunk_start_count, self.history_ring, scan_start=self.trigger_info,
+                      actual_sampling_rate=self.actual_rate, clock_source=self.clock_source,
+                      device_id=self.device_id)
+            self.last_clock_ns = 0
+        sink.write(chunk_start_count, chunk)
+        if clock_point is not None and clock_point[1] - self.last_clock_ns >= CLOCK_TABLE_INTERVAL * 1e9:
+            sink.add_clock_point(*clock_point)
+            self.last_clock_ns = clock_point[1]
+
+    @property
+    def recording_files(self) -> list:
+        """files of the running recording (so far), or of the last one"""
+        file_sink = self.file_sink
+        if file_sink is not None:
+            return file_sink.file_names
+        return self.recorded_files
+
+    def close_file_sink(self):
+        if self.file_sink is not None:
+            self.file_sink.close()
+            self.recorded_files = self.file_sink.file_names
+            self.file_sink = None
 
-            else:
-                # Wait a short amount of time for more data to be
-                # acquired.
-                time.sleep(0.0001)
+    def start_viewing(self, settings: MCC_settings):
+        # Record option is mandatory for now..
+        self.ai_range = ULRange[settings.voltage_range]
+        self.set_scan_columns(settings)
+        self.sampling_rate = settings.sampling_rate
+        self.scan_key = self.get_scan_key(settings)
+        self.create_plot_ring()
+        self.create_live_ring(settings)
+        self.start_stream(settings)
+        self.file_sink = None
+        self.trigger_info = {}
+        # keeps the recent samples, to be written in front of a recording which is started next
+        self.history_ring = None
+        if settings.pretrigger_duration > 0:
+            self.history_ring = SampleRing(int(settings.pretrigger_duration * self.sampling_rate), self.num_channels)
+            self.history_columns = list(self.scan_columns)
+            self.history_rate = self.sampling_rate
 
-            # t += (time.monotonic() - t0)
-            # loop_counter += 1
-            # if loop_counter == 100:
-            #     loop_counter = 0
-            #     self.log.info(f'100 grabbing/rec loops took :{t:0.5f} s')
-            #     t = 0
+        if OS_TYPE == 'Linux':
+            self.log.debug('Start viewing via Linux routine')
+            self.start_rec_time = time.monotonic()
+            self.recording_thread = Thread(target=self.run_scan_linux)
+            self.recording_thread.start()
 
-        # free buffer before exiting the Thread
-        self.memhandle = None
+        elif OS_TYPE == 'Windows':
+            raise NotImplementedError
+            self.log.debug('Started recording-thread via Windows routine')
+            # self.start_rec_time = time.monotonic()
+            # self.recording_thread = Thread(target=self.start_recording_windows)
+            # self.recording_thread.start()
+        else:
+            raise NotImplementedError
+
+        self.is_viewing = True
 
     def reset_counters(self):
         self.log.debug("Resetting counters")
@@ -807,6 +1073,8 @@ class MCCBoard:
         self.is_pulsing = False
 
     def release_device(self):
+        self.close_live_ring()
+        self.stop_stream()
         if OS_TYPE == 'Linux':
             if self.daq_device:
                 self.stop_pulsing()
@@ -0,0 +1,149 @@
+import logging
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+from buffer_utils import SharedSampleRing
+
+LIVE_RING_SECONDS = 5  # s of scans the GUI can fall behind before scans are skipped in the plots
+STATE_REFRESH_TIME = 0.05  # s, cached board state older than this is requested again
+STATE_ATTRIBUTES = ('is_viewing', 'is_recording', 'is_armed', 'is_pulsing', 'is_connected', 'ai_ranges',
+                    'num_channels', 'sampling_rate', 'scan_channels', 'scan_columns', 'counter_channels',
+                    'counter_columns', 'digital_channels', 'encoder_channels', 'file_name', 'recorded_files',
+                    'recording_files', 'device_id', 'actual_rate', 'trigger_info')
+
+
+def get_board_state(board) -> dict:
+    state = {attribute: getattr(board, attribute) for attribute in STATE_ATTRIBUTES}
+    state['live_ring_name'] = board.live_ring.name if board.live_ring is not None else None
+    return state
+
+
+def get_board_methods(board) -> list:
+    """public methods of the board which the proxy may call"""
+    return [name for name in dir(board) if not name.startswith('_') and name not in STATE_ATTRIBUTES
+            and callable(getattr(board, name, None))]
+
+
+def run_board_process(conn):
+    """
+    main of the acquisition process, executes the method calls of the GUI on its own MCCBoard and answers
+    with the result and the current board state
+    """
+    from MCC_Board_linux import MCCBoard
+    log = logging.getLogger('Board-Process')
+    board = MCCBoard()
+    board.use_queues = False
+    while True:
+        command, name, args, kwargs = conn.recv()
+        if command == 'exit':
+            break
+        try:
+            if command == 'methods':
+                result = get_board_methods(board)
+            elif command == 'call':
+                if name in ('start_viewing', 'start_recording'):
+                    settings = args[0]
+                    board.live_ring_rows = int(settings.sampling_rate * LIVE_RING_SECONDS)
+                result = getattr(board, name)(*args, **kwargs)
+            else:  # only the state is requested
+                result = None
+            conn.send(('ok', result, get_board_state(board)))
+        except Exception as e:
+            log.exception(f"Calling {name} in the acquisition process failed")
+            conn.send(('error', e, get_board_state(board)))
+    if board.is_recording or board.is_viewing:
+        board.stop_recording()
+    board.close_live_ring()
+    conn.close()
+
+
+class MCCBoardProcess:
+    """
+    runs a MCCBoard in a child process, so plotting in the GUI can not delay draining the hardware buffer.
+    Mirrors the interface of MCCBoard used by the GUI, method calls and the board state go over a pipe,
+    the scanned data arrives in a shared memory ring
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        # the proxy is used from the GUI and from worker threads, a request and its reply must not interleave
+        self.lock = threading.Lock()
+        self.ring_lock = threading.Lock()  # the live ring is replaced by a request while the GUI reads it
+        self.process = context.Process(target=run_board_process, args=(child_conn,), daemon=True)
+        self.process.start()
+        self.state = {}
+        self.state_time = 0
+        self.live_ring = None
+        self.read_count = 0
+        self.live_values = None  # preallocated arrays the new scans are read into
+        self.live_columns = None
+        self.log = logging.getLogger('DAQ-Board')
+        self.methods = frozenset(self.request(command='methods'))
+
+    def request(self, name: (str, None) = None, *args, command: str = 'call', **kwargs):
+        with self.lock:
+            self.conn.send((command, name, args, kwargs))
+            status, result, state = self.conn.recv()
+            self.update_state(state)
+        if status == 'error':
+            raise result
+        return result
+
+    def update_state(self, state: dict):
+        self.state = state
+        self.state_time = time.monotonic()
+        live_ring_name = state['live_ring_name']
+        with self.ring_lock:
+            self.update_live_ring(live_ring_name)
+
+    def update_live_ring(self, live_ring_name: (str, None)):
+        if self.live_ring is not None and self.live_ring.name != live_ring_name:
+            self.live_ring.close()
+            self.live_ring = None
+        if self.live_ring is None and live_ring_name is not None:
+            self.live_ring = SharedSampleRing.attach(live_ring_name)
+            self.read_count = 0
+            self.live_values = np.empty(self.live_ring.capacity)
+            num_channels = self.live_ring.num_channels
+            self.live_columns = np.empty((num_channels, self.live_ring.capacity // num_channels))
+
+    def __getattr__(self, name):
+        # only called for attributes which are not set on the proxy
+        if name in STATE_ATTRIBUTES:
+            if time.monotonic() - self.state_time > STATE_REFRESH_TIME:
+                self.request(command='state')
+            return self.state[name]
+        if name in self.__dict__.get('methods', ()):
+            return lambda *args, **kwargs: self.request(name, *args, **kwargs)
+        raise AttributeError(f"'{type(self).__name__}' has no attribute '{name}', the board has no such method")
+
+    def get_new_data(self, max_scans: (int, None) = None) -> np.ndarray:
+        """
+        returns all scans acquired since the last call from the live ring in one copy, shape (columns, scans).
+        The array is reused by the next call
+        """
+        with self.ring_lock:
+            if self.live_ring is None:
+                return np.zeros((0, 0))
+            rows, self.read_count = self.live_ring.read_new(self.read_count, max_scans, out=self.live_values)
+            columns = self.live_columns[:, :rows.shape[0]]
+            columns[:] = rows.T
+            return columns
+
+    def get_backlog(self) -> int:
+        with self.ring_lock:
+            if self.live_ring is None:
+                return 0
+            return (self.live_ring.write_count - self.read_count) // self.live_ring.num_channels
+
+    def close(self):
+        with self.ring_lock:
+            self.update_live_ring(None)
+        if self.process.is_alive():
+            with self.lock:
+                self.conn.send(('exit', None, (), {}))
+            self.process.join(timeout=5)
@@ -0,0 +1,261 @@
+import json
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+class SampleRing:
+    """
+    Preallocated ring buffer holding the most recent values of an interleaved scan.
+    Values are written in chunks of arbitrary length, reading returns complete scans (rows) only
+    """
+
+    def __init__(self, num_rows: int, num_channels: int, dtype=np.float64):
+        self.num_channels = num_channels
+        self.capacity = max(int(num_rows), 1) * num_channels
+        self.buffer = np.zeros(self.capacity, dtype)
+        self.write_count = 0  # total number of values written since creation
+
+    @property
+    def rows_written(self) -> int:
+        return self.write_count // self.num_channels
+
+    def write(self, values):
+        """copies a chunk of interleaved values into the ring, wrapping around at the end"""
+        values = np.asarray(values, dtype=self.buffer.dtype)
+        if values.size >= self.capacity:  # only the newest values fit
+            start = (self.write_count + values.size - self.capacity) % self.capacity
+            self.buffer[start:] = values[-self.capacity:][:self.capacity - start]
+            self.buffer[:start] = values[-self.capacity:][self.capacity - start:]
+            self.write_count += values.size
+            return
+        start = self.write_count % self.capacity
+        first_part = min(values.size, self.capacity - start)
+        self.buffer[start:start + first_part] = values[:first_part]
+        self.buffer[:values.size - first_part] = values[first_part:]
+        self.write_count += values.size
+
+    def read_values(self, start_count: int, end_count: int, out: (np.ndarray, None) = None) -> np.ndarray:
+        """
+        returns a copy of the values between two absolute write counts, which must still be in the ring.
+        With out (at least the ring capacity) the values are copied into it and a view on it is returned
+        """
+        if end_count - start_count > self.capacity or start_count < self.write_count - self.capacity:
+            raise IndexError('requested values were already overwritten')
+        start = start_count % self.capacity
+        length = end_count - start_count
+        first_part = min(length, self.capacity - start)
+        if out is None:
+            if first_part == length:
+                return self.buffer[start:start + length].copy()
+            return np.concatenate((self.buffer[start:], self.buffer[:length - first_part]))
+        out[:first_part] = self.buffer[start:start + first_part]
+        out[first_part:length] = self.buffer[:length - first_part]
+        return out[:length]
+
+    def read_new(self, start_count: int, max_rows: (int, None) = None, out: (np.ndarray, None) = None) -> tuple:
+        """
+        returns the complete scans written since start_count, shape (rows, channels), and the count to continue
+        from. If the reader fell behind, the overwritten scans are skipped. The ring may be written by another
+        thread or process meanwhile, the write count is updated after the values
+        """
+        while True:
+            write_count = self.write_count
+            end_count = write_count // self.num_channels * self.num_channels
+            oldest_count = -(-max(write_count - self.capacity, 0) // self.num_channels) * self.num_channels
+            read_start = max(start_count, oldest_count)
+            read_end = end_count if max_rows is None else min(end_count, read_start + max_rows * self.num_channels)
+            try:
+                values = self.read_values(read_start, read_end, out)
+            except IndexError:  # overwritten since the write count was taken
+                continue
+            # the writer may have overwritten the start while copying, then read again
+            if self.write_count - self.capacity <= read_start:
+                return values.reshape(-1, self.num_channels), read_end
+
+    def history(self, end_count: (int, None) = None) -> np.ndarray:
+        """
+        returns the complete scans held in the ring in chronological order, shape (rows, channels)
+        end_count limits the history to the scans before this absolute write count, it must be a multiple of
+        the channel count
+        """
+        if end_count is None:
+            end_count = self.rows_written * self.num_channels
+        # a partially written scan may already have overwritten the oldest one
+        oldest_count = max(self.write_count - self.capacity, 0)
+        start_count = min(-(-oldest_count // self.num_channels) * self.num_channels, end_count)
+        return self.read_values(start_count, end_count).reshape(-1, self.num_channels)
+
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """attaches to an existing block without handing it to the resource tracker, the creator unlinks it"""
+    try:
+        return SharedMemory(name=name, track=False)  # python >= 3.13
+    except TypeError:
+        pass
+    # older versions always register, the tracker would unlink the block when this process exits.
+    # Unregistering afterwards breaks the creator if it shares the tracker, so registering is skipped
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedSampleRing(SampleRing):
+    """
+    SampleRing in a multiprocessing.shared_memory block, so other processes can follow the scan.
+    The block starts with HEADER_SIZE bytes holding write count, channel count, capacity, length of the metadata
+    and an open flag, followed by METADATA_SIZE bytes of json metadata (channel names, rate) and the values.
+    The writer updates the write count after the values, readers check it again after copying
+    """
+    HEADER_SIZE = 64
+    METADATA_SIZE = 4096
+
+    def __init__(self, num_rows: int, num_channels: int, name: (str, None) = None, create: bool = True,
+                 metadata: (dict, None) = None):
+        if create:
+            capacity = max(int(num_rows), 1) * num_channels
+            size = self.HEADER_SIZE + self.METADATA_SIZE + capacity * 8
+            try:
+                self.shm = SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:  # left over from a process which did not shut down
+                stale = attach_shared_memory(name)
+                stale.close()
+                stale.unlink()
+                self.shm = SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+        self.is_owner = create
+        self.counters = np.ndarray(5, np.int64, self.shm.buf)
+        if create:
+            metadata = json.dumps(metadata or {}).encode()
+            if len(metadata) > self.METADATA_SIZE:
+                raise ValueError('metadata of the shared ring is too long')
+            self.shm.buf[self.HEADER_SIZE:self.HEADER_SIZE + len(metadata)] = metadata
+            self.counters[:] = [0, num_channels, capacity, len(metadata), 1]
+        self.num_channels = int(self.counters[1])
+        self.capacity = int(self.counters[2])
+        self.buffer = np.ndarray(self.capacity, np.float64, self.shm.buf,
+                                 offset=self.HEADER_SIZE + self.METADATA_SIZE)
+
+    @classmethod
+    def attach(cls, name: str):
+        return cls(0, 0, name=name, create=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def metadata(self) -> dict:
+        return json.loads(bytes(self.shm.buf[self.HEADER_SIZE:self.HEADER_SIZE + int(self.counters[3])]).decode())
+
+    @property
+    def is_open(self) -> bool:
+        """False once the writer closed the ring"""
+        return bool(self.counters[4])
+
+    @property
+    def write_count(self) -> int:
+        return int(self.counters[0])
+
+    @write_count.setter
+    def write_count(self, value: int):
+        self.counters[0] = value
+
+    def close(self):
+        if self.is_owner:
+            self.counters[4] = 0
+        # views on the block have to be released before it can be closed
+        self.counters = None
+        self.buffer = None
+        try:
+            self.shm.close()
+        except BufferError:  # views handed out to a client are still alive, the mapping goes with them
+            pass
+        if self.is_owner:
+            self.shm.unlink()
+
+
+class LiveDataClient:
+    """
+    Lightweight reader for the live data a MCCBoard exports into a named shared memory ring
+    (setting live_export_name), for use in other processes on the same machine, e.g.:
+
+        client = LiveDataClient('mcc_live')
+        data = client.read_latest(1000)  # (samples, channels)
+        lick = client.read_latest(1000, ['Lick_spout'])
+
+    A new scan of the board replaces the ring, the client attaches to the new one on the next read
+    """
+
+    def __init__(self, name: str = 'mcc_live'):
+        self.name = name
+        self.ring = None
+        self.read_count = 0
+        self.channel_names = []
+        self.sampling_rate = None
+        self.attach()
+
+    def attach(self) -> bool:
+        """attaches to the ring of the current scan, returns False if the board is not exporting"""
+        self.close()
+        try:
+            self.ring = SharedSampleRing.attach(self.name)
+        except FileNotFoundError:
+            return False
+        metadata = self.ring.metadata
+        self.channel_names = metadata.get('channel_names', [])
+        self.sampling_rate = metadata.get('sampling_rate')
+        self.read_count = 0
+        return True
+
+    def check_ring(self) -> bool:
+        if self.ring is None or not self.ring.is_open:
+            return self.attach()
+        return True
+
+    @property
+    def samples_written(self) -> int:
+        """number of scans written since the start of the current scan"""
+        return self.ring.rows_written if self.check_ring() else 0
+
+    def get_channel_indices(self, channels: (list, None)) -> (list, slice):
+        if channels is None:
+            return slice(None)
+        return [self.channel_names.index(channel) for channel in channels]
+
+    def read_latest(self, num_samples: int, channels: (list, None) = None) -> np.ndarray:
+        """
+        returns the latest num_samples scans, shape (samples, channels). This is a view on the shared memory
+        (no copy) unless the samples wrap around the end of the ring, copy it if it is kept beyond the next
+        ring cycle
+        """
+        if not self.check_ring():
+            return np.zeros((0, len(self.channel_names)))
+        ring = self.ring
+        write_count = ring.write_count
+        end_count = write_count // ring.num_channels * ring.num_channels
+        oldest_count = -(-max(write_count - ring.capacity, 0) // ring.num_channels) * ring.num_channels
+        start_count = max(end_count - num_samples * ring.num_channels, oldest_count)
+        start = start_count % ring.capacity
+        if start + end_count - start_count <= ring.capacity:
+            values = ring.buffer[start:start + end_count - start_count]
+        else:
+            values = ring.read_values(start_count, end_count)
+        return values.reshape(-1, ring.num_channels)[:, self.get_channel_indices(channels)]
+
+    def read_new(self, channels: (list, None) = None) -> np.ndarray:
+        """returns a copy of the scans written since the last call, shape (samples, channels)"""
+        if not self.check_ring():
+            return np.zeros((0, len(self.channel_names)))
+        rows, self.read_count = self.ring.read_new(self.read_count)
+        return rows[:, self.get_channel_indices(channels)]
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
@@ -0,0 +1,252 @@
+from pathlib import Path
+
+from socket_utils import FileTransferServer, MessageType, SocketMessage
+from file_utils import CopyWorker, FileMirror
+
+DAQ_FOLDER = 'daq'
+
+
+class RemoteControl:
+    """
+    the remote control of a recorder, shared by the GUI window and the headless daemon, without Qt.
+    The recorder inherits it and provides mcc_board, settings, socket_comm and log, the DAQ actions
+    (run_daq, record_daq, stop_daq, start_stop_pulses, load_settings_fromfile) and calls setup_remote_control.
+    The set_* hooks apply a remote command to the settings, the GUI overrides them to update its widgets
+    """
+
+    def setup_remote_control(self, host: str, transfer_port: int):
+        self.remote_host = host
+        self.transfer_port = transfer_port
+        self.session_path = None
+        self.files_copied = False
+        self.copy_client = None
+        self.file_mirror = None
+        self.transfer_server = None
+        self.copy_worker = CopyWorker(on_progress=self.report_copy_progress, on_done=self.copy_finished)
+
+    ### hooks
+    def is_remote_ready(self) -> bool:
+        return self.mcc_board.is_connected
+
+    def set_trigger_mode(self, trigger_mode: bool):
+        self.settings.trigger_mode = trigger_mode
+
+    def set_session_name(self, session_name: str):
+        self.settings.session_name = session_name
+
+    def set_pulse_rate(self, pulse_rate: int):
+        self.settings.pulse_rate = pulse_rate
+
+    def client_disconnected(self):
+        self.log.info("got message that client disconnected")
+
+    ### messages
+    def get_status_message(self) -> dict:
+        if self.mcc_board.is_armed:
+            return SocketMessage.status_armed
+        elif self.mcc_board.is_recording:
+            return SocketMessage.status_recording
+        elif self.mcc_board.is_viewing:
+            return SocketMessage.status_viewing
+        elif self.is_remote_ready():
+            return SocketMessage.status_ready
+        return SocketMessage.status_error
+
+    def push_status(self):
+        """sends the status to the clients subscribed to it, if it changed"""
+        if self.socket_comm:
+            self.socket_comm.push_status(self.get_status_message())
+
+    def handle_remote_message(self, message: dict, client_id: int):
+        """handles a remote command as soon as it arrives, replies go to the client which sent it"""
+        self.socket_comm.reply_to = client_id
+        try:
+            self.check_and_parse_messages(message)
+        except Exception:
+            self.log.exception(f"Handling {message} failed")
+            self.socket_comm.send_json_message(SocketMessage.status_error)
+        self.push_status()
+
+    def check_and_parse_messages(self, message: dict):
+        if not message:
+            return
+        self.log.debug(f"got message {message}")
+        if message['type'] == MessageType.start_daq.value or message['type'] == MessageType.start_daq_viewing.value:
+            if self.mcc_board.is_recording or (self.mcc_board.is_viewing and
+                                               message['type'] == MessageType.start_daq_viewing.value):
+                # got record but we already are ! recording from viewing keeps the pre-trigger history
+                self.socket_comm.send_json_message(SocketMessage.status_error)
+                self.log.info("got message to start, but something is already running!")
+                return
+
+            try:
+                if message["setting_file"]:
+                    self.load_settings_fromfile(message["setting_file"])
+                    self.log.debug(f"loaded settings from {message['setting_file']}")
+            except (FileNotFoundError, KeyError):
+                self.log.error("passed settings file not found")
+
+            if message.get('trigger') is not None:
+                self.set_trigger_mode(bool(message['trigger']))
+            self.set_session_name(message["session_id"])
+
+            if message['type'] == MessageType.start_daq.value:
+                self.log.info("got message to start recording")
+                self.record_daq()
+                if message.get('session_path') and self.settings.mirror_recording:
+                    self.session_path = message['session_path']
+                    self.start_mirror()
+                self.socket_comm.send_json_message(SocketMessage.respond_recording)
+            else:
+                self.log.info("got message to start viewing")
+                self.run_daq()
+                self.socket_comm.send_json_message(SocketMessage.respond_viewing)
+
+        elif message['type'] == MessageType.stop_daq.value:
+            if self.mcc_board.is_recording or self.mcc_board.is_viewing:
+                self.log.info("got message to stop")
+                self.stop_daq()
+                self.socket_comm.send_json_message(SocketMessage.respond_stop)
+            else:
+                self.log.info("got message to stop, but nothing is running")
+                self.socket_comm.send_json_message(SocketMessage.status_error)
+
+        elif message['type'] == MessageType.start_daq_pulses.value:
+            if not self.mcc_board.is_pulsing:
+                if 'fps' in message:
+                    self.set_pulse_rate(message['fps'])
+                self.start_stop_pulses(lag=message.get('pulse_lag', 0))
+                self.socket_comm.send_json_message(SocketMessage.respond_pulsing)
+            else:
+                self.log.info("got message to start pulsing, but already are!")
+                self.socket_comm.send_json_message(SocketMessage.status_error)
+
+        elif message['type'] == MessageType.stop_daq_pulses.value:
+            self.start_stop_pulses()
+            self.socket_comm.send_json_message(SocketMessage.respond_stop)
+
+        elif message['type'] == MessageType.poll_status.value:
+            self.socket_comm.send_json_message(self.get_status_message())
+
+        elif message['type'] == MessageType.disconnected.value:
+            self.client_disconnected()
+
+        elif message['type'] == MessageType.copy_files.value:
+            self.log.debug('got message to copy files')
+            self.session_path = message['session_path']
+            if self.session_path:
+                self.copy_recorded_file()
+
+        elif message['type'] == MessageType.transfer_files.value:
+            self.log.debug('got message to transfer files')
+            self.transfer_recorded_file()
+
+        elif message['type'] == MessageType.read_range.value:
+            self.log.debug('got message to read from the recording')
+            if self.start_transfer_server():
+                self.socket_comm.send_json_message(dict(SocketMessage.respond_read, port=self.transfer_server.port,
+                                                        files=self.transfer_server.get_file_list(readable=True)))
+
+        elif message['type'] == MessageType.purge_files.value:
+            self.log.debug('got message to purge files')
+            self.purge_recorded_file()
+
+    ### files
+    def purge_recorded_file(self):
+        #TODO add a check that this is the current file ?
+        for file_name in self.mcc_board.recorded_files or [self.mcc_board.file_name]:
+            self.log.info(f"Deleting file {file_name}")
+            try:
+                Path(file_name).unlink()
+            except FileNotFoundError:
+                self.log.warning(f"File {file_name} doesnt not exist")
+
+    def get_copy_destination(self) -> Path:
+        if "MusterMaus" in self.settings.session_name:
+            return Path(self.session_path)
+        return Path(self.session_path) / DAQ_FOLDER
+
+    def start_mirror(self):
+        """mirrors the growing recording to the session path, so copying at the end only has the tail left"""
+        if self.file_mirror is not None:
+            self.file_mirror.stop()
+        destination = self.get_copy_destination()
+        self.log.info(f"Mirroring the recording to {destination}")
+        try:
+            self.file_mirror = FileMirror(lambda: self.mcc_board.recording_files, destination,
+                                          self.settings.mirror_interval)
+        except OSError as e:
+            self.log.error(f"Can not mirror to {destination}: {e}")
+            self.file_mirror = None
+
+    def copy_recorded_file(self):
+        """
+        copies the recording in the background, the client gets progress messages and the reply once the
+        copy was verified
+        """
+        destination = self.get_copy_destination()
+        self.log.info(f"Copying file {self.mcc_board.file_name} to {destination}")
+        if not self.mcc_board.is_recording and not self.files_copied:
+            self.copy_client = self.socket_comm.reply_to
+            # a segmented recording is copied with all its segments and the manifest
+            self.copy_worker.submit(self.mcc_board.recorded_files or [self.mcc_board.file_name], destination,
+                                    mirror=self.file_mirror)
+            self.file_mirror = None
+
+    def get_transfer_files(self) -> list:
+        """called from the transfer server, a running recording is not served"""
+        if self.mcc_board.is_recording:
+            return []
+        return self.mcc_board.recorded_files or [self.mcc_board.file_name]
+
+    def start_transfer_server(self) -> bool:
+        """starts the data connection on the first request, the client gets an error if that fails"""
+        if self.transfer_server is None:
+            try:
+                self.transfer_server = FileTransferServer(self.get_transfer_files, host=self.remote_host,
+                                                          port=self.transfer_port,
+                                                          get_read_files=lambda: self.mcc_board.recording_files)
+                self.transfer_server.start()
+            except OSError as e:
+                self.log.error(f"Can not serve the recording: {e}")
+                self.transfer_server = None
+                self.socket_comm.send_json_message(dict(SocketMessage.respond_transfer_fail, error=str(e)))
+                return False
+        return True
+
+    def transfer_recorded_file(self):
+        """
+        answers with the port of the data connection and the files of the last recording, the client downloads
+        them itself (socket_utils.download_recording)
+        """
+        if self.mcc_board.is_recording:
+            self.socket_comm.send_json_message(dict(SocketMessage.respond_transfer_fail, error='recording'))
+            return
+        if self.start_transfer_server():
+            self.socket_comm.send_json_message(dict(SocketMessage.respond_transfer, port=self.transfer_server.port,
+                                                    files=self.transfer_server.get_file_list()))
+
+    def report_copy_progress(self, file_name: str, bytes_done: int, bytes_total: int):
+        """called from the copy worker"""
+        self.socket_comm.send_json_message({'type': MessageType.copy_progress.value, 'file': file_name,
+                                            'bytes_done': bytes_done, 'bytes_total': bytes_total},
+                                           client_id=self.copy_client)
+
+    def copy_finished(self, success: bool, checksums: dict, error: (str, None)):
+        """called from the copy worker"""
+        if success:
+            self.files_copied = True
+            self.socket_comm.send_json_message(dict(SocketMessage.respond_copy, checksums=checksums),
+                                               client_id=self.copy_client)
+        else:
+            self.socket_comm.send_json_message(dict(SocketMessage.respond_copy_fail, error=error),
+                                               client_id=self.copy_client)
+
+    def stop_file_services(self):
+        """stops mirroring and serving the recording, on exit"""
+        if self.file_mirror is not None:
+            self.file_mirror.stop()
+            self.file_mirror = None
+        if self.transfer_server is not None:
+            self.transfer_server.stop()
+            self.transfer_server = None
@@ -0,0 +1,326 @@
+import errno
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+COPY_BLOCK_SIZE = 8 * 1024 ** 2  # bytes copied and hashed at once
+PROGRESS_INTERVAL = 0.5  # s between progress reports
+FICLONE = 0x40049409  # linux ioctl to share the extents of a file (reflink) on btrfs, xfs, ...
+CHECKSUM_ALGORITHM = 'blake2b'
+MIRROR_BLOCK_SIZE = 1024 ** 2  # growing files are mirrored in multiples of this size
+MIRROR_MAX_BATCH = 64 * 1024 ** 2  # bytes mirrored per file and round at most, to throttle the background load
+
+
+def update_checksum(checksum, file_name: (str, Path), end: (int, None) = None, progress=None):
+    """hashes the file (the first end bytes) into checksum, progress(bytes_done) is called after every block"""
+    bytes_done = 0
+    with open(file_name, 'rb') as fi:
+        while block := fi.read(COPY_BLOCK_SIZE if end is None else min(COPY_BLOCK_SIZE, end - bytes_done)):
+            checksum.update(block)
+            bytes_done += len(block)
+            if progress is not None:
+                progress(bytes_done)
+    return checksum
+
+
+def file_checksum(file_name: (str, Path), progress=None, end: (int, None) = None) -> str:
+    """streaming checksum of a file, or of its first end bytes"""
+    return update_checksum(hashlib.new(CHECKSUM_ALGORITHM), file_name, end, progress).hexdigest()
+
+
+def try_hardlink(src: Path, dst: Path) -> bool:
+    """links the recording into the destination if both are on the same file system"""
+    try:
+        if os.stat(src).st_dev != os.stat(dst.parent).st_dev:
+            return False
+        os.link(src, dst)
+        return True
+    except OSError:
+        return False
+
+
+def try_reflink(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False
+
+
+def copy_blocks(src_fi, dst_fi, progress=None) -> (str, None):
+    """
+    copies block by block. With os.copy_file_range the data stays in the kernel (also server side copies on
+    nfs/cifs), but can not be hashed on the way: None is returned and the caller hashes source and copy in one
+    verification pass, so the source is read twice. Otherwise the blocks are read, hashed and written from user
+    space and the checksum of the source is returned, only the copy is read back
+    """
+    checksum = hashlib.new(CHECKSUM_ALGORITHM)
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied := os.copy_file_range(src_fi.fileno(), dst_fi.fileno(), COPY_BLOCK_SIZE, offset, offset):
+                offset += copied
+                if progress is not None:
+                    progress(offset)
+            dst_fi.truncate(offset)
+            return None
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+        # copied again from the start, so the checksum covers the whole file
+        offset = 0
+    src_fi.seek(0)
+    dst_fi.seek(0)
+    while block := src_fi.read(COPY_BLOCK_SIZE):
+        checksum.update(block)
+        dst_fi.write(block)
+        offset += len(block)
+        if progress is not None:
+            progress(offset)
+    dst_fi.truncate(offset)
+    return checksum.hexdigest()
+
+
+def verify_copy(src: (str, Path), dst: (str, Path), progress=None) -> str:
+    """hashes source and copy block by block in one pass, returns the checksum, raises IOError if they differ"""
+    src_checksum = hashlib.new(CHECKSUM_ALGORITHM)
+    dst_checksum = hashlib.new(CHECKSUM_ALGORITHM)
+    bytes_done = 0
+    with open(src, 'rb') as src_fi, open(dst, 'rb') as dst_fi:
+        while True:
+            block = src_fi.read(COPY_BLOCK_SIZE)
+            copied_block = dst_fi.read(COPY_BLOCK_SIZE)
+            if not block and not copied_block:
+                break
+            src_checksum.update(block)
+            dst_checksum.update(copied_block)
+            bytes_done += len(block)
+            if progress is not None:
+                progress(bytes_done)
+    if src_checksum.hexdigest() != dst_checksum.hexdigest():
+        raise IOError(f"Checksum of {dst} does not match {src}")
+    return src_checksum.hexdigest()
+
+
+def copy_file(src: (str, Path), dst: (str, Path), progress=None, allow_hardlink: bool = True) -> str:
+    """
+    copies src to dst with the fastest method the file systems allow (hardlink, reflink, copy_file_range,
+    read/write) and verifies the copy against a checksum of the source. Returns the checksum,
+    raises IOError if the copy differs or dst is the source itself. progress(bytes_done, bytes_total) is called
+    during copy and verification
+    """
+    src, dst = Path(src), Path(dst)
+    size = src.stat().st_size
+    report = (lambda done: progress(done, 2 * size)) if progress is not None else None
+    if dst.exists():
+        if dst.samefile(src):
+            raise IOError(f"{dst} is the recording {src} itself, not copying it onto itself")
+        dst.unlink()
+    if allow_hardlink and try_hardlink(src, dst):
+        checksum = file_checksum(src, report)
+        if not dst.samefile(src):
+            raise IOError(f"Hardlink {dst} does not point to {src}")
+        if progress is not None:
+            progress(2 * size, 2 * size)
+        return checksum
+
+    with open(src, 'rb') as src_fi, open(dst, 'wb') as dst_fi:
+        checksum = None
+        if not try_reflink(src_fi.fileno(), dst_fi.fileno()):
+            checksum = copy_blocks(src_fi, dst_fi, report)
+        dst_fi.flush()
+        os.fsync(dst_fi.fileno())
+
+    verify_progress = (lambda done: progress(size + done, 2 * size)) if progress is not None else None
+    if checksum is None:  # copied in the kernel, source and copy are hashed together
+        return verify_copy(src, dst, verify_progress)
+    if file_checksum(dst, verify_progress) != checksum:
+        raise IOError(f"Checksum of {dst} does not match {src}")
+    return checksum
+
+
+class MirroredFile:
+    """
+    copy of a growing file which is extended block by block, source and copy are hashed on the way
+    (the copy is read back after writing)
+    """
+
+    def __init__(self, src: Path, dst: Path):
+        self.src = src
+        self.dst = dst
+        self.offset = 0
+        self.src_checksum = hashlib.new(CHECKSUM_ALGORITHM)
+        self.dst_checksum = hashlib.new(CHECKSUM_ALGORITHM)
+        if dst.exists() and dst.samefile(src):
+            raise IOError(f"{dst} is the recording {src} itself, not mirroring it onto itself")
+        open(dst, 'wb').close()
+
+    def update(self, final: bool = False, max_bytes: int = MIRROR_MAX_BATCH, progress=None):
+        """appends the complete blocks written since the last update, or everything if final"""
+        size = self.src.stat().st_size
+        end = size if final else self.offset + min((size - self.offset) // MIRROR_BLOCK_SIZE * MIRROR_BLOCK_SIZE,
+                                                   max_bytes)
+        if end <= self.offset:
+            return
+        with open(self.src, 'rb') as src_fi, open(self.dst, 'r+b') as dst_fi:
+            src_fi.seek(self.offset)
+            dst_fi.seek(self.offset)
+            position = self.offset
+            while position < end:
+                block = src_fi.read(min(COPY_BLOCK_SIZE, end - position))
+                if not block:
+                    break
+                self.src_checksum.update(block)
+                dst_fi.write(block)
+                position += len(block)
+                if progress is not None:
+                    progress(position, end)
+            dst_fi.flush()
+            os.fsync(dst_fi.fileno())
+            dst_fi.seek(self.offset)
+            self.dst_checksum.update(dst_fi.read(position - self.offset))
+        self.offset = position
+
+    def verify(self) -> str:
+        if self.src_checksum.hexdigest() != self.dst_checksum.hexdigest():
+            raise IOError(f"Checksum of {self.dst} does not match {self.src}")
+        return self.src_checksum.hexdigest()
+
+
+class FileMirror:
+    """
+    mirrors the growing files of a recording into a destination folder during the acquisition.
+    Every interval the new complete blocks of the binary files are appended to their copies, so at the end
+    only the tail is left to copy and verify (finish). get_files returns the current files of the recording
+    """
+
+    def __init__(self, get_files, destination: (str, Path), interval: float = 5):
+        self.get_files = get_files
+        self.destination = Path(destination)
+        self.interval = interval
+        self.files = {}  # source path: MirroredFile
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.log = logging.getLogger('FileMirror')
+        self.destination.mkdir(parents=True, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.mirror_round()
+            except OSError as e:
+                self.log.warning(f"Mirroring to {self.destination} failed, retrying next round: {e}")
+
+    def mirror_round(self, final: bool = False, progress=None):
+        with self.lock:
+            for file_name in map(Path, self.get_files()):
+                if file_name.suffix != '.bin':  # small files like the manifest are rewritten, copied at the end
+                    continue
+                if file_name not in self.files:
+                    self.files[file_name] = MirroredFile(file_name, self.destination / file_name.name)
+                report = ((lambda done, total, name=file_name.name: progress(name, done, total))
+                          if progress is not None else None)
+                self.files[file_name].update(final, progress=report)
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def discard(self):
+        """stops mirroring and removes the partial copies, if the recording is copied elsewhere"""
+        self.stop()
+        with self.lock:
+            for mirrored in self.files.values():
+                self.log.info(f"Removing the partial copy {mirrored.dst}")
+                mirrored.dst.unlink(missing_ok=True)
+            self.files = {}
+
+    def finish(self, progress=None) -> dict:
+        """copies the remaining tails, returns the verified checksums of the mirrored files"""
+        self.stop()
+        self.mirror_round(final=True, progress=progress)
+        return {file_name.name: mirrored.verify() for file_name, mirrored in self.files.items()}
+
+
+class CopyWorker:
+    """
+    copies recordings in a background thread, one job (a list of files) after the other.
+    on_progress(file_name, bytes_done, bytes_total) is throttled to PROGRESS_INTERVAL,
+    on_done(success, checksums, error) is called from the worker thread when a job finished
+    """
+
+    def __init__(self, on_progress=None, on_done=None):
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.jobs = queue.Queue()
+        self.is_busy = False
+        self.log = logging.getLogger('CopyWorker')
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, file_names: list, destination: (str, Path), mirror: (FileMirror, None) = None):
+        """copies the files, files which were mirrored into the destination only get their tail copied"""
+        self.is_busy = True
+        self.jobs.put(([Path(file_name) for file_name in file_names], Path(destination), mirror))
+
+    def run(self):
+        while True:
+            file_names, destination, mirror = self.jobs.get()
+            checksums = {}
+            error = None
+            try:
+                if mirror is not None and mirror.destination != destination:
+                    self.log.info(f"Discarding the mirror in {mirror.destination}, copying to {destination}")
+                    mirror.discard()
+                    mirror = None
+                destination.mkdir(parents=True, exist_ok=True)
+                if mirror is not None:
+                    self.log.info(f"Finishing the mirror in {destination}")
+                    checksums.update(mirror.finish(self.mirror_progress))
+                for file_name in file_names:
+                    if file_name.name not in checksums:
+                        checksums[file_name.name] = self.copy(file_name, destination / file_name.name)
+            except OSError as e:
+                self.log.error(f"Copying to {destination} failed: {e}")
+                error = str(e)
+            except Exception as e:  # the client still gets its reply and the worker stays alive for the next job
+                self.log.exception(f"Copying to {destination} failed")
+                error = f"{type(e).__name__}: {e}"
+            if mirror is not None:  # a failed job must not leave the mirror thread running
+                mirror.stop()
+            self.is_busy = not self.jobs.empty()
+            if self.on_done is not None:
+                try:
+                    self.on_done(error is None, checksums, error)
+                except Exception:
+                    self.log.exception('Reporting the copy result failed')
+
+    def copy(self, src: Path, dst: Path) -> str:
+        self.log.info(f"Copying {src} to {dst}")
+        last_report = 0
+
+        def progress(bytes_done, bytes_total):
+            nonlocal last_report
+            if self.on_progress is not None and (time.monotonic() - last_report > PROGRESS_INTERVAL
+                                                 or bytes_done == bytes_total):
+                last_report = time.monotonic()
+                self.on_progress(src.name, bytes_done, bytes_total)
+
+        return copy_file(src, dst, progress)
+
+    def mirror_progress(self, file_name: str, bytes_done: int, bytes_total: int):
+        if self.on_progress is not None:
+            self.on_progress(file_name, bytes_done, bytes_total)
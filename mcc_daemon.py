@@ -0,0 +1,172 @@
+"""
+Headless recorder for rigs which are only controlled remotely. Runs the MCCBoard, the recording pipeline and the
+control server without Qt, with the same settings files and message protocol as the GUI:
+
+    python mcc_daemon.py --settings MCC_settings_default.json --host 0.0.0.0
+
+With several devices (--device 0 1) the boards are recorded together by a MultiBoardManager, the first one drives
+the clock of the others unless --independent_clocks is set
+"""
+
+import argparse
+import logging
+import queue
+import sys
+import time
+from pathlib import Path
+
+from MCC_Board_linux import MCCBoard
+from multi_board import MultiBoardManager
+from settings_utils import MCC_settings
+from socket_utils import ControlServer
+from control_utils import RemoteControl
+
+HOST = "localhost"
+PORT = 8800
+TRANSFER_PORT = 8802
+STATUS_INTERVAL = 0.5  # s between status checks while no command arrives (e.g. armed -> recording)
+BOARD_STATS_INTERVAL = 10  # s between logged throughput and skew of several boards
+
+log = logging.getLogger('main')
+
+
+class MCCDaemon(RemoteControl):
+    """
+    the remote control part of the GUI without its widgets. Commands arrive on the thread of the control server
+    and are handled one after the other by the thread calling run
+    """
+
+    def __init__(self, settings_file: (str, Path) = 'MCC_settings_default.json', host: str = HOST,
+                 port: int = PORT, transfer_port: int = TRANSFER_PORT, device_indices: (list, tuple) = (0,),
+                 shared_clock: bool = True):
+        self.settings_file = settings_file
+        self.device_indices = list(device_indices)
+        self.is_running = False
+        self.last_stats_time = 0
+        self.messages = queue.Queue()
+        self.settings = MCC_settings()
+        self.mcc_board = MultiBoardManager(shared_clock) if len(self.device_indices) > 1 else MCCBoard()
+        self.mcc_board.use_queues = False  # nothing is plotted
+        self.log = logging.getLogger('Daemon')
+        self.setup_remote_control(host, transfer_port)
+        self.socket_comm = ControlServer(host=host, port=port,
+                                         on_message=lambda message, client_id: self.messages.put((message, client_id)))
+
+    def connect_to_device(self) -> bool:
+        devices = self.mcc_board.scan_devices()
+        if not devices or max(self.device_indices) >= len(devices):
+            self.log.error(f"MCC device(s) {self.device_indices} not found, found {devices}")
+            return False
+        if isinstance(self.mcc_board, MultiBoardManager):
+            self.mcc_board.connect_to_devices(self.device_indices)
+        else:
+            self.mcc_board.connect_to_device(self.device_indices[0])
+        self.mcc_board.reset_counters()
+        self.log.info(f"Connected to {[devices[idx] for idx in self.device_indices]}")
+        return self.mcc_board.is_connected
+
+    def log_board_stats(self):
+        """throughput and skew of several boards recorded together"""
+        if (not isinstance(self.mcc_board, MultiBoardManager) or not self.mcc_board.is_running
+                or time.monotonic() - self.last_stats_time < BOARD_STATS_INTERVAL):
+            return
+        self.last_stats_time = time.monotonic()
+        for stats in self.mcc_board.get_stats():
+            if stats['running']:
+                self.log.info(f"Board {stats['board']}: {stats['throughput']:0.1f} samples/s, "
+                              f"skew {stats['skew_ms']:0.3f} ms")
+            else:
+                self.log.warning(f"Board {stats['board']} is not scanning")
+
+    def load_settings_fromfile(self, settings_file: (str, Path)):
+        self.settings.from_file(Path(settings_file))
+
+    def get_settings(self):
+        """completes the settings of the file with the connected board, like the GUI does from its widgets"""
+        try:
+            self.settings.device = self.mcc_board.daq_device.product_name
+        except AttributeError:
+            pass
+        self.settings.get_active_channels()
+
+    ### DAQ Board interaction
+    def run_daq(self):
+        self.get_settings()
+        self.mcc_board.reset_counters()
+        self.mcc_board.start_viewing(self.settings)
+
+    def record_daq(self):
+        """a running viewing scan is recorded without restarting it if the settings allow"""
+        self.get_settings()
+        self.files_copied = False
+        if self.mcc_board.is_viewing:
+            if self.mcc_board.attach_recording(self.settings):
+                return
+            self.stop_daq()
+        self.mcc_board.reset_counters()
+        self.mcc_board.start_recording(self.settings)
+
+    def stop_daq(self):
+        self.mcc_board.stop_recording()
+
+    def start_stop_pulses(self, lag: float = 0):
+        if not self.mcc_board.is_pulsing:
+            self.mcc_board.start_pulsing(self.settings.pulse_rate, lag=lag)
+        else:
+            self.mcc_board.stop_pulsing()
+
+    ### main loop
+    def run(self):
+        """handles commands until stop is called, the thread sleeps while no command arrives"""
+        if Path(self.settings_file).exists():
+            self.load_settings_fromfile(self.settings_file)
+        self.connect_to_device()
+        self.socket_comm.start()
+        self.is_running = True
+        while self.is_running:
+            try:
+                message, client_id = self.messages.get(timeout=STATUS_INTERVAL)
+            except queue.Empty:
+                self.push_status()  # e.g. a trigger arrived
+                self.log_board_stats()
+                continue
+            self.handle_remote_message(message, client_id)
+        self.shutdown()
+
+    def stop(self):
+        self.is_running = False
+
+    def shutdown(self):
+        self.socket_comm.close_socket()
+        self.stop_file_services()
+        if self.mcc_board.is_recording or self.mcc_board.is_viewing:
+            self.mcc_board.stop_recording()
+        if self.mcc_board.is_connected:
+            self.mcc_board.release_device()
+
+
+def start_daemon(argv: (list, None) = None):
+    parser = argparse.ArgumentParser(description='Headless MCC recorder, controlled via the socket protocol')
+    parser.add_argument('--settings', type=str, default='MCC_settings_default.json', help='Settings file')
+    parser.add_argument('--host', type=str, default=HOST, help='Address the control server listens on')
+    parser.add_argument('--port', type=int, default=PORT, help='Port of the control server')
+    parser.add_argument('--transfer_port', type=int, default=TRANSFER_PORT, help='Port of the data connection')
+    parser.add_argument('--device', type=int, nargs='+', default=[0],
+                        help='Index of the MCC device, several devices are recorded together')
+    parser.add_argument('--independent_clocks', action='store_true',
+                        help='Several devices run on their own clocks instead of the pacer of the first one')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    t_start = time.perf_counter()
+    daemon = MCCDaemon(args.settings, args.host, args.port, args.transfer_port, args.device,
+                       shared_clock=not args.independent_clocks)
+    log.info(f"Daemon set up in {time.perf_counter() - t_start:0.3f} s")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        log.info('Stopping the daemon')
+        daemon.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(start_daemon())
@@ -0,0 +1,245 @@
+import logging
+import copy
+import time
+
+import numpy as np
+
+from settings_utils import MCC_settings
+from MCC_Board_linux import MCCBoard, OS_TYPE
+
+
+class MultiBoardManager:
+    """
+    Runs several MCC boards side by side, every board acquires in its own thread (MCCBoard).
+    With a shared clock the first board drives the scans of the others via its pacer output, so sample n of
+    every board belongs to the same clock tick. The pacer output of the first board has to be wired to the
+    external clock input of the others.
+    The manager can stand in for a single MCCBoard in the daemon (mcc_daemon.py --device 0 1), pulses come from
+    the first board
+    """
+
+    def __init__(self, shared_clock: bool = True):
+        self.boards = []
+        self.shared_clock = shared_clock
+        self.use_queues = True  # handed to the boards when connecting
+        self.last_stats = {}
+        self.log = logging.getLogger('Multi-Board')
+
+    @property
+    def is_running(self) -> bool:
+        return any(board.is_recording or board.is_viewing for board in self.boards)
+
+    @property
+    def is_connected(self) -> bool:
+        return bool(self.boards) and all(board.is_connected for board in self.boards)
+
+    @property
+    def is_recording(self) -> bool:
+        return any(board.is_recording for board in self.boards)
+
+    @property
+    def is_viewing(self) -> bool:
+        return any(board.is_viewing for board in self.boards)
+
+    @property
+    def is_armed(self) -> bool:
+        return any(board.is_armed for board in self.boards)
+
+    @property
+    def is_pulsing(self) -> bool:
+        return bool(self.boards) and self.boards[0].is_pulsing
+
+    @property
+    def file_name(self):
+        return self.boards[0].file_name if self.boards else None
+
+    @property
+    def recorded_files(self) -> list:
+        return [file_name for board in self.boards for file_name in board.recorded_files]
+
+    @property
+    def recording_files(self) -> list:
+        return [file_name for board in self.boards for file_name in board.recording_files]
+
+    def scan_devices(self) -> list:
+        return MCCBoard().scan_devices()
+
+    def connect_to_devices(self, device_indices: list):
+        """connects one MCCBoard per device, the first device is the clock master"""
+        self.boards = []
+        for board_num, idx in enumerate(device_indices):
+            board = MCCBoard()
+            board.board_num = board_num
+            board.scan_devices()
+            board.connect_to_device(idx)
+            board.file_suffix = f"_board{board_num}"
+            board.use_queues = self.use_queues
+            self.boards.append(board)
+        self.set_clock_sources()
+
+    def set_clock_sources(self):
+        if self.shared_clock and OS_TYPE != 'Linux':
+            self.log.warning('Sharing the pacer clock is only implemented for linux, boards run independently')
+            self.shared_clock = False
+        for board_num, board in enumerate(self.boards):
+            if not self.shared_clock or len(self.boards) == 1:
+                board.clock_source = 'internal'
+            else:
+                board.clock_source = 'pacer_out' if board_num == 0 else 'external'
+
+    def get_board_settings(self, settings: (MCC_settings, list)) -> list:
+        """one settings object per board, a single one is used for all boards"""
+        if isinstance(settings, MCC_settings):
+            settings = [settings for _ in self.boards]
+        if len(settings) != len(self.boards):
+            raise ValueError(f"Got {len(settings)} settings for {len(self.boards)} boards")
+        settings = [copy.deepcopy(board_settings) for board_settings in settings]
+        if self.shared_clock and len({board_settings.sampling_rate for board_settings in settings}) > 1:
+            raise ValueError('Boards sharing a clock need the same sampling rate')
+        if self.shared_clock and len(self.boards) > 1:
+            # the history of every board ends at its own chunk boundary of the previous scan,
+            # it is neither continuous with the synchronized scan nor aligned across the boards
+            if any(board_settings.pretrigger_duration > 0 for board_settings in settings):
+                self.log.warning('Pre-trigger history is disabled for boards sharing a clock')
+            for board_settings in settings:
+                board_settings.pretrigger_duration = 0
+        return settings
+
+    def start(self, settings: (MCC_settings, list), record: bool = True, timeout: float = 5):
+        """
+        starts all boards, the clock followers first so they wait for the pacer of the master board
+        and start with its first sample
+        """
+        settings = self.get_board_settings(settings)
+        order = list(range(1, len(self.boards))) + [0] if self.shared_clock else range(len(self.boards))
+        for board_num in order:
+            board = self.boards[board_num]
+            board.actual_rate = None
+            board.reset_counters()
+            if record:
+                board.start_recording(settings[board_num])
+            else:
+                board.start_viewing(settings[board_num])
+            if self.shared_clock and board_num != 0:
+                self.wait_for_scan(board, timeout)
+        self.last_stats = {}
+
+    def start_recording(self, settings: (MCC_settings, list)):
+        self.start(settings, record=True)
+
+    def attach_recording(self, settings: (MCC_settings, list)) -> bool:
+        """the boards are restarted for a recording, to start them on the same clock tick"""
+        return False
+
+    def reset_counters(self):
+        for board in self.boards:
+            board.reset_counters()
+
+    def start_pulsing(self, freq: float = 30, lag: float = 0):
+        self.boards[0].start_pulsing(freq, lag=lag)
+
+    def stop_pulsing(self):
+        self.boards[0].stop_pulsing()
+
+    def start_viewing(self, settings: (MCC_settings, list)):
+        self.start(settings, record=False)
+
+    def wait_for_scan(self, board: MCCBoard, timeout: float):
+        t_start = time.monotonic()
+        while board.actual_rate is None:
+            if time.monotonic() - t_start > timeout:
+                raise RuntimeError(f"Board {board.board_num} did not start scanning")
+            time.sleep(0.001)
+
+    def stop_recording(self):
+        """stops the master first, which stops the clock of the followers"""
+        for board in self.boards:
+            if board.is_recording or board.is_viewing:
+                board.stop_recording()
+
+    def get_stats(self) -> list:
+        """
+        returns per board the throughput (samples/s since the last call) and the skew against the first board,
+        the scan counts are extrapolated to a common host time for the skew
+        """
+        now_ns = time.monotonic_ns()
+        stats = []
+        reference_count = None
+        for board in self.boards:
+            if board.last_clock_point is None or not board.actual_rate:
+                stats.append({'board': board.board_num, 'device_id': board.device_id, 'running': False})
+                continue
+            scan_count, clock_ns, _ = board.last_clock_point
+            count_now = scan_count + (now_ns - clock_ns) / 1e9 * board.actual_rate
+            # a scan which was not armed for a trigger started about when it was started
+            start_ns = board.trigger_info.get('arm_monotonic_ns', int(board.start_rec_time * 1e9))
+            last_count, last_ns = self.last_stats.get(board.board_num, (0, start_ns))
+            throughput = (scan_count - last_count) / max((clock_ns - last_ns) / 1e9, 1e-9)
+            self.last_stats[board.board_num] = (scan_count, clock_ns)
+            if reference_count is None:
+                reference_count = count_now
+            skew_samples = count_now - reference_count
+            stats.append({'board': board.board_num, 'device_id': board.device_id, 'running': True,
+                          'clock_source': board.clock_source, 'scan_count': scan_count,
+                          'actual_rate': board.actual_rate, 'throughput': throughput,
+                          'skew_samples': skew_samples, 'skew_ms': skew_samples / board.actual_rate * 1e3})
+        return stats
+
+    def release_devices(self):
+        for board in self.boards:
+            board.release_device()
+        self.boards = []
+
+    def release_device(self):
+        self.release_devices()
+
+
+class MultiBoardReader:
+    """
+    reads the recordings of several boards and merges them into the sample timeline of the first board.
+    With a shared clock the samples are matched by scan index, otherwise by the fitted wall-clock time of
+    the clock tables (nearest sample)
+    """
+
+    def __init__(self, file_names: list, shared_clock: bool = True):
+        from GUI_utils import MyBinaryFile_Reader  # the manager itself is used without Qt
+        self.readers = [MyBinaryFile_Reader(file_name) for file_name in file_names]
+        self.shared_clock = shared_clock
+        self.sampling_rate = self.readers[0].sampling_rate
+        self.channel_names = []
+        self.data = None
+        self.merge()
+        self.make_fields_toproperties()
+
+    @staticmethod
+    def get_scan_rows(reader) -> np.ndarray:
+        """
+        the rows of the synchronized scan, a pre-trigger history in front of it came from an earlier scan
+        and is not aligned across the boards
+        """
+        return reader.data[reader.header.get('pretrigger_samples', 0):]
+
+    def merge(self):
+        for board_num, reader in enumerate(self.readers):
+            self.channel_names += [f"B{board_num}_{name}" for name in reader.channel_names]
+        if self.shared_clock:
+            first_samples = [reader.header.get('recording_start_sample', 0) for reader in self.readers]
+            scan_rows = [self.get_scan_rows(reader) for reader in self.readers]
+            start = max(first_samples)
+            end = min(first + rows.shape[0] for first, rows in zip(first_samples, scan_rows))
+            self.data = np.hstack([rows[start - first:end - first] for first, rows in zip(first_samples, scan_rows)])
+        else:
+            reference_times = self.readers[0].sample_to_time(np.arange(self.readers[0].data.shape[0]))
+            columns = [self.readers[0].data]
+            for reader in self.readers[1:]:
+                times = reader.sample_to_time(np.arange(reader.data.shape[0]))
+                idx = np.clip(np.searchsorted(times, reference_times), 1, len(times) - 1)
+                idx -= (reference_times - times[idx - 1]) < (times[idx] - reference_times)
+                columns.append(reader.data[idx])
+            self.data = np.hstack(columns)
+        self.rec_duration = self.data.shape[0] / self.sampling_rate
+
+    def make_fields_toproperties(self):
+        '''this adds the channel names as fields to the class'''
+        for idx, channel_name in enumerate(self.channel_names):
+            self.__dict__[channel_name] = self.data[:, idx]
@@ -3,23 +3,46 @@
 import logging
 import numpy as np
 import re
-import pyqtgraph as pg
 from datetime import datetime
 # from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
+from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtWidgets import QWidget, QCheckBox, QLabel, QSpinBox, QHBoxLayout, QVBoxLayout
 from GUI_utils import MCC_settings, PlotWindowEnum, TimeBases, YRanges, MAX_GRAPHS
 
 history_dur = 10
+MIN_PLOT_BINS = 500  # min/max bins per line at least, otherwise one bin per pixel of the plot width
+pg = None  # pyqtgraph is imported with the first plot, showing the window does not need it
+
+
+def import_pyqtgraph():
+    global pg
+    if pg is None:
+        import pyqtgraph
+        pg = pyqtgraph
+    return pg
 
 
 # Analog_plot ------------------------------------------------------
 class MultiplotWidget(QWidget):
+    """
+    the graphs of a viewer tab, they are only created when the tab is shown the first time
+    (plots_created is emitted then)
+    """
+    plots_created = pyqtSignal()
+
     def __init__(self, parent=None, nr_plots=3, idx=0):
         super().__init__(parent)
         self._nr_plots = nr_plots
         self.layout = QVBoxLayout(self)
         self.list_of_plots = []
-        self.adjust_current_widget()
+        self.is_built = False
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.is_built:
+            self.is_built = True
+            self.adjust_current_widget()
+            self.plots_created.emit()
 
     @property
     def nr_plots(self) -> int:
@@ -34,6 +57,8 @@ class MultiplotWidget(QWidget):
         self.adjust_current_widget()
 
     def adjust_current_widget(self):
+        if not self.is_built:
+            return
         for plot in self.list_of_plots:
             self.layout.removeWidget(plot)
         self.list_of_plots = []
@@ -51,6 +76,7 @@ class Analog_plot(QWidget):
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        import_pyqtgraph()
 
         # Create axis
         self.axis = pg.PlotWidget(title=f"Analog Plot", labels={'left': 'Volts'})
@@ -80,6 +106,15 @@ class Analog_plot(QWidget):
         self.vertical_layout.addWidget(self.axis)
         self.setLayout(self.vertical_layout)
         self.log = logging.getLogger('Plotter')
+        self.ADCs = []
+        self.decimated = []
+        self.plot_lines = []
+        self.is_dirty = False  # the histories changed since they were last drawn
+
+    def showEvent(self, event):
+        # plots on hidden tabs are only drawn again once they are shown
+        super().showEvent(event)
+        self.draw_lines()
 
     def reset(self, settings: MCC_settings, win_id=0):
         try:
@@ -100,11 +135,16 @@ class Analog_plot(QWidget):
 
         self.axis.clear()
         self.axis.setTitle(f"Analog {PlotWindowEnum(win_id).name}")
-        self.ADCs = [Signal_history(history_length) for _ in range(nr_lines)]  # * nr_lines
+        self.ADCs = [Signal_history(history_length, sample_time=1 / settings.sampling_rate)
+                     for _ in range(nr_lines)]
+        # long histories are drawn as min/max per bin, about two points per pixel
+        num_bins = max(self.axis.width(), MIN_PLOT_BINS)
+        self.decimated = [MinMax_history(ADC, num_bins) if history_length > 2 * num_bins else None
+                          for ADC in self.ADCs]
         self.plot_lines = list()
+        self.is_dirty = False
         for name, c in zip(names, colors):
             self.plot_lines.append(self.axis.plot(pen=pg.mkPen(c), name=name))
-        self.x = np.linspace(-dur, 0, history_length)  # X axis for timeseries plots.
         try:
             # yrange = int(re.findall(r'\d', "settings.voltage_range")[0])
             yrange = YRanges(settings.graphsettings[PlotWindowEnum(win_id).name]["Yrange"]).name
@@ -125,19 +165,34 @@ class Analog_plot(QWidget):
         self.axis.setYRange(yrange_min, yrange_max, padding=0)
         self.axis.setXRange(-dur, dur * 0.02, padding=0)
 
-    def update_new(self, new_ADCs: list):
+    def update_new(self, new_ADCs: list, render: bool = True):
+        """
+        adds the new samples to the histories, the lines are only drawn if the plot is visible and render is set.
+        Hidden plots keep their histories and are drawn when they are shown
+        """
         for ADC_id, new_val in enumerate(new_ADCs):
-            self.ADCs[ADC_id].update(new_val)
-
-        if self.AC_mode:
-            # Plot signals with mean removed.
-            for ADC, plot in zip(self.ADCs, self.plot_lines):
-                y = ADC.history - np.mean(ADC.history) \
-                    + self.offset_spinbox.value() / 1000
-                plot.setData(self.x, y)
-        else:
-            for ADC, plot in zip(self.ADCs, self.plot_lines):
-                plot.setData(self.x, ADC.history)
+            if len(new_val):
+                self.ADCs[ADC_id].update(new_val)
+                self.is_dirty = True
+        if render:
+            self.draw_lines()
+
+    def draw_lines(self):
+        """draws the histories if they changed since the last time and the plot is on screen"""
+        if not self.is_dirty or not self.isVisible():
+            return
+        self.is_dirty = False
+        for ADC, decimated, plot in zip(self.ADCs, self.decimated, self.plot_lines):
+            if decimated is not None:  # catches up on all bins written since it was last drawn
+                decimated.update()
+            # the ring is plotted in storage order at the time of its samples, the line is moved so the newest
+            # sample is at 0 s. De-meaning moves it vertically
+            y_offset = 0
+            if self.AC_mode:
+                y_offset = self.offset_spinbox.value() / 1000 - np.mean(ADC.buffer)
+            line = ADC if decimated is None else decimated
+            plot.setData(line.times, line.buffer, connect=line.connect)
+            plot.setPos(-ADC.newest_time, y_offset)
 
     def update(self, new_ADC1, new_ADC2):
         new_ADC1 = 3.3 * new_ADC1 / (1 << 15)  # Convert to Volts.
@@ -172,6 +227,7 @@ class Analog_plot(QWidget):
 class Digital_plot():
 
     def __init__(self):
+        import_pyqtgraph()
         self.axis = pg.PlotWidget(title="Digital signal", labels={'left': 'Level', 'bottom': 'Time (seconds)'})
         self.axis.addLegend(offset=(10, 10))
         self.plot_1 = self.axis.plot(pen=pg.mkPen('b'), name='digital 1')
@@ -181,8 +237,8 @@ class Digital_plot():
 
     def reset(self, sampling_rate):
         history_length = int(sampling_rate * history_dur)
-        self.DI1 = Signal_history(history_length, int)
-        self.DI2 = Signal_history(history_length, int)
+        self.DI1 = Signal_history(history_length, int, 1 / sampling_rate)
+        self.DI2 = Signal_history(history_length, int, 1 / sampling_rate)
         self.x = np.linspace(-history_dur, 0, history_length)  # X axis for timeseries plots.
 
     def update(self, new_DI1, new_DI2):
@@ -234,16 +290,98 @@ class Digital_plot():
 # Signal_history ------------------------------------------------------------
 
 class Signal_history():
-    # Buffer to store the recent history of a signal.
+    """
+    Preallocated circular buffer with the recent history of a signal, update only writes the new samples.
+    times holds the time (s) of the sample in every slot and connect breaks the line between the newest and the
+    oldest slot, so the buffer can be plotted as it is stored
+    """
+
+    def __init__(self, history_length, dtype=float, sample_time=1.0):
+        self.length = max(int(history_length), 1)
+        self.sample_time = sample_time
+        self.buffer = np.zeros(self.length, dtype)
+        # before the first update the history holds zeros in the past
+        self.times = np.arange(-self.length, 0) * sample_time
+        self.connect = np.ones(self.length, bool)
+        self.connect[-1] = False
+        self.write_count = 0  # samples written since the reset
 
-    def __init__(self, history_length, dtype=float):
-        self.history = np.zeros(history_length, dtype)
+    @property
+    def newest_time(self) -> float:
+        return (self.write_count - 1) * self.sample_time
+
+    @property
+    def history(self) -> np.ndarray:
+        """copy of the history in chronological order"""
+        start = self.write_count % self.length
+        return np.concatenate((self.buffer[start:], self.buffer[:start]))
 
     def update(self, new_data):
-        # Move old data along buffer, store new data samples.
+        # store the new data samples over the oldest ones
         data_len = len(new_data)
-        self.history = np.roll(self.history, -data_len)
-        self.history[-data_len:] = new_data
+        if data_len == 0:
+            return
+        self.connect[(self.write_count - 1) % self.length] = True
+        if data_len > self.length:
+            self.write_count += data_len - self.length
+            new_data = new_data[-self.length:]
+            data_len = self.length
+        start = self.write_count % self.length
+        first_part = min(data_len, self.length - start)
+        self.buffer[start:start + first_part] = new_data[:first_part]
+        self.buffer[:data_len - first_part] = new_data[first_part:]
+        self.times[start:start + first_part] = np.arange(self.write_count, self.write_count + first_part) * \
+            self.sample_time
+        self.times[:data_len - first_part] = np.arange(self.write_count + first_part, self.write_count + data_len) * \
+            self.sample_time
+        self.write_count += data_len
+        self.connect[(self.write_count - 1) % self.length] = False
+
+class MinMax_history():
+    """
+    Peak preserving decimation of a Signal_history for plotting. The samples are binned by their index since the
+    reset and every bin is drawn as its minimum and maximum, so pulses shorter than a pixel stay visible.
+    The bins are kept in a ring like the samples, an update only computes the bins with new samples
+    """
+
+    def __init__(self, history: Signal_history, num_bins: int):
+        self.history = history
+        self.bin_size = max(-(-history.length // int(num_bins)), 1)
+        self.num_bins = -(-history.length // self.bin_size) + 1  # the newest bin is incomplete
+        self.buffer = np.zeros(2 * self.num_bins, history.buffer.dtype)
+        self.times = np.zeros(2 * self.num_bins)
+        bins = np.arange(-self.num_bins, 0)
+        self.set_times(bins)
+        self.connect = np.ones(2 * self.num_bins, bool)
+        self.newest_bin = -1
+        self.connect[2 * (self.newest_bin % self.num_bins) + 1] = False
+        self.next_bin = 0  # first bin which is not complete yet
+
+    def set_times(self, bins: np.ndarray):
+        slots = bins % self.num_bins
+        self.times[2 * slots] = self.times[2 * slots + 1] = (bins * self.bin_size + (self.bin_size - 1) / 2) * \
+            self.history.sample_time
+
+    def update(self):
+        """recomputes the bins holding samples written since the last update"""
+        history = self.history
+        end = history.write_count
+        if end == 0:
+            return
+        start = max(self.next_bin * self.bin_size, end - history.length)
+        first_bin = start // self.bin_size
+        last_bin = (end - 1) // self.bin_size
+        samples = history.buffer[np.arange(start, end) % history.length]
+        bins = np.arange(first_bin, last_bin + 1)
+        bin_starts = np.maximum(bins * self.bin_size, start) - start
+        slots = bins % self.num_bins
+        self.buffer[2 * slots] = np.minimum.reduceat(samples, bin_starts)
+        self.buffer[2 * slots + 1] = np.maximum.reduceat(samples, bin_starts)
+        self.set_times(bins)
+        self.connect[2 * (self.newest_bin % self.num_bins) + 1] = True
+        self.connect[2 * (last_bin % self.num_bins) + 1] = False
+        self.newest_bin = last_bin
+        self.next_bin = last_bin + 1 if end % self.bin_size == 0 else last_bin
 
 # Record_clock ----------------------------------------------------
 #
@@ -0,0 +1,331 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+
+TRAILER_MAGIC = b'MCCTRAIL'
+
+
+def write_trailer(fi, trailer: dict):
+    """appends a json block after the samples, followed by its length and a magic marker"""
+    trailer = json.dumps(trailer).encode()
+    fi.write(trailer)
+    fi.write(len(trailer).to_bytes(8, 'little'))
+    fi.write(TRAILER_MAGIC)
+
+
+def read_trailer(fi) -> tuple:
+    """returns the trailer of an open binary file (empty if there is none) and the file position where it starts"""
+    fi.seek(0, 2)
+    file_end = fi.tell()
+    if file_end >= 16:
+        fi.seek(file_end - 16)
+        trailer_length = int.from_bytes(fi.read(8), 'little')
+        if fi.read(8) == TRAILER_MAGIC and trailer_length <= file_end - 16:
+            trailer_start = file_end - 16 - trailer_length
+            fi.seek(trailer_start)
+            return json.loads(fi.read(trailer_length).decode('utf-8')), trailer_start
+    return {}, file_end
+
+
+def unwrap_counter(counts, bits: int = 32):
+    """
+    converts scanned counter values, which wrap around at 2**bits in both directions,
+    into a continuous int64 count. Steps larger than half the counter range are treated as wraps
+    """
+    counts = np.asarray(counts).astype(np.int64)
+    if counts.size == 0:
+        return counts
+    span = 1 << bits
+    steps = np.diff(counts)
+    steps = (steps + span // 2) % span - span // 2
+    return counts[0] + np.concatenate(([0], np.cumsum(steps)))
+
+
+def fit_clock_table(clock_table, nominal_rate: float) -> dict:
+    """
+    least-squares fit of the host wall-clock against the sample index of a clock table
+    (rows of sample, time.monotonic_ns, time.time_ns). The rate is taken from the monotonic clock, which does
+    not jump, the offset from the wall-clock. Returns the fitted rate, its drift against the nominal rate in ppm
+    and the residual jitter of the clock points
+    """
+    clock_table = np.asarray(clock_table, dtype=np.int64).reshape(-1, 3)
+    if clock_table.shape[0] < 2:
+        raise ValueError('clock table needs at least two points for a fit')
+    # relative to the first point to keep the ns precision in float64
+    sample_offset = int(clock_table[0, 0])
+    samples = (clock_table[:, 0] - sample_offset).astype(float)
+    monotonic_s = (clock_table[:, 1] - clock_table[0, 1]) / 1e9
+    wall_s = (clock_table[:, 2] - clock_table[0, 2]) / 1e9
+    seconds_per_sample, monotonic_intercept = np.polyfit(samples, monotonic_s, 1)
+    residuals = monotonic_s - (monotonic_intercept + seconds_per_sample * samples)
+    wall_intercept = np.mean(wall_s - seconds_per_sample * samples)
+    return {'sample_offset': sample_offset,
+            'time_offset_ns': int(clock_table[0, 2]) + int(round(wall_intercept * 1e9)),
+            'seconds_per_sample': seconds_per_sample,
+            'fitted_rate': 1 / seconds_per_sample,
+            'drift_ppm': (nominal_rate * seconds_per_sample - 1) * 1e6,
+            'jitter_s': float(np.std(residuals))}
+
+
+def get_manifest_name(file_name: (str, Path)) -> Path:
+    """name of the manifest listing the segments of a recording"""
+    file_name = Path(file_name)
+    return file_name.with_name(f"{file_name.stem}.manifest.json")
+
+
+def get_clock_file_name(file_name: (str, Path)) -> Path:
+    """name of the file the clock table of a recording is appended to while recording"""
+    file_name = Path(file_name)
+    return file_name.with_name(f"{file_name.stem}.clock.jsonl")
+
+
+def read_clock_table(file_name: (str, Path)) -> list:
+    """
+    reads the clock table of a recording from its clock file, one (sample, time.monotonic_ns, time.time_ns) row
+    per line. A line cut off by a crash is skipped
+    """
+    clock_table = []
+    with open(get_clock_file_name(file_name), 'r') as fi:
+        for line in fi:
+            try:
+                clock_table.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return clock_table
+
+
+def get_segment_name(file_name: (str, Path), segment_index: int) -> Path:
+    """the first segment keeps the name of the recording, the following ones are numbered"""
+    file_name = Path(file_name)
+    if segment_index == 0:
+        return file_name
+    return file_name.with_name(f"{file_name.stem}_seg{segment_index:03d}{file_name.suffix}")
+
+
+def get_channel_names(header: dict) -> list:
+    """names of the data columns of a recording, in the order the board scanned them"""
+    if 'scan_columns' in header:
+        return list(header['scan_columns'])
+    if 'scan_channels' in header:
+        names = {channel['id']: channel['name'] for channel in header['channel_list']}
+        return [names.get(ch_id, f"CH_{ch_id}") for ch_id in header['scan_channels']]
+    return [channel['name'] for channel in header['channel_list']]
+
+
+def map_segment(file_name: (str, Path)) -> tuple:
+    """
+    returns the header and a read-only memory map of the complete scans of a binary file, shape (samples, channels).
+    A file which is still being written is mapped up to its last complete scan
+    """
+    with open(file_name, 'rb') as fi:
+        header_length = int.from_bytes(fi.read(16), 'little')
+        header = json.loads(fi.read(header_length).decode('utf-8'))
+        _, data_end = read_trailer(fi)
+    data_start = 16 + header_length
+    num_samples = max(data_end - data_start, 0) // (8 * header['num_channels'])
+    if num_samples == 0:
+        return header, np.zeros((0, header['num_channels']))
+    return header, np.memmap(file_name, '<f8', 'r', data_start, (num_samples, header['num_channels']))
+
+
+def get_recording_segments(file_name: (str, Path)) -> list:
+    """
+    files of a recording in order, via the manifest if there is one. Segments of a running recording which
+    are not yet in the manifest are found by their names
+    """
+    file_name = Path(file_name)
+    if file_name.name.endswith('.manifest.json'):
+        manifest_name = file_name
+        file_name = file_name.with_name(file_name.name[:-len('.manifest.json')] + '.bin')
+    else:
+        manifest_name = get_manifest_name(file_name)
+    segments = [file_name]
+    if manifest_name.exists():
+        with open(manifest_name, 'r') as fi:
+            segments = [manifest_name.parent / segment['file_name'] for segment in json.load(fi)['segments']]
+    while get_segment_name(file_name, len(segments)).exists():
+        segments.append(get_segment_name(file_name, len(segments)))
+    return segments
+
+
+def read_range(file_name: (str, Path), start: float = 0, end: (float, None) = None, unit: str = 'samples',
+               channels: (list, None) = None, decimation: int = 1) -> tuple:
+    """
+    reads a window of a recording through memory maps, without loading the rest of the file. start and end are
+    sample indices or s (unit 's') from the first sample of the recording, every decimation-th sample is returned.
+    Works on a recording which is still being written, the window ends at the last complete scan.
+    Returns an info dict (channel_names, first_sample, num_samples, samples_available, ...) and the samples as
+    (samples, channels) array
+    """
+    mapped = [map_segment(segment) for segment in get_recording_segments(file_name)]
+    header = mapped[0][0]
+    sampling_rate = header['sampling_rate']
+    channel_names = get_channel_names(header)
+    columns = list(range(len(channel_names))) if channels is None else [channel_names.index(name)
+                                                                          for name in channels]
+    samples_available = sum(data.shape[0] for _, data in mapped)
+    if unit == 's':
+        start = round(start * sampling_rate)
+        end = None if end is None else round(end * sampling_rate)
+    decimation = max(int(decimation), 1)
+    start = min(max(int(start), 0), samples_available)
+    end = samples_available if end is None else min(max(int(end), start), samples_available)
+
+    blocks = []
+    segment_start = 0
+    next_sample = start
+    for _, data in mapped:
+        segment_end = segment_start + data.shape[0]
+        if next_sample < min(segment_end, end):
+            blocks.append(data[next_sample - segment_start:end - segment_start:decimation, columns])
+            next_sample += blocks[-1].shape[0] * decimation
+        segment_start = segment_end
+    data = np.concatenate(blocks) if blocks else np.zeros((0, len(columns)))
+    info = {'channel_names': [channel_names[idx] for idx in columns], 'first_sample': start,
+            'num_samples': data.shape[0], 'decimation': decimation, 'sampling_rate': sampling_rate / decimation,
+            'samples_available': samples_available}
+    return info, np.ascontiguousarray(data, '<f8')
+
+
+class RecordingSink:
+    """
+    Writes the interleaved samples of a running scan into a binary file (16 bytes header length, json header,
+    float64 samples). The sink can be attached to a scan at any chunk boundary, the file starts with the next
+    complete scan, optionally preceded by the history of the scan before that point.
+    With segment_samples set, the recording rolls over to a new file after this number of samples, each segment
+    has its own header and a manifest lists the segments of the recording.
+    Clock points are appended to a clock file as they are added, so they survive a crash, and written to the trailer
+    of their segment when it is closed
+    """
+
+    def __init__(self, file_name: (str, Path), header: bytes, num_channels: int,
+                 history: (np.ndarray, None) = None, segment_samples: int = 0):
+        self.file_name = Path(file_name)
+        self.header = json.loads(header.decode())
+        self.num_channels = num_channels
+        self.history = history
+        self.segment_values = int(segment_samples) * num_channels  # 0 for a single file
+        self.start_count = None  # value count of the scan at which the recording starts
+        self.values_written = 0
+        self.segment_values_written = 0
+        self.segments = []
+        self.clock_table = []  # (sample, time.monotonic_ns, time.time_ns) of the current segment
+        self.fi = None
+        self.clock_fi = None
+        self.log = logging.getLogger('Recording')
+
+    @property
+    def file_names(self) -> list:
+        """all files of the recording, segments and manifest"""
+        file_names = [Path(segment['file_name']) for segment in self.segments]
+        if self.segment_values:
+            file_names.append(get_manifest_name(self.file_name))
+        if self.segments:
+            file_names.append(get_clock_file_name(self.file_name))
+        return file_names
+
+    @property
+    def is_open(self) -> bool:
+        return self.fi is not None
+
+    def open(self, chunk_start_count: int, history_ring=None, **header_fields):
+        """
+        creates the file, the recording starts with the first complete scan in the chunk starting at
+        chunk_start_count. If no history was passed on creation it is taken from the history_ring
+        """
+        self.start_count = -(-chunk_start_count // self.num_channels) * self.num_channels
+        if self.history is None and history_ring is not None:
+            self.history = history_ring.history(end_count=self.start_count)
+        pretrigger_samples = 0 if self.history is None else self.history.shape[0]
+        self.header.update(header_fields)
+        self.header.update({'recording_start_sample': self.start_count // self.num_channels,
+                            'pretrigger_samples': pretrigger_samples})
+        if self.segment_values:
+            self.header['segment_samples'] = self.segment_values // self.num_channels
+
+        self.open_segment()
+        self.clock_fi = open(get_clock_file_name(self.file_name), 'w')
+        if pretrigger_samples:
+            self.write_values(self.history.ravel())
+            self.log.debug(f'written {pretrigger_samples} samples of pre-trigger history')
+        self.history = None
+
+    def open_segment(self):
+        """starts a new segment file, its header holds the index of its first sample within the recording"""
+        file_name = get_segment_name(self.file_name, len(self.segments))
+        first_sample = self.values_written // self.num_channels
+        header = dict(self.header)
+        if self.segment_values:
+            header.update({'segment_index': len(self.segments), 'segment_start_sample': first_sample})
+        header = json.dumps(header).encode()
+
+        self.fi = open(file_name, 'wb')
+        self.log.info(f'Writing data to {file_name}')
+        self.fi.write(len(header).to_bytes(16, 'little'))
+        self.fi.write(header)
+        self.segment_values_written = 0
+        self.segments.append({'file_name': str(file_name), 'first_sample': first_sample, 'num_samples': 0})
+
+    def add_clock_point(self, scan_sample: int, monotonic_ns: int, time_ns: int):
+        """
+        links the host clocks to a sample, scan_sample is the number of scans acquired by the board at that time.
+        It is stored as the sample index within the recording and written with the current segment
+        """
+        sample = scan_sample - self.start_count // self.num_channels + self.header['pretrigger_samples']
+        self.clock_table.append((sample, monotonic_ns, time_ns))
+        self.clock_fi.write(f"[{sample}, {monotonic_ns}, {time_ns}]\n")
+        self.clock_fi.flush()
+
+    def close_segment(self):
+        # the clock table is appended after the samples, readers stop reading samples at the trailer
+        write_trailer(self.fi, {'clock_table': self.clock_table})
+        self.clock_table = []
+        self.fi.close()
+        self.fi = None
+        self.segments[-1]['num_samples'] = self.segment_values_written // self.num_channels
+        if self.segment_values:
+            self.write_manifest()
+
+    def write_manifest(self):
+        """lists the segments, the manifest is replaced at every rollover so it is valid during the recording"""
+        manifest = {'num_channels': self.num_channels,
+                    'sampling_rate': self.header.get('sampling_rate'),
+                    'num_samples': self.values_written // self.num_channels,
+                    'segments': [dict(segment, file_name=Path(segment['file_name']).name)
+                                 for segment in self.segments]}
+        manifest_name = get_manifest_name(self.file_name)
+        tmp_name = manifest_name.with_suffix('.tmp')
+        with open(tmp_name, 'w') as fi:
+            json.dump(manifest, fi, indent=1)
+        tmp_name.replace(manifest_name)
+
+    def write_values(self, values: np.ndarray):
+        """writes interleaved values, rolling over to a new segment at the segment boundary"""
+        while values.size:
+            if self.segment_values and self.segment_values_written == self.segment_values:
+                self.close_segment()
+                self.open_segment()
+            n_values = values.size
+            if self.segment_values:
+                n_values = min(n_values, self.segment_values - self.segment_values_written)
+            self.fi.write(values[:n_values].tobytes())
+            self.values_written += n_values
+            self.segment_values_written += n_values
+            values = values[n_values:]
+
+    def write(self, chunk_start_count: int, values: np.ndarray):
+        """writes a chunk of interleaved values, values before the start of the recording are skipped"""
+        skip = max(self.start_count - chunk_start_count, 0)
+        if skip < values.size:
+            self.write_values(values[skip:])
+
+    def close(self):
+        if self.fi is not None:
+            self.close_segment()
+            self.clock_fi.close()
+            self.clock_fi = None
+            self.log.info(f'Closed {self.file_name} after {self.values_written // self.num_channels} samples '
+                          f'in {len(self.segments)} file(s)')
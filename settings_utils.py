@@ -0,0 +1,161 @@
+import copy
+from pathlib import Path
+import json
+import datetime
+import logging
+
+COLOR_PALETTE = ['#023eff', '#ff7c00', '#1ac938', '#e8000b', '#8b2be2', '#9f4800', '#f14cc1', '#a3a3a3', '#ffc400',
+                 '#00d7ff', '#023eff', '#ff7c00', '#1ac938', '#e8000b', '#8b2be2', '#9f4800']
+# 'bright' from seaborn
+
+
+def is_valid_bit(bit) -> bool:
+    """checks the bit a channel is mapped to on the digital port"""
+    return isinstance(bit, int) and not isinstance(bit, bool) and bit >= 0
+
+
+class MCC_settings:
+    def __init__(self):
+        self.scan_counters = False
+        self.scan_digital = False
+        self.encoder_channels = []
+        self.trigger_mode = False
+        self.trigger_type = 'POS_EDGE'
+        self.trigger_level = 0.0
+        self.trigger_channel = 0
+        self.pretrigger_duration = 0  # s of viewing data written in front of a recording
+        self.segment_size_mb = 0  # roll over to a new file after this size, 0 for a single file
+        self.segment_duration = 0  # roll over to a new file after this many s, 0 for a single file
+        self.live_export_name = ''  # shared memory name the live data is published under, empty disables it
+        self.live_export_seconds = 10
+        self.stream_host = 'localhost'
+        self.stream_port = 0  # tcp port of the binary live data stream, 0 disables it
+        self.mirror_recording = False  # mirror the recording to the session path while recording
+        self.mirror_interval = 5  # s between mirrored batches
+        self.num_channels = None
+        self.channel_list = []
+        self.device = None
+        self.voltage_range = None
+        self.pulse_rate = 30
+        self.sampling_rate = 1000
+        self.graphsettings = {}
+        default_params_file = 'MCC_settings_default.json'
+        if Path(default_params_file).exists():
+            self.from_file(default_params_file)
+        else:
+            self.default_setting()
+
+    def to_header(self, scan_channels: (list, None) = None, scan_columns: (list, None) = None,
+                  digital_channels: (dict, None) = None) -> bytes:
+        """
+        serializes the settings for the file header,
+        scan_channels is the analog channel order as scanned by the board (defaults to the active channels),
+        scan_columns names every column of the data including digital ports and counters,
+        digital_channels maps the ids of the TTL lines unpacked from the scanned port to their bit
+        """
+        if scan_channels is None:
+            scan_channels = self.get_active_channel_ids()
+        self.get_active_channels()
+        dictionary = copy.deepcopy(vars(self))
+        dictionary['datetime'] = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        dictionary['scan_channels'] = list(scan_channels)
+        if scan_columns is not None:
+            dictionary['scan_columns'] = list(scan_columns)
+            dictionary['num_channels'] = len(scan_columns)
+        else:
+            dictionary['num_channels'] = len(scan_channels)
+        if digital_channels is not None:
+            dictionary['digital_channels'] = {str(ch_id): bit for ch_id, bit in digital_channels.items()}
+        ids_topop = []
+        for c_id, channel in enumerate(dictionary['channel_list']):
+            channel.pop('color', None)
+            channel.pop('win', None)
+            if not channel["active"]:
+                ids_topop.append(c_id)
+        dictionary.pop("graphsettings")
+        for c_id in sorted(ids_topop, reverse=True):
+            dictionary['channel_list'].pop(c_id)
+        return json.dumps(dictionary).encode()
+
+    def get_active_channel_ids(self) -> list:
+        """returns the ids of all active analog channels in ascending order"""
+        return sorted(channel['id'] for channel in self.channel_list
+                      if channel['active'] and channel.get('source', 'ai') == 'ai')
+
+    def get_digital_channels(self) -> list:
+        """
+        returns the active channels which are mapped to a bit of the digital port, channels without a valid bit
+        are skipped
+        """
+        digital_channels = []
+        for channel in self.channel_list:
+            if not channel['active'] or channel.get('source') != 'dio':
+                continue
+            bit = channel.get('bit')
+            if not is_valid_bit(bit):
+                logging.getLogger('Settings').warning(f"{channel.get('name', channel['id'])} is mapped to the "
+                                                      f"digital port without a valid bit ({bit}), skipping it")
+                continue
+            digital_channels.append(channel)
+        return digital_channels
+
+    def get_segment_samples(self, num_columns: int) -> int:
+        """samples per recording segment from the size and duration limits, 0 for a single file"""
+        limits = []
+        if self.segment_size_mb:
+            limits.append(int(self.segment_size_mb * 1024 ** 2 / (8 * num_columns)))
+        if self.segment_duration:
+            limits.append(int(self.segment_duration * self.sampling_rate))
+        return max(min(limits), 1) if limits else 0
+
+    def get_active_channels(self):
+        active_channels = self.get_active_channel_ids()
+        self.num_channels = len(active_channels)
+        if not active_channels:
+            return None, None
+        return min(active_channels), max(active_channels)
+
+    def default_setting(self, num_channels=16):
+        if num_channels == 16:
+            self.device = "USB-1608G"
+            self.voltage_range = 'BIP5VOLTS'
+        elif num_channels == 8:
+            self.voltage_range = 'BIP10VOLTS'
+            raise NotImplementedError
+        else:
+            raise NotImplementedError
+
+        for ch_id in range(num_channels):
+            channel_dict = {}
+            channel_dict['id'] = ch_id
+            channel_dict['name'] = f"Channel_{ch_id}"
+            channel_dict['active'] = True
+            channel_dict['win'] = -1
+            channel_dict['color'] = COLOR_PALETTE[ch_id]
+            self.channel_list.append(channel_dict)
+
+    def from_file(self, path2file: (str, Path)):
+        with open(path2file, 'r') as fi:
+            loaded_dict = json.load(fi)
+        for key in loaded_dict.keys():
+            if key in self.__dict__.keys():
+                self.__dict__[key] = loaded_dict[key]
+
+    def to_file(self, path2file: (str, Path)):
+        dict_to_save = vars(self)
+        with open(path2file, 'w') as fi:
+            json.dump(dict_to_save, fi, indent=4)
+
+    def add_graphsettings(self, graphsetting: dict):
+        # # throw away old settings
+        # if "A" in graphsetting.keys():
+        #     for graph_name in [el.name for el in list(PlotWindowEnum)[1:5]]:
+        #         self.graphsettings.pop(graph_name, None)
+        # elif "E" in graphsetting.keys():
+        #     for graph_name in [el.name for el in list(PlotWindowEnum)[5:9]]:
+        #         self.graphsettings.pop(graph_name, None)
+        # elif "J" in graphsetting.keys():
+        #     for graph_name in [el.name for el in list(PlotWindowEnum)[9:13]]:
+        #         self.graphsettings.pop(graph_name, None)
+
+        self.graphsettings.update({**graphsetting})
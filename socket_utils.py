@@ -1,3 +1,4 @@
+import asyncio
 import socket
 import ssl
 import threading
@@ -5,9 +6,26 @@ import json
 import time
 import select
 import logging
+import queue
+import struct
+import hashlib
+from collections import deque
+from pathlib import Path
 
 from enum import Enum
 
+import numpy as np
+
+from file_utils import CHECKSUM_ALGORITHM, file_checksum, update_checksum
+from recording_utils import read_range
+
+STREAM_MAGIC = b'MCCD'
+# magic, frame type, flags, number of channels, first sample, number of samples, payload length
+STREAM_FRAME_HEADER = struct.Struct('<4sBBHQII')
+STREAM_QUEUE_SIZE = 64  # frames buffered per subscriber before the drop policy applies
+RECV_SIZE = 65536  # bytes read from the socket at once
+TRANSFER_BLOCK_SIZE = 8 * 1024 ** 2  # bytes handed to sendfile at once
+
 
 class MessageType(Enum):
     start_daq = 'start_rec'
@@ -25,12 +43,17 @@ class MessageType(Enum):
     disconnected = 'disconnected'
     copy_files = 'copy_files'
     purge_files = 'purge_files'
+    subscribe_status = 'subscribe_status'
+    copy_progress = 'copy_progress'
+    transfer_files = 'transfer_files'
+    read_range = 'read_range'
 
 class MessageStatus(Enum):
     ready = 'ready'
     error = 'error'
     viewing = 'viewing'
     recording = 'recording'
+    armed = 'armed'
     viewing_ok = 'viewing_ok'
     recording_ok = 'recording_ok'
     recording_fail = 'recording_fail'
@@ -39,12 +62,16 @@ class MessageStatus(Enum):
     calib_ok = 'calib_ok'
     copy_ok = 'copy_ok'
     copy_fail = 'copy_fail'
+    transfer_ready = 'transfer_ready'
+    transfer_fail = 'transfer_fail'
+    read_ready = 'read_ready'
 
 class SocketMessage:
     status_error = {'type': MessageType.status.value, 'status': MessageStatus.error.value}
     status_ready = {'type': MessageType.status.value, 'status': MessageStatus.ready.value}
     status_recording = {'type': MessageType.status.value, 'status': MessageStatus.recording.value}
     status_viewing = {'type': MessageType.status.value, 'status': MessageStatus.viewing.value}
+    status_armed = {'type': MessageType.status.value, 'status': MessageStatus.armed.value}
 
     respond_recording = {'type': MessageType.response.value, 'status': MessageStatus.recording_ok.value}
     respond_recording_fail = {'type': MessageType.response.value, 'status': MessageStatus.recording_fail.value}
@@ -54,6 +81,9 @@ class SocketMessage:
     respond_calib = {'type': MessageType.response.value, 'status': MessageStatus.calib_ok.value}
     respond_copy = {'type': MessageType.response.value, 'status': MessageStatus.copy_ok.value}
     respond_copy_fail = {'type': MessageType.response.value, 'status': MessageStatus.copy_fail.value}
+    respond_transfer = {'type': MessageType.response.value, 'status': MessageStatus.transfer_ready.value}
+    respond_transfer_fail = {'type': MessageType.response.value, 'status': MessageStatus.transfer_fail.value}
+    respond_read = {'type': MessageType.response.value, 'status': MessageStatus.read_ready.value}
     client_disconnected = {'type': MessageType.disconnected.value}
 
     def __init__(self):
@@ -63,8 +93,10 @@ class SocketMessage:
         self._daq_setting_file = ''
         self._basler_setting_file = ''
         self._pulse_lag = 0
+        self._trigger = None
         self.start_daq = {'type': MessageType.start_daq.value, 'session_id': self._session_id,
-                          'setting_file': self._daq_setting_file}
+                          'setting_file': self._daq_setting_file, 'trigger': self._trigger,
+                          'session_path': self._session_path}
         self.stop_daq = {'type': MessageType.stop_daq.value}
         self.start_daq_pulses = {'type': MessageType.start_daq_pulses.value, 'fps': self._fps,
                                  'pulse_lag': self._pulse_lag}
@@ -72,6 +104,7 @@ class SocketMessage:
         self.start_daq_viewing = {'type': MessageType.start_daq_viewing.value, 'session_id': self._session_id,
                                   'setting_file': self._daq_setting_file}
         self.poll_status = {'type': MessageType.poll_status.value}
+        self.subscribe_status = {'type': MessageType.subscribe_status.value}
 
         self.start_video_rec = {'type': MessageType.start_video_rec.value, 'session_id': self._session_id,
                                 'setting_file': self._basler_setting_file, 'frame_rate': self._fps}
@@ -85,6 +118,7 @@ class SocketMessage:
         self.copy_files = {'type': MessageType.copy_files.value, 'session_id': self._session_id,
                                      'session_path': self._session_path}
         self.purge_files = {'type': MessageType.purge_files.value, 'session_id': self._session_id}
+        self.transfer_files = {'type': MessageType.transfer_files.value, 'session_id': self._session_id}
 
     @property
     def pulse_lag(self):
@@ -95,6 +129,16 @@ class SocketMessage:
         self._pulse_lag = value
         self.update_messages()
 
+    @property
+    def trigger(self):
+        return self._trigger
+
+    @trigger.setter
+    def trigger(self, value: (bool, None)):
+        """True arms the daq to start recording on the external trigger, None keeps the setting file"""
+        self._trigger = value
+        self.update_messages()
+
     @property
     def session_id(self):
         return self._session_id
@@ -141,7 +185,8 @@ class SocketMessage:
         self.update_messages()
 
     def update_messages(self):
-        self.start_daq.update(**{'session_id': self.session_id, 'setting_file': self.daq_setting_file})
+        self.start_daq.update(**{'session_id': self.session_id, 'setting_file': self.daq_setting_file,
+                                 'trigger': self.trigger, 'session_path': self._session_path})
         self.start_daq_viewing.update(**{'session_id': self._session_id,
                                          'setting_file': self.daq_setting_file})
         self.start_daq_pulses.update(**{'fps': self.fps, 'pulse_lag': self.pulse_lag})
@@ -152,6 +197,40 @@ class SocketMessage:
         self.start_video_calibrec.update(**{'session_id': 'calibration', 'setting_file': self.basler_setting_file})
         self.copy_files.update(**{'session_id': self.session_id, 'session_path': self._session_path})
         self.purge_files.update(**{'session_id': self._session_id})
+        self.transfer_files.update(**{'session_id': self._session_id})
+
+
+class MessageFramer:
+    """
+    splits a byte stream into delimited messages, bytes after the last delimiter are kept for the next feed
+    """
+
+    def __init__(self, delimiter: bytes = b'\n'):
+        self.delimiter = delimiter
+        self.buffer = bytearray()
+        self.messages = deque()
+
+    def feed(self, data: bytes):
+        # only the new bytes (and the delimiter overlap) are searched
+        search_start = max(len(self.buffer) - len(self.delimiter) + 1, 0)
+        self.buffer += data
+        message_start = 0
+        while True:
+            end = self.buffer.find(self.delimiter, search_start)
+            if end == -1:
+                break
+            self.messages.append(bytes(self.buffer[message_start:end]))
+            message_start = search_start = end + len(self.delimiter)
+        if message_start:
+            del self.buffer[:message_start]
+
+    def pop(self) -> (bytes, None):
+        return self.messages.popleft() if self.messages else None
+
+    def pop_all(self) -> list:
+        messages = list(self.messages)
+        self.messages.clear()
+        return messages
 
 
 class SocketComm:
@@ -180,6 +259,7 @@ class SocketComm:
         self.log = logging.getLogger(f"SocketComm_{self.type}")
         self.log.setLevel(logging.DEBUG)
         self.message_time = time.monotonic()
+        self.framer = MessageFramer(b'\n')
 
     def create_socket(self):
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -273,9 +353,22 @@ class SocketComm:
             message = None
         return message
 
+    def read_json_messages(self) -> list:
+        """returns all complete messages which arrived so far, reading the socket in large blocks"""
+        if not self.framer.messages:
+            if self._fill_framer() == -1:
+                return [SocketMessage.client_disconnected]
+        messages = []
+        for message in self.framer.pop_all():
+            try:
+                messages.append(json.loads(message.decode()))
+            except json.decoder.JSONDecodeError:
+                self.log.warning(f'message decoding failed: {message}')
+        return messages
+
     def read_json_message_fast(self) -> dict:
         try:
-            message = self._recv(1024)
+            message = self._recv_until(b'\n')
             if message == -1:
                 return SocketMessage.client_disconnected
             if message is not None:
@@ -332,21 +425,31 @@ class SocketComm:
             self.log.warning("Client disconnected")
             return -1
 
+    def _fill_framer(self) -> (int, None):
+        """reads what is available (up to the socket timeout) into the framer, returns -1 if disconnected"""
+        data = self._recv(RECV_SIZE)
+        if data == -1 or data == b'':
+            if data == b'':
+                self.log.warning("Client disconnected")
+            return -1
+        if data is not None:
+            self.framer.feed(data)
+        return None
+
     def _recv_until(self, delimiter) -> bytes:
-        data = b''
-        try:
-            if self.use_ssl:
-                while not data.endswith(delimiter):
-                    data += self.ssl_sock.recv(1)
-            else:
-                while not data.endswith(delimiter):
-                    data += self.sock.recv(1)
-        except socket.timeout:
-            data = None
-        except ConnectionResetError:
-            self.log.warning("Client disconnected")
-            data = -1
-        return data
+        """returns the next message without the delimiter, None if none arrived before the timeout"""
+        if delimiter != self.framer.delimiter:
+            self.framer = MessageFramer(delimiter)
+        while not self.framer.messages:
+            data = self._recv(RECV_SIZE)
+            if data == -1 or data == b'':
+                if data == b'':
+                    self.log.warning("Client disconnected")
+                return -1
+            if data is None:
+                return None
+            self.framer.feed(data)
+        return self.framer.pop()
 
     def _recv_all(self):
         data = b''
@@ -365,10 +468,644 @@ class SocketComm:
         return data
 
 
+class ControlServer:
+    """
+    asyncio control server running on its own thread, several clients can be connected at once.
+    Every received json line is passed right away to on_message(message, client_id), which is called from the
+    server thread (emit a Qt signal there to get to the GUI thread). Clients sending subscribe_status get every
+    status passed to push_status. Offers the interface of a SocketComm server used by the GUI
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8800, on_message=None):
+        self.host = host
+        self.port = port
+        self.on_message = on_message
+        self.loop = None
+        self.thread = None
+        self.stop_future = None
+        self.started = threading.Event()
+        self.clients = {}  # client id: (stream writer, address)
+        self.status_clients = set()
+        self.next_client_id = 0
+        self.reply_to = None  # client a reply without client_id goes to, the sender of the handled command
+        self.last_status = None
+        self.log = logging.getLogger('ControlServer')
+        self.log.setLevel(logging.DEBUG)
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.clients)
+
+    @property
+    def addr(self) -> list:
+        return [address for _, address in self.clients.values()]
+
+    @property
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, timeout: float = 5):
+        self.started.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait(timeout)
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    async def serve(self):
+        self.stop_future = self.loop.create_future()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port, reuse_address=True)
+        self.log.info(f"Control server listening on {self.host}:{self.port}")
+        self.started.set()
+        async with server:
+            await self.stop_future
+        for writer, _ in list(self.clients.values()):
+            writer.close()
+        self.clients = {}
+        self.status_clients = set()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client_id = self.next_client_id
+        self.next_client_id += 1
+        address = writer.get_extra_info('peername')
+        self.clients[client_id] = (writer, address)
+        self.log.info(f"Connected to {address}")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line.decode())
+                except json.decoder.JSONDecodeError:
+                    self.log.warning(f"message decoding failed: {line}")
+                    continue
+                if message.get('type') == MessageType.subscribe_status.value:
+                    self.status_clients.add(client_id)
+                    if self.last_status is not None:
+                        self._write([client_id], self.last_status)
+                elif self.on_message is not None:
+                    self.on_message(message, client_id)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.pop(client_id, None)
+            self.status_clients.discard(client_id)
+            writer.close()
+            self.log.info(f"Client {address} disconnected")
+            if not self.clients and self.on_message is not None and not self.stop_future.done():
+                self.on_message(SocketMessage.client_disconnected, client_id)
+
+    def _write(self, client_ids, data: bytes):
+        for client_id in client_ids:
+            if client_id in self.clients:
+                self.clients[client_id][0].write(data)
+
+    def send_json_message(self, message: dict, client_id: (int, None) = None):
+        """sends a message from any thread, to the client of the handled command unless a client_id is given"""
+        if not self.is_running:
+            return
+        client_id = self.reply_to if client_id is None else client_id
+        client_ids = list(self.clients) if client_id is None else [client_id]
+        data = json.dumps(message).encode()
+        self.log.info(f"Sending message {data}")
+        self.loop.call_soon_threadsafe(self._write, client_ids, data + b'\n')
+
+    def push_status(self, message: dict):
+        """sends a changed status to all subscribed clients"""
+        data = json.dumps(message).encode() + b'\n'
+        if data == self.last_status or not self.is_running:
+            return
+        self.last_status = data
+        self.loop.call_soon_threadsafe(lambda: self._write(list(self.status_clients), data))
+
+    def close_socket(self):
+        if self.is_running:
+            self.loop.call_soon_threadsafe(lambda: self.stop_future.done() or self.stop_future.set_result(None))
+            self.thread.join()
+        self.last_status = None
+
+    def threaded_accept_connection(self):
+        """starts the server, clients are accepted by its thread"""
+        if not self.is_running:
+            self.start()
+
+    def stop_waiting_for_connection(self):
+        if not self.connected:
+            self.close_socket()
+
+
+class StreamFrameType(Enum):
+    info = 0  # json payload with channel names and rate, sent on subscription and at the start of every scan
+    data = 1  # interleaved little-endian float64 samples
+
+
+class StreamFlag:
+    gap = 1  # frames were dropped before this one
+
+
+def pack_stream_frame(frame_type: StreamFrameType, payload: bytes, first_sample: int = 0, num_samples: int = 0,
+                      num_channels: int = 0, flags: int = 0) -> bytes:
+    return STREAM_FRAME_HEADER.pack(STREAM_MAGIC, frame_type.value, flags, num_channels, first_sample,
+                                    num_samples, len(payload)) + payload
+
+
+class StreamSubscriber:
+    """
+    a client of the StreamServer, with its own channel selection, decimation and a bounded frame queue
+    which is sent by its own thread. If the queue is full, frames are dropped (drop_policy 'oldest' or 'newest')
+    """
+
+    def __init__(self, sock: socket.socket, addr, channels: (list, None) = None, decimation: int = 1,
+                 drop_policy: str = 'oldest', queue_size: int = STREAM_QUEUE_SIZE):
+        self.sock = sock
+        self.addr = addr
+        self.channels = channels
+        self.decimation = max(int(decimation), 1)
+        self.drop_policy = drop_policy
+        self.frames = queue.Queue(queue_size)
+        self.column_indices = []
+        self.dropped_frames = 0
+        self.gap = False
+        self.is_connected = True
+        self.thread = threading.Thread(target=self.send_frames, daemon=True)
+        self.log = logging.getLogger('StreamServer')
+
+    def select_columns(self, channel_names: list) -> list:
+        if self.channels is None:
+            self.column_indices = list(range(len(channel_names)))
+        else:
+            self.column_indices = [channel_names.index(name) for name in self.channels if name in channel_names]
+        return [channel_names[idx] for idx in self.column_indices]
+
+    def put(self, frame: tuple):
+        """queues a frame without ever blocking the acquisition"""
+        try:
+            self.frames.put_nowait(frame)
+            return
+        except queue.Full:
+            self.dropped_frames += 1
+            self.gap = True
+        if self.drop_policy == 'oldest':
+            try:
+                self.frames.get_nowait()
+                self.frames.put_nowait(frame)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def pack_data(self, first_sample: int, rows: np.ndarray) -> (bytes, None):
+        """picks the channels and every decimation-th sample, counted from the start of the scan"""
+        offset = -first_sample % self.decimation
+        rows = rows[offset::self.decimation, self.column_indices]
+        if rows.shape[0] == 0:
+            return None
+        flags = StreamFlag.gap if self.gap else 0
+        self.gap = False
+        return pack_stream_frame(StreamFrameType.data, rows.astype('<f8').tobytes(),
+                                 (first_sample + offset) // self.decimation, rows.shape[0], rows.shape[1], flags)
+
+    def send_frames(self):
+        while self.is_connected:
+            try:
+                frame_type, first_sample, content = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if frame_type == StreamFrameType.info:
+                info = dict(content, channel_names=self.select_columns(content['channel_names']),
+                            decimation=self.decimation, sampling_rate=content['sampling_rate'] / self.decimation)
+                data = pack_stream_frame(StreamFrameType.info, json.dumps(info).encode())
+            else:
+                data = self.pack_data(first_sample, content)
+                if data is None:
+                    continue
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.log.info(f"Stream subscriber {self.addr} disconnected")
+                self.close()
+
+    def close(self):
+        self.is_connected = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class StreamServer:
+    """
+    Streams the live data in binary frames (STREAM_FRAME_HEADER + payload) to any number of TCP subscribers.
+    A subscriber sends one json line after connecting, e.g. {"channels": ["NP_R"], "decimation": 10,
+    "drop_policy": "oldest"}, and receives an info frame followed by data frames. Publishing only queues the
+    chunk per subscriber, so slow subscribers lose frames instead of slowing down the acquisition
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8801):
+        self.host = host
+        self.port = port
+        self.subscribers = []
+        self.stream_info = None
+        self.sample_count = 0
+        self.leftover = np.zeros(0)
+        self.num_channels = 1
+        self._sock = None
+        self.stop_event = threading.Event()
+        self.acception_thread = None
+        self.lock = threading.Lock()
+        self.log = logging.getLogger('StreamServer')
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.listen()
+        self.stop_event.clear()
+        self.acception_thread = threading.Thread(target=self.accept_subscribers, daemon=True)
+        self.acception_thread.start()
+        self.log.info(f"Streaming live data on {self.host}:{self.port}")
+
+    def accept_subscribers(self):
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select([self._sock], [], [], 0.1)
+            if not ready:
+                continue
+            sock, addr = self._sock.accept()
+            try:
+                sock.settimeout(2)
+                request = json.loads(sock.makefile('rb').readline().decode() or '{}')
+                sock.settimeout(None)
+            except (OSError, json.decoder.JSONDecodeError):
+                self.log.warning(f"No valid subscription from {addr}")
+                sock.close()
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = StreamSubscriber(sock, addr, request.get('channels'), request.get('decimation', 1),
+                                          request.get('drop_policy', 'oldest'))
+            with self.lock:
+                if self.stream_info is not None:
+                    subscriber.put((StreamFrameType.info, 0, self.stream_info))
+                self.subscribers.append(subscriber)
+            subscriber.thread.start()
+            self.log.info(f"Stream subscriber {addr} connected")
+
+    def start_scan(self, channel_names: list, sampling_rate: float):
+        """announces a new scan, sample indices start at 0 again"""
+        with self.lock:
+            self.stream_info = {'channel_names': list(channel_names), 'sampling_rate': sampling_rate}
+            self.num_channels = len(channel_names)
+            self.sample_count = 0
+            self.leftover = np.zeros(0)
+            for subscriber in self.subscribers:
+                subscriber.put((StreamFrameType.info, 0, self.stream_info))
+
+    def publish(self, values: np.ndarray):
+        """
+        hands a chunk of interleaved values to the subscribers, only complete scans are sent,
+        a partial one is kept for the next chunk
+        """
+        with self.lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber.is_connected]
+            if not self.subscribers:
+                # the partial scan is kept as it is, a subscriber joining later gets it completed
+                num_leftover = (self.leftover.size + values.size) % self.num_channels
+                self.sample_count += (self.leftover.size + values.size) // self.num_channels
+                self.leftover = np.concatenate((self.leftover, values[-num_leftover:]))[-num_leftover:] \
+                    if num_leftover else np.zeros(0)
+                return
+            values = np.concatenate((self.leftover, values))
+            num_values = values.size // self.num_channels * self.num_channels
+            self.leftover = values[num_values:]
+            rows = values[:num_values].reshape(-1, self.num_channels)
+            for subscriber in self.subscribers:
+                subscriber.put((StreamFrameType.data, self.sample_count, rows))
+            self.sample_count += rows.shape[0]
+
+    def stop(self):
+        self.stop_event.set()
+        if self.acception_thread is not None:
+            self.acception_thread.join()
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers = []
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class StreamClient:
+    """subscribes to a StreamServer and returns the received frames"""
+
+    def __init__(self, host: str = "localhost", port: int = 8801, channels: (list, None) = None,
+                 decimation: int = 1, drop_policy: str = 'oldest'):
+        self.sock = socket.create_connection((host, port))
+        self.sock.sendall(json.dumps({'channels': channels, 'decimation': decimation,
+                                      'drop_policy': drop_policy}).encode() + b'\n')
+        self.info = None
+        self.next_sample = None
+        self.missed_samples = 0
+
+    def _recv_exact(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Stream server closed the connection')
+            data += chunk
+        return bytes(data)
+
+    def read_frame(self) -> tuple:
+        """
+        returns the next data frame as (first sample, samples x channels), info frames are stored in self.info.
+        Samples are counted after decimation, missed_samples counts samples dropped by the server
+        """
+        while True:
+            magic, frame_type, flags, num_channels, first_sample, num_samples, payload_length = \
+                STREAM_FRAME_HEADER.unpack(self._recv_exact(STREAM_FRAME_HEADER.size))
+            if magic != STREAM_MAGIC:
+                raise ValueError('Lost the frame alignment of the stream')
+            payload = self._recv_exact(payload_length)
+            if frame_type == StreamFrameType.info.value:
+                self.info = json.loads(payload.decode())
+                self.next_sample = None
+                continue
+            if self.next_sample is not None and first_sample > self.next_sample:
+                self.missed_samples += first_sample - self.next_sample
+            self.next_sample = first_sample + num_samples
+            return first_sample, np.frombuffer(payload, '<f8').reshape(num_samples, num_channels)
+
+    def close(self):
+        self.sock.close()
+
+
+class FileTransferServer:
+    """
+    Sends finished recordings over a dedicated data connection, for clients which can not mount the session path.
+    A client sends one json line per file, {"file": "rec.bin", "offset": 0, "length": null}, and gets a json line
+    with file, size, offset, length and the checksum of the file up to offset + length, followed by the raw bytes
+    (os.sendfile, the data does not pass through user space). Only the files returned by get_files are served.
+    A window of a recording is requested with {"read": "rec.bin", "start": 2.5, "end": 4, "unit": "s",
+    "channels": ["Lick_spout"], "decimation": 1} and answered with a json line (read_range info and length) and
+    the samples as little-endian float64. get_read_files returns the recordings which can be read this way,
+    including the running one
+    """
+
+    def __init__(self, get_files, host: str = "localhost", port: int = 8802, get_read_files=None):
+        self.get_files = get_files
+        self.get_read_files = get_read_files or get_files
+        self.host = host
+        self.port = port
+        self._sock = None
+        self.stop_event = threading.Event()
+        self.acception_thread = None
+        self.checksums = {}  # (path, end, mtime): checksum, resumed transfers do not hash the file again
+        self.log = logging.getLogger('FileTransfer')
+
+    @property
+    def is_running(self) -> bool:
+        return self.acception_thread is not None and self.acception_thread.is_alive()
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.listen()
+        self.port = self._sock.getsockname()[1]
+        self.stop_event.clear()
+        self.acception_thread = threading.Thread(target=self.accept_clients, daemon=True)
+        self.acception_thread.start()
+        self.log.info(f"Serving recordings on {self.host}:{self.port}")
+
+    def accept_clients(self):
+        while not self.stop_event.is_set():
+            ready, _, _ = select.select([self._sock], [], [], 0.1)
+            if ready:
+                sock, addr = self._sock.accept()
+                threading.Thread(target=self.handle_client, args=(sock, addr), daemon=True).start()
+
+    def get_file_list(self, readable: bool = False) -> list:
+        file_names = self.get_read_files() if readable else self.get_files()
+        return [{'file': Path(file_name).name, 'size': Path(file_name).stat().st_size}
+                for file_name in file_names if file_name and Path(file_name).exists()]
+
+    def find_file(self, name: str, readable: bool = False) -> (Path, None):
+        for file_name in (self.get_read_files() if readable else self.get_files()):
+            if file_name and Path(file_name).name == name:
+                return Path(file_name)
+        return None
+
+    def get_checksum(self, file_name: Path, end: int) -> str:
+        key = (file_name, end, file_name.stat().st_mtime_ns)
+        if key not in self.checksums:
+            self.checksums[key] = file_checksum(file_name, end=end)
+        return self.checksums[key]
+
+    def handle_client(self, sock: socket.socket, addr):
+        self.log.info(f"Transfer client {addr} connected")
+        try:
+            with sock, sock.makefile('rb') as requests:
+                for line in requests:
+                    request = json.loads(line.decode())
+                    if 'read' in request:
+                        self.send_range(sock, request)
+                    else:
+                        self.send_file(sock, request)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            self.log.warning(f"Transfer to {addr} failed: {e}")
+        self.log.info(f"Transfer client {addr} disconnected")
+
+    def send_file(self, sock: socket.socket, request: dict):
+        file_name = self.find_file(request.get('file', ''))
+        if file_name is None:
+            sock.sendall(json.dumps({'file': request.get('file'), 'error': 'unknown file'}).encode() + b'\n')
+            return
+        size = file_name.stat().st_size
+        offset = min(max(int(request.get('offset') or 0), 0), size)
+        length = size - offset if request.get('length') is None else min(int(request['length']), size - offset)
+        header = {'file': file_name.name, 'size': size, 'offset': offset, 'length': length,
+                  'algorithm': CHECKSUM_ALGORITHM, 'checksum': self.get_checksum(file_name, offset + length)}
+        sock.sendall(json.dumps(header).encode() + b'\n')
+        self.log.info(f"Sending {length} bytes of {file_name} from {offset}")
+        with open(file_name, 'rb') as fi:
+            sent = 0
+            while sent < length:  # socket.sendfile uses os.sendfile where available
+                sent += sock.sendfile(fi, offset + sent, min(TRANSFER_BLOCK_SIZE, length - sent))
+
+    def send_range(self, sock: socket.socket, request: dict):
+        file_name = self.find_file(request['read'], readable=True)
+        if file_name is None:
+            sock.sendall(json.dumps({'read': request['read'], 'error': 'unknown file'}).encode() + b'\n')
+            return
+        try:
+            info, data = read_range(file_name, request.get('start', 0), request.get('end'),
+                                    request.get('unit', 'samples'), request.get('channels'),
+                                    request.get('decimation', 1))
+        except (ValueError, KeyError, OSError) as e:
+            sock.sendall(json.dumps({'read': request['read'], 'error': str(e)}).encode() + b'\n')
+            return
+        sock.sendall(json.dumps(dict(info, read=file_name.name, length=data.nbytes)).encode() + b'\n')
+        sock.sendall(data.data)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.acception_thread is not None:
+            self.acception_thread.join()
+            self.acception_thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class FileTransferClient:
+    """
+    downloads recordings from a FileTransferServer. An existing partial download is resumed from its size,
+    the complete file is verified against the checksum of the server
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8802):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        self.log = logging.getLogger('FileTransfer')
+
+    def download(self, file_name: str, destination: (str, Path), offset: (int, None) = None,
+                 length: (int, None) = None, progress=None) -> str:
+        """
+        writes file_name into the destination folder, returns the verified checksum.
+        progress(bytes_done, bytes_total) is called after every block
+        """
+        target = Path(destination) / file_name
+        if offset is None:
+            offset = target.stat().st_size if target.exists() else 0
+        self.sock.sendall(json.dumps({'file': file_name, 'offset': offset, 'length': length}).encode() + b'\n')
+        header = json.loads(self.reader.readline().decode() or '{}')
+        if 'error' in header or 'checksum' not in header:
+            raise IOError(f"Server can not send {file_name}: {header.get('error', 'connection closed')}")
+        offset = header['offset']
+        checksum = update_checksum(hashlib.new(header['algorithm']), target, offset) if offset else \
+            hashlib.new(header['algorithm'])
+        with open(target, 'r+b' if target.exists() else 'wb') as fi:
+            fi.seek(offset)
+            received = 0
+            while received < header['length']:
+                block = self.reader.read(min(TRANSFER_BLOCK_SIZE, header['length'] - received))
+                if not block:
+                    raise ConnectionError(f"Transfer of {file_name} stopped after {offset + received} bytes")
+                fi.write(block)
+                checksum.update(block)
+                received += len(block)
+                if progress is not None:
+                    progress(offset + received, offset + header['length'])
+            fi.truncate()
+        if checksum.hexdigest() != header['checksum']:
+            raise IOError(f"Checksum of {target} does not match {file_name}")
+        return header['checksum']
+
+    def read_range(self, file_name: str, start: float = 0, end: (float, None) = None, unit: str = 'samples',
+                   channels: (list, None) = None, decimation: int = 1) -> tuple:
+        """returns the info of the window and its samples (samples, channels), see recording_utils.read_range"""
+        self.sock.sendall(json.dumps({'read': file_name, 'start': start, 'end': end, 'unit': unit,
+                                      'channels': channels, 'decimation': decimation}).encode() + b'\n')
+        info = json.loads(self.reader.readline().decode() or '{}')
+        if 'error' in info or 'length' not in info:
+            raise IOError(f"Server can not read {file_name}: {info.get('error', 'connection closed')}")
+        payload = self.reader.read(info['length'])
+        if len(payload) < info['length']:
+            raise ConnectionError(f"Connection closed while reading {file_name}")
+        return info, np.frombuffer(payload, '<f8').reshape(info['num_samples'], len(info['channel_names']))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def request_data_connection(comm: SocketComm, message_type: MessageType, timeout: float = 30) -> dict:
+    """sends a command for the data connection and returns the response with its port and the files"""
+    comm.send_json_message({'type': message_type.value})
+    t_start = time.monotonic()
+    while True:
+        response = comm.read_json_message_fast()
+        if response is not None and response.get('type') == MessageType.response.value:
+            break
+        if response == SocketMessage.client_disconnected or time.monotonic() - t_start > timeout:
+            raise ConnectionError(f"Recorder did not answer {message_type.value}")
+    if 'port' not in response:
+        raise IOError(f"Recorder can not serve the recording: {response.get('error')}")
+    return response
+
+
+def download_recording(comm: SocketComm, destination: (str, Path), progress=None, timeout: float = 30) -> dict:
+    """
+    client side of transfer_files: asks the recorder for the files of the last recording and downloads them
+    over the data connection into destination, partial files of an interrupted download are resumed.
+    Returns the checksums of the files
+    """
+    response = request_data_connection(comm, MessageType.transfer_files, timeout)
+    Path(destination).mkdir(parents=True, exist_ok=True)
+    client = FileTransferClient(comm.host, response['port'])
+    try:
+        return {info['file']: client.download(info['file'], destination, progress=progress)
+                for info in response['files']}
+    finally:
+        client.close()
+
+
+def read_recording_range(comm: SocketComm, file_name: (str, None) = None, start: float = 0,
+                         end: (float, None) = None, unit: str = 's', channels: (list, None) = None,
+                         decimation: int = 1, timeout: float = 30) -> tuple:
+    """
+    client side of read_range: reads a window of a recording on the recorder, by default of the current
+    (or last) one, e.g. read_recording_range(comm, start=10, end=12, channels=['Lick_spout']).
+    Returns the info of the window and the samples (samples, channels)
+    """
+    response = request_data_connection(comm, MessageType.read_range, timeout)
+    if file_name is None:
+        file_name = next(info['file'] for info in response['files'] if info['file'].endswith('.bin'))
+    client = FileTransferClient(comm.host, response['port'])
+    try:
+        return client.read_range(file_name, start, end, unit, channels, decimation)
+    finally:
+        client.close()
+
+
+def benchmark_message_framing(num_messages: int = 100000) -> float:
+    """sends json status messages through a local socket pair and returns the parsed messages per second"""
+    server_sock, client_sock = socket.socketpair()
+    receiver = SocketComm('client')
+    receiver.sock = server_sock
+    receiver.sock.settimeout(1)
+    data = (json.dumps(SocketMessage.status_recording).encode() + b'\n') * num_messages
+    sender = threading.Thread(target=client_sock.sendall, args=(data,))
+    t_start = time.perf_counter()
+    sender.start()
+    received = 0
+    while received < num_messages:
+        messages = receiver.read_json_messages()
+        if messages == [SocketMessage.client_disconnected]:
+            break
+        received += len(messages)
+    duration = time.perf_counter() - t_start
+    sender.join()
+    server_sock.close()
+    client_sock.close()
+    return received / duration
+
+
 if __name__ == "__main__":
     import time
     import argparse
     import json
+    import sys
+
+    if '--benchmark' in sys.argv:
+        print(f"{benchmark_message_framing():0.0f} messages/s")
+        sys.exit()
     """
     parser = argparse.ArgumentParser(description='Socket communication test')
     parser.add_argument('--type', type=str, default='server', help='Socket type: client or server')
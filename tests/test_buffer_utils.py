@@ -0,0 +1,101 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from buffer_utils import LiveDataClient, SampleRing, SharedSampleRing
+
+
+def test_write_wraps_around():
+    ring = SampleRing(4, 2)
+    ring.write(np.arange(6))
+    ring.write(np.arange(6, 10))
+    assert ring.write_count == 10
+    np.testing.assert_array_equal(ring.buffer, [8, 9, 2, 3, 4, 5, 6, 7])
+    np.testing.assert_array_equal(ring.history(), np.arange(2, 10).reshape(-1, 2))
+
+
+def test_write_larger_than_capacity_keeps_newest():
+    ring = SampleRing(3, 2)
+    ring.write(np.arange(2))
+    ring.write(np.arange(2, 16))
+    np.testing.assert_array_equal(ring.history(), np.arange(10, 16).reshape(-1, 2))
+
+
+def test_read_values_of_overwritten_range_raises():
+    ring = SampleRing(3, 2)
+    ring.write(np.arange(10))
+    with pytest.raises(IndexError):
+        ring.read_values(0, 4)
+
+
+def test_read_values_into_out():
+    ring = SampleRing(3, 2)
+    ring.write(np.arange(10))
+    out = np.empty(ring.capacity)
+    values = ring.read_values(4, 10, out)
+    assert np.shares_memory(values, out)
+    np.testing.assert_array_equal(values, np.arange(4, 10))
+
+
+def test_read_new_returns_complete_scans_only():
+    ring = SampleRing(10, 3)
+    ring.write(np.arange(7))
+    rows, read_count = ring.read_new(0)
+    np.testing.assert_array_equal(rows, np.arange(6).reshape(-1, 3))
+    assert read_count == 6
+    ring.write(np.arange(7, 12))
+    rows, read_count = ring.read_new(read_count)
+    np.testing.assert_array_equal(rows, np.arange(6, 12).reshape(-1, 3))
+
+
+def test_read_new_skips_overwritten_scans():
+    ring = SampleRing(4, 2)
+    ring.write(np.arange(20))
+    rows, read_count = ring.read_new(0)
+    np.testing.assert_array_equal(rows, np.arange(12, 20).reshape(-1, 2))
+    assert read_count == 20
+
+
+def test_read_new_max_rows():
+    ring = SampleRing(10, 2)
+    ring.write(np.arange(12))
+    rows, read_count = ring.read_new(0, max_rows=2)
+    np.testing.assert_array_equal(rows, np.arange(4).reshape(-1, 2))
+    assert read_count == 4
+
+
+def test_history_end_count():
+    ring = SampleRing(4, 2)
+    ring.write(np.arange(10))
+    np.testing.assert_array_equal(ring.history(end_count=6), np.arange(2, 6).reshape(-1, 2))
+
+
+def test_shared_ring_is_seen_by_attached_reader():
+    name = f"mcc_test_{uuid.uuid4().hex[:8]}"
+    ring = SharedSampleRing(5, 2, name=name, metadata={'channel_names': ['a', 'b'], 'sampling_rate': 100})
+    try:
+        reader = SharedSampleRing.attach(name)
+        assert (reader.num_channels, reader.capacity) == (2, 10)
+        assert reader.metadata['channel_names'] == ['a', 'b']
+        ring.write(np.arange(6))
+        rows, _ = reader.read_new(0)
+        np.testing.assert_array_equal(rows, np.arange(6).reshape(-1, 2))
+        assert reader.is_open
+        reader.close()
+    finally:
+        ring.close()
+
+
+def test_live_data_client():
+    name = f"mcc_test_{uuid.uuid4().hex[:8]}"
+    ring = SharedSampleRing(5, 2, name=name, metadata={'channel_names': ['a', 'b'], 'sampling_rate': 100})
+    try:
+        client = LiveDataClient(name)
+        ring.write(np.arange(14))
+        np.testing.assert_array_equal(client.read_latest(2), [[10, 11], [12, 13]])
+        np.testing.assert_array_equal(client.read_latest(2, ['b']), [[11], [13]])
+        np.testing.assert_array_equal(client.read_new(['a']), [[4], [6], [8], [10], [12]])
+        client.close()
+    finally:
+        ring.close()
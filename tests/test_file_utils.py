@@ -0,0 +1,40 @@
+import threading
+
+from file_utils import CopyWorker, FileMirror
+
+
+def run_copy(*submit_args) -> tuple:
+    done = threading.Event()
+    result = []
+
+    def on_done(success, checksums, error):
+        result.extend((success, checksums, error))
+        done.set()
+
+    worker = CopyWorker(on_done=on_done)
+    worker.submit(*submit_args)
+    assert done.wait(10)
+    return tuple(result)
+
+
+def test_copy_finishes_mirror_in_destination(tmp_path):
+    src = tmp_path / 'rec.bin'
+    src.write_bytes(bytes(range(256)) * 100)
+    mirror = FileMirror(lambda: [src], tmp_path / 'session', interval=60)
+    success, checksums, error = run_copy([src], tmp_path / 'session', mirror)
+    assert success and error is None
+    assert (tmp_path / 'session' / 'rec.bin').read_bytes() == src.read_bytes()
+    assert not mirror.thread.is_alive()
+
+
+def test_copy_elsewhere_discards_mirror(tmp_path):
+    src = tmp_path / 'rec.bin'
+    src.write_bytes(bytes(range(256)) * 100)
+    mirror = FileMirror(lambda: [src], tmp_path / 'old_session', interval=60)
+    mirror.mirror_round()
+    assert (tmp_path / 'old_session' / 'rec.bin').exists()
+    success, checksums, error = run_copy([src], tmp_path / 'session', mirror)
+    assert success
+    assert (tmp_path / 'session' / 'rec.bin').read_bytes() == src.read_bytes()
+    assert not (tmp_path / 'old_session' / 'rec.bin').exists()
+    assert not mirror.thread.is_alive()
@@ -0,0 +1,86 @@
+import pytest
+
+uldaq = pytest.importorskip('uldaq')
+
+from MCC_Board_linux import MCCBoard  # noqa: E402
+from settings_utils import MCC_settings  # noqa: E402
+
+
+class FakeDevice:
+    """records the configuration calls of the dio and counter subsystems"""
+
+    def __init__(self):
+        self.calls = []
+
+    def get_dio_device(self):
+        return self
+
+    def get_ctr_device(self):
+        return self
+
+    def d_config_port(self, *args):
+        self.calls.append(('d_config_port',) + args)
+
+    def c_config_scan(self, *args):
+        self.calls.append(('c_config_scan',) + args)
+
+
+def make_board() -> MCCBoard:
+    """a board with a daq input subsystem, one 8 bit port and three counters of which two decode encoders"""
+    board = MCCBoard()
+    board.supports_queue = True
+    board.supports_daqi = True
+    board.dio_ports = [uldaq.DigitalPortType.AUXPORT]
+    board.dio_port_bits = [8]
+    board.dev_counters = [0, 1, 2]
+    board.encoder_counters = [0, 1]
+    board.input_mode = uldaq.AiInputMode.SINGLE_ENDED
+    board.ai_range = uldaq.Range.BIP10VOLTS
+    board.daq_device = FakeDevice()
+    return board
+
+
+def make_settings() -> MCC_settings:
+    settings = MCC_settings()
+    settings.channel_list = [{'id': 0, 'name': 'sync', 'active': True},
+                             {'id': 1, 'name': 'off', 'active': False},
+                             {'id': 3, 'name': 'lick', 'active': True},
+                             {'id': 16, 'name': 'camera', 'active': True, 'source': 'dio', 'bit': 2}]
+    settings.scan_counters = True
+    settings.encoder_channels = [{'counter': 1, 'name': 'wheel', 'counts_per_rev': 1024, 'mode': 'X2'}]
+    return settings
+
+
+def test_scan_columns_of_combined_scan():
+    board = make_board()
+    board.set_scan_columns(make_settings())
+    assert board.scan_channels == [0, 3]
+    assert board.scan_columns == ['sync', 'lick', 'DIO_AUXPORT', 'CTR0', 'wheel', 'CTR2']
+    assert board.counter_columns == [3, 4, 5]
+    assert board.num_channels == 6
+
+
+def test_scan_index_and_channel_bit():
+    board = make_board()
+    board.set_scan_columns(make_settings())
+    assert board.get_scan_index(3) == 1
+    assert board.get_scan_index(16) == 2  # the port column the bit is unpacked from
+    assert board.get_scan_index(1) is None
+    assert board.get_channel_bit(16) == 2
+    assert board.get_channel_bit(0) is None
+
+
+def test_daqi_descriptors():
+    board = make_board()
+    board.set_scan_columns(make_settings())
+    board.create_daqi_descriptors()
+    descriptors = [(descriptor.channel, descriptor.type) for descriptor in board.daqi_descriptors]
+    assert descriptors == [(0, uldaq.DaqInChanType.ANALOG_SE), (3, uldaq.DaqInChanType.ANALOG_SE),
+                           (uldaq.DigitalPortType.AUXPORT, uldaq.DaqInChanType.DIGITAL),
+                           (0, uldaq.DaqInChanType.CTR32), (1, uldaq.DaqInChanType.CTR32),
+                           (2, uldaq.DaqInChanType.CTR32)]
+    calls = board.daq_device.calls
+    assert calls[0] == ('d_config_port', uldaq.DigitalPortType.AUXPORT, uldaq.DigitalDirection.INPUT)
+    # only the encoder counter is configured, plain counters keep counting edges
+    assert [call[:4] for call in calls[1:]] == [('c_config_scan', 1, uldaq.CounterMeasurementType.ENCODER,
+                                                 uldaq.CounterMeasurementMode.ENCODER_X2)]
@@ -0,0 +1,151 @@
+import json
+
+import numpy as np
+import pytest
+
+from buffer_utils import SampleRing
+from recording_utils import (RecordingSink, fit_clock_table, get_clock_file_name, get_manifest_name,
+                             get_recording_segments, map_segment, read_clock_table, read_range, read_trailer,
+                             unwrap_counter)
+
+
+def make_header(num_channels: int) -> bytes:
+    return json.dumps({'num_channels': num_channels, 'sampling_rate': 1000,
+                       'scan_columns': [f"CH_{ch_id}" for ch_id in range(num_channels)]}).encode()
+
+
+def test_attach_with_chunk_larger_than_history_ring(tmp_path):
+    """the board hands the chunk to the sink before it goes into the history ring"""
+    num_channels, ring_rows, chunk_rows = 2, 10, 50
+    ring = SampleRing(ring_rows, num_channels)
+    values = np.arange(4 * chunk_rows * num_channels, dtype=float)
+    chunks = values.reshape(4, -1)
+    sink = None
+    for chunk_index, chunk in enumerate(chunks):
+        chunk_start_count = chunk_index * chunk.size
+        if chunk_index == 2:
+            sink = RecordingSink(tmp_path / 'rec.bin', make_header(num_channels), num_channels)
+        if sink is not None:
+            if not sink.is_open:
+                sink.open(chunk_start_count, ring)
+            sink.write(chunk_start_count, chunk)
+        ring.write(chunk)
+    sink.close()
+
+    header, data = map_segment(tmp_path / 'rec.bin')
+    start = 2 * chunks.shape[1]
+    assert header['pretrigger_samples'] == ring_rows
+    np.testing.assert_array_equal(data.ravel(), values[start - ring_rows * num_channels:])
+
+
+def test_history_is_written_before_the_recording(tmp_path):
+    history = np.arange(6, dtype=float).reshape(-1, 2)
+    sink = RecordingSink(tmp_path / 'rec.bin', make_header(2), 2, history=history)
+    sink.open(0)
+    sink.write(0, np.arange(6, 10, dtype=float))
+    sink.close()
+    header, data = map_segment(tmp_path / 'rec.bin')
+    assert header['pretrigger_samples'] == 3
+    np.testing.assert_array_equal(data.ravel(), np.arange(10))
+
+
+def test_attach_mid_chunk_starts_with_next_complete_scan(tmp_path):
+    sink = RecordingSink(tmp_path / 'rec.bin', make_header(2), 2)
+    sink.open(5)
+    sink.write(5, np.arange(5, 11, dtype=float))
+    sink.close()
+    header, data = map_segment(tmp_path / 'rec.bin')
+    assert header['recording_start_sample'] == 3
+    np.testing.assert_array_equal(data, [[6, 7], [8, 9]])
+
+
+def test_segments_and_manifest(tmp_path):
+    file_name = tmp_path / 'rec.bin'
+    sink = RecordingSink(file_name, make_header(2), 2, segment_samples=4)
+    sink.open(0)
+    for start in range(0, 20, 6):
+        sink.write(start, np.arange(start, min(start + 6, 20), dtype=float))
+    sink.close()
+
+    segments = get_recording_segments(file_name)
+    assert [segment.name for segment in segments] == ['rec.bin', 'rec_seg001.bin', 'rec_seg002.bin']
+    with open(get_manifest_name(file_name)) as fi:
+        manifest = json.load(fi)
+    assert manifest['num_samples'] == 10
+    assert [segment['num_samples'] for segment in manifest['segments']] == [4, 4, 2]
+    header, data = map_segment(segments[1])
+    assert header['segment_start_sample'] == 4
+    np.testing.assert_array_equal(data.ravel(), np.arange(8, 16))
+    assert sink.file_names == segments + [get_manifest_name(file_name), get_clock_file_name(file_name)]
+
+
+def test_read_range_across_segments(tmp_path):
+    file_name = tmp_path / 'rec.bin'
+    sink = RecordingSink(file_name, make_header(2), 2, segment_samples=4)
+    sink.open(0)
+    sink.write(0, np.arange(20, dtype=float))
+    sink.close()
+    info, data = read_range(file_name, 3, 9)
+    assert info['first_sample'] == 3 and info['num_samples'] == 6
+    np.testing.assert_array_equal(data, np.arange(6, 18).reshape(-1, 2))
+    info, data = read_range(file_name, 1, None, unit='samples', decimation=3)
+    np.testing.assert_array_equal(data[:, 0], [2, 8, 14])
+
+
+def test_clock_table_is_written_as_trailer(tmp_path):
+    sink = RecordingSink(tmp_path / 'rec.bin', make_header(2), 2)
+    sink.open(4)
+    sink.write(4, np.arange(4, 12, dtype=float))
+    sink.add_clock_point(5, 1000, 2000)
+    sink.close()
+    with open(tmp_path / 'rec.bin', 'rb') as fi:
+        trailer, data_end = read_trailer(fi)
+    # scan 5 of the board is the 4th sample of the recording, which started at scan 2
+    assert trailer == {'clock_table': [[3, 1000, 2000]]}
+    header, data = map_segment(tmp_path / 'rec.bin')
+    assert data.shape == (4, 2)
+
+
+def test_clock_points_are_in_the_clock_file_before_the_segment_is_closed(tmp_path):
+    sink = RecordingSink(tmp_path / 'rec.bin', make_header(2), 2, segment_samples=4)
+    sink.open(0)
+    sink.write(0, np.arange(12, dtype=float))
+    sink.add_clock_point(1, 1000, 2000)
+    sink.add_clock_point(5, 3000, 4000)
+    # the recording is not closed, as after a crash
+    assert read_clock_table(tmp_path / 'rec.bin') == [[1, 1000, 2000], [5, 3000, 4000]]
+    with open(get_clock_file_name(tmp_path / 'rec.bin'), 'a') as fi:
+        fi.write('[9, 50')  # cut off
+    assert len(read_clock_table(tmp_path / 'rec.bin')) == 2
+    sink.close()
+
+
+def test_map_segment_of_file_being_written(tmp_path):
+    sink = RecordingSink(tmp_path / 'rec.bin', make_header(2), 2)
+    sink.open(0)
+    sink.write(0, np.arange(7, dtype=float))
+    sink.fi.flush()
+    _, data = map_segment(tmp_path / 'rec.bin')
+    np.testing.assert_array_equal(data, np.arange(6).reshape(-1, 2))
+    sink.close()
+
+
+def test_unwrap_counter():
+    counts = np.array([2 ** 32 - 2, 2 ** 32 - 1, 0, 1, 0, 2 ** 32 - 1], dtype=np.uint32)
+    np.testing.assert_array_equal(unwrap_counter(counts), [2 ** 32 - 2, 2 ** 32 - 1, 2 ** 32, 2 ** 32 + 1, 2 ** 32,
+                                                           2 ** 32 - 1])
+    assert unwrap_counter([]).size == 0
+
+
+def test_fit_clock_table():
+    rate = 1000.0
+    actual_rate = rate * (1 + 50e-6)  # the board runs 50 ppm fast
+    samples = np.arange(0, 10000, 1000)
+    monotonic_ns = (samples / actual_rate * 1e9).astype(np.int64) + 5 * 10 ** 9
+    time_ns = monotonic_ns + 1_700_000_000 * 10 ** 9
+    fit = fit_clock_table(np.column_stack((samples, monotonic_ns, time_ns)), rate)
+    assert fit['fitted_rate'] == pytest.approx(actual_rate, rel=1e-9)
+    assert fit['drift_ppm'] == pytest.approx(-50, abs=0.01)
+    assert fit['time_offset_ns'] == pytest.approx(time_ns[0], abs=1000)
+    with pytest.raises(ValueError):
+        fit_clock_table([[0, 0, 0]], rate)
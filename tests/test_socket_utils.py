@@ -0,0 +1,46 @@
+import numpy as np
+
+from socket_utils import MessageFramer, StreamServer
+
+
+def test_framer_joins_messages_split_across_feeds():
+    framer = MessageFramer()
+    framer.feed(b'{"type": "po')
+    assert framer.pop() is None
+    framer.feed(b'll"}\n{"a": 1}\n{"b"')
+    assert framer.pop_all() == [b'{"type": "poll"}', b'{"a": 1}']
+    framer.feed(b': 2}\n')
+    assert framer.pop() == b'{"b": 2}'
+    assert framer.pop() is None
+
+
+def test_framer_delimiter_split_across_feeds():
+    framer = MessageFramer(b'\r\n')
+    framer.feed(b'first\r')
+    assert framer.pop() is None
+    framer.feed(b'\nsecond\r\n\r\n')
+    assert framer.pop_all() == [b'first', b'second', b'']
+
+
+class FakeSubscriber:
+    is_connected = True
+
+    def __init__(self):
+        self.frames = []
+
+    def put(self, frame):
+        self.frames.append(frame)
+
+
+def test_stream_keeps_partial_scan_without_subscribers():
+    server = StreamServer()
+    server.start_scan(['a', 'b', 'c'], 100)
+    values = np.arange(20, dtype=float)
+    server.publish(values[:7])
+    server.publish(values[7:11])
+    subscriber = FakeSubscriber()
+    server.subscribers = [subscriber]
+    server.publish(values[11:20])
+    _, first_sample, rows = subscriber.frames[0]
+    assert first_sample == 3
+    np.testing.assert_array_equal(rows, values[9:18].reshape(-1, 3))